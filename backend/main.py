@@ -1,17 +1,33 @@
 # Save this code as 'main.py' in your project directory
-from fastapi import FastAPI, HTTPException
+import json
+import time
+import asyncio
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from db.query import doiEntered, vectorSearch, titledPaper
-from google.cloud import bigquery
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel
+from db.attributes import SearchFilter
+from db.query import (SEARCH_BACKENDS, TITLE_BACKENDS, TITLE_BACKEND, TITLE_POSITIONS, SEARCH_POSITION,
+                      DETAIL_FIELDS, PAPER_FIELDS, TITLE_FIELDS,
+                      get_client, get_citation_graph)
+from db.async_query import (doiEnteredAsync, vectorSearchAsync, vectorSearchBatchAsync, vectorSearchByEmbeddingAsync,
+                            titledPaperPageAsync, abstractsByDoiAsync, worksByOpenAlexIdAsync, run_blocking,
+                            run_cpu)
+from db.cache import TTLCache, AsyncCache
+from db.cursor import MAX_RESULT_DEPTH, InvalidCursor, decode_cursor, encode_cursor
+from db.openalex import RelatedWorksHydrator
+from db.query_encoder import QueryEncoder, normalize_query
+from db.telemetry import REQUEST_LATENCY, REQUESTS_IN_FLIGHT, configure_tracing, metrics_payload, stage
 # from db.connection import returnPaper  # Your function to query MongoDB
-import httpx  
-import asyncio
-import certifi
-import concurrent
 import urllib.parse
 import logging
+import os
+from typing import List, Optional
 
 app = FastAPI()
+configure_tracing()
 
 
 origins = [
@@ -25,92 +41,431 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+def _route_of(request: Request) -> str:
+    # label by route template, not by raw path, so every DOI does not become its own series
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = _route_of(request)
+    in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_flight.dec()
+        REQUEST_LATENCY.labels(endpoint, request.method, str(status)).observe(time.perf_counter() - start)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "3600"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def _new_cache():
+    return AsyncCache(TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, max_bytes=CACHE_MAX_BYTES))
+
+
+paper_cache = _new_cache()
+vector_cache = _new_cache()
+title_cache = _new_cache()
+semantic_cache = _new_cache()
+abstract_cache = _new_cache()
+
+# reads publication_year from EWORKS, run db.migrate_works before turning it on
+RELATED_WORKS_FROM_WORKS_TABLE = os.environ.get("RELATED_WORKS_FROM_WORKS_TABLE", "0") == "1"
+related_works = RelatedWorksHydrator(
+    works_lookup=worksByOpenAlexIdAsync if RELATED_WORKS_FROM_WORKS_TABLE else None,
 )
 
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+
+SEMANTIC_SEARCH_ENABLED = os.environ.get("SEMANTIC_SEARCH_ENABLED", "1") == "1"
+MAX_QUERY_LENGTH = 1000
+query_encoder = QueryEncoder(
+    quantize=os.environ.get("QUERY_ENCODER_QUANTIZE", "0") == "1",
+    max_batch_size=int(os.environ.get("QUERY_ENCODER_MAX_BATCH", "32")),
+    max_wait_ms=float(os.environ.get("QUERY_ENCODER_MAX_WAIT_MS", "2")),
+    cache_size=int(os.environ.get("QUERY_ENCODER_CACHE_SIZE", "10000")),
+)
+
+
+async def _load_query_encoder():
+    try:
+        await run_blocking(query_encoder.load)
+        logging.info("Query encoder loaded")
+    except Exception as e:
+        logging.error(f"Could not load the query encoder, semantic search stays unavailable: {e}", exc_info=True)
+
+
+@app.on_event("startup")
+async def load_query_encoder():
+    # loaded in the background so a slow or failing model load does not hold up the other
+    # endpoints; semantic search answers 503 until the encoder is ready
+    if SEMANTIC_SEARCH_ENABLED:
+        app.state.query_encoder_load = asyncio.create_task(_load_query_encoder())
+
+
+@app.on_event("shutdown")
+async def close_related_works_client():
+    await related_works.close()
+    await query_encoder.close()
+
+
+def _fields(fields: Optional[List[str]], known) -> Optional[tuple]:
+    """Projection requested with fields=a,b or repeated fields= parameters, None for all
+    fields. Sorted so the same projection is one cache entry however it was listed."""
+    if not fields:
+        return None
+    requested = {field.strip() for value in fields for field in value.split(",") if field.strip()}
+    unknown = requested - set(known)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}. "
+                                                    f"Known fields are {', '.join(known)}.")
+    return tuple(sorted(requested))
+
 
 @app.get("/paper_details/{doi:path}")
-async def get_paper_details(doi: str):
+async def get_paper_details(doi: str, fields: Optional[List[str]] = Query(None)):
+    fields = _fields(fields, [*DETAIL_FIELDS, "related_works_details"])
+    # related works are hydrated from the related_works ids, so asking for the details reads those
+    lookup_fields = None
+    if fields is not None:
+        lookup_fields = {f for f in fields if f in DETAIL_FIELDS}
+        if "related_works_details" in fields:
+            lookup_fields.add("related_works")
+        lookup_fields = tuple(sorted(lookup_fields))
 
-    main_paper = doiEntered(doi)
+    # key on the full DOI like the other endpoints, so doi.org/... and bare spellings share an entry;
+    # doiEntered adds the https://doi.org/ prefix itself
+    full_doi = _full_doi(doi)
+    with stage("paper_details.lookup"):
+        main_paper = await paper_cache.get_or_load((full_doi, lookup_fields), lambda: doiEnteredAsync(
+            full_doi[len("https://doi.org/"):], fields=lookup_fields))
     # This needs doiEntered as well
     if not main_paper:
         raise HTTPException(status_code=404, detail="Paper not found in the database.")
     
-    print('ented app.get method from streamlit app')
     paper = {
         "title": main_paper.get("title"),
         "author_ids": main_paper.get('author_ids'),
         "referenced_works": main_paper.get('referenced_works'),
         "oa_url": main_paper.get('oa_url'),
         "cited_by_count":main_paper.get("cited_by_count"),
+        "paper_id": main_paper.get("paper_id"),
         "authors": main_paper.get("authors", []),
         "abstract": main_paper.get("abstract", ""),
         "related_works": main_paper.get("related_works", [])
     }
-    print(paper['title'])
 
-    related_works_urls = paper.get('related_works', [])
     related_works_details = []
+    if fields is None or "related_works_details" in fields:
+        with stage("paper_details.related_works"):
+            related_works_details = await related_works.hydrate(paper.get('related_works') or [])
+    if fields is not None:
+        paper = {key: value for key, value in paper.items() if key in fields}
 
-    async with httpx.AsyncClient(verify=certifi.where()) as client:
+    # rendered here instead of by FastAPI so serialisation shows up as its own stage
+    with stage("paper_details.serialize"):
+        return JSONResponse(content=jsonable_encoder({
+            "paper": paper, 
+            "related_works": related_works_details
+        }))
 
-        tasks = []
-        for work_url in related_works_urls: 
-            api_url = work_url.replace("openalex.org/", "api.openalex.org/works/")
-            tasks.append(client.get(api_url))
-        
-        responses = await asyncio.gather(*tasks, return_exceptions=True)
-        for response in responses:
-            if isinstance(response, httpx.Response) and response.status_code == 200:
-                work_data = response.json()
-                if work_data.get('doi'):
-                    print(work_data.get('doi'))
-                    related_works_details.append({
-                        "title": work_data.get('title'),
-                        "doi": work_data.get('doi'),
-                        'publication_year': work_data.get('publication_year')
-                    })
+MAX_BATCH_DOIS = 1000
+MAX_ABSTRACT_DOIS = 100
 
-    return {
-        "paper": paper, 
-        "related_works": related_works_details
-    }
 
-@app.get("/vector_search/{doi:path}")
-async def get_vector_search(doi: str):
-    logging.info(f"Received request for vector search with raw DOI: {doi}")
-    
+def _full_doi(doi: str) -> str:
     if not doi.startswith("https://doi.org/"):
         if doi.startswith("doi.org/"):
-            full_doi = f"https://{doi}"
+            return f"https://{doi}"
+        return f"https://doi.org/{doi}"
+    return doi
+
+
+def _check_search_params(top_k: int, fraction: Optional[float], backend: Optional[str], max_top_k: int = 100):
+    if backend is not None and backend not in SEARCH_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown search backend '{backend}'.")
+    if not 0 < top_k <= max_top_k:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {max_top_k}.")
+    if fraction is not None and not 0 < fraction <= 1:
+        raise HTTPException(status_code=400, detail="fraction must be in (0, 1].")
+
+
+def _search_filter(year_from: Optional[int], year_to: Optional[int], min_citations: Optional[int],
+                   max_citations: Optional[int], oa_status: Optional[List[str]]) -> SearchFilter:
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_from must not be after year_to.")
+    if any(c is not None and c < 0 for c in (min_citations, max_citations)):
+        raise HTTPException(status_code=400, detail="Citation bounds must not be negative.")
+    if min_citations is not None and max_citations is not None and min_citations > max_citations:
+        raise HTTPException(status_code=400, detail="min_citations must not exceed max_citations.")
+    # sorted so the same filter is one cache entry however the statuses were listed
+    return SearchFilter(year_from=year_from, year_to=year_to, min_citations=min_citations,
+                        max_citations=max_citations, oa_status=tuple(sorted(set(oa_status or ()))))
+
+
+NDJSON = "application/x-ndjson"
+# a streamed response is fetched this many results at a time and may run to more of them
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", "20"))
+MAX_STREAM_RESULTS = 1000
+
+
+def _wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def _decode_cursor(cursor: Optional[str], scope: str, fields: dict) -> Optional[dict]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor, scope, fields)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}.")
+
+
+def _position_key(position: Optional[dict]) -> tuple:
+    return () if position is None else (json.dumps(position, sort_keys=True),)
+
+
+def _search_page_size(size: int, after: Optional[dict]) -> int:
+    # no page reaches past MAX_RESULT_DEPTH, see _next_search_position
+    return min(size, MAX_RESULT_DEPTH - (after["offset"] if after else 0))
+
+
+def _next_search_position(papers, top_k: int, after: Optional[dict]) -> Optional[dict]:
+    """Where the page after a vector search page starts, None if this one came back short
+    or reached MAX_RESULT_DEPTH."""
+    offset = (after["offset"] if after else 0) + len(papers)
+    if len(papers) < top_k or offset >= MAX_RESULT_DEPTH:
+        return None
+    last = papers[-1]
+    return {"distance": last["distance"], "doi": last["doi"], "offset": offset}
+
+
+def _page_response(papers, position: Optional[dict], scope: str) -> JSONResponse:
+    # the body stays a plain list, the cursor for the next page travels in a header
+    headers = {"X-Next-Cursor": encode_cursor(position, scope)} if position is not None else None
+    return JSONResponse(content=jsonable_encoder(papers), headers=headers)
+
+
+def _stream_response(fetch_page, position: Optional[dict], total: int, scope: str) -> StreamingResponse:
+    """NDJSON of up to `total` results, one per line, ending in a {"next_cursor"} line.
+    Results are fetched STREAM_PAGE_SIZE at a time with `fetch_page(position, size)` ->
+    (papers, next position), and each page is written out as soon as it is ready."""
+    async def lines():
+        nonlocal position
+        sent = 0
+        while sent < total:
+            try:
+                papers, position = await fetch_page(position, min(STREAM_PAGE_SIZE, total - sent))
+            except Exception as e:
+                # the status line has gone out already, the error can only be another line
+                logging.error(f"Streamed search failed after {sent} results: {e}", exc_info=True)
+                yield json.dumps({"error": f"An error occurred while fetching data: {e}"}) + "\n"
+                return
+            for paper in papers:
+                yield json.dumps(jsonable_encoder(paper)) + "\n"
+            sent += len(papers)
+            if position is None:
+                break
+        next_cursor = encode_cursor(position, scope) if position is not None else None
+        yield json.dumps({"next_cursor": next_cursor}) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+
+class BatchSearchRequest(BaseModel):
+    dois: List[str]
+    top_k: int = 10
+    fraction: Optional[float] = None
+    nprobe: Optional[int] = None
+    backend: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    min_citations: Optional[int] = None
+    max_citations: Optional[int] = None
+    oa_status: Optional[List[str]] = None
+    fields: Optional[List[str]] = None
+
+
+@app.post("/vector_search/batch")
+async def post_vector_search_batch(request: BatchSearchRequest):
+    _check_search_params(request.top_k, request.fraction, request.backend)
+    filters = _search_filter(request.year_from, request.year_to, request.min_citations, request.max_citations,
+                             request.oa_status)
+    fields = _fields(request.fields, list(PAPER_FIELDS))
+    if not request.dois:
+        raise HTTPException(status_code=400, detail="dois must not be empty.")
+    if len(request.dois) > MAX_BATCH_DOIS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_DOIS} DOIs per batch.")
+
+    full_dois = {doi: _full_doi(doi) for doi in request.dois}
+    key_of = lambda full_doi: (full_doi, request.top_k, request.fraction, request.nprobe, request.backend, filters,
+                               fields)
+
+    async def search(keys):
+        searched = await vectorSearchBatchAsync([key[0] for key in keys], top_k=request.top_k,
+                                                fraction=request.fraction, nprobe=request.nprobe,
+                                                backend=request.backend, filters=filters, fields=fields)
+        return {key: searched.get(key[0]) for key in keys}
+
+    logging.info(f"Batch vector search for {len(full_dois)} DOIs")
+    try:
+        found = await vector_cache.get_many([key_of(full_doi) for full_doi in full_dois.values()], search)
+    except Exception as e:
+        logging.error(f"Batch vector search failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching data: {e}")
+
+    results = {}
+    for doi, full_doi in full_dois.items():
+        papers = found.get(key_of(full_doi))
+        if papers:
+            results[doi] = {"papers": papers}
         else:
-            full_doi = f"https://doi.org/{doi}"
-    else:
-        full_doi = doi
+            results[doi] = {"error": f"Paper with DOI '{doi}' not found."}
+    return results
+
+
+@app.get("/vector_search/{doi:path}")
+async def get_vector_search(request: Request, doi: str, top_k: int = 10, fraction: Optional[float] = None,
+                            nprobe: Optional[int] = None, backend: Optional[str] = None,
+                            year_from: Optional[int] = None, year_to: Optional[int] = None,
+                            min_citations: Optional[int] = None, max_citations: Optional[int] = None,
+                            oa_status: Optional[List[str]] = Query(None), cursor: Optional[str] = None,
+                            fields: Optional[List[str]] = Query(None)):
+    logging.info(f"Received request for vector search with raw DOI: {doi}")
+
+    stream = _wants_ndjson(request)
+    _check_search_params(top_k, fraction, backend, MAX_STREAM_RESULTS if stream else 100)
+    filters = _search_filter(year_from, year_to, min_citations, max_citations, oa_status)
+    fields = _fields(fields, list(PAPER_FIELDS))
+    full_doi = _full_doi(doi)
+    scope = f"vector_search|{full_doi}|{fraction}|{nprobe}|{backend}|{filters}"
+    after = _decode_cursor(cursor, scope, SEARCH_POSITION)
     
     logging.info(f"Full URL for query: {full_doi}")
-    
-    loop = asyncio.get_event_loop()
+
+    async def fetch_page(after, size):
+        size = _search_page_size(size, after)
+        cache_key = (full_doi, size, fraction, nprobe, backend, filters, fields) + _position_key(after)
+        papers = await vector_cache.get_or_load(cache_key, lambda: vectorSearchAsync(
+            full_doi, top_k=size, fraction=fraction, nprobe=nprobe, backend=backend, filters=filters, after=after,
+            fields=fields))
+        return papers or [], _next_search_position(papers or [], size, after)
+
+    if stream:
+        return _stream_response(fetch_page, after, top_k, scope)
+
     try:
-        papers = await loop.run_in_executor(executor, vectorSearch, full_doi)
+        papers, position = await fetch_page(after, top_k)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while fetching data: {e}")
-    if not papers:
+    # a cursor past the last neighbour is an empty page, not a missing paper
+    if not papers and after is None:
         raise HTTPException(status_code=404, detail=f"Paper with DOI '{doi}' not found.")
-    return papers
+    return _page_response(papers, position, scope)
+
+
+@app.get("/semantic_search")
+async def get_semantic_search(request: Request, q: str, top_k: int = 10, fraction: Optional[float] = None,
+                              nprobe: Optional[int] = None, backend: Optional[str] = None,
+                              year_from: Optional[int] = None, year_to: Optional[int] = None,
+                              min_citations: Optional[int] = None, max_citations: Optional[int] = None,
+                              oa_status: Optional[List[str]] = Query(None), cursor: Optional[str] = None,
+                              fields: Optional[List[str]] = Query(None)):
+    if not SEMANTIC_SEARCH_ENABLED:
+        raise HTTPException(status_code=503, detail="Semantic search is disabled.")
+    if not query_encoder.ready:
+        raise HTTPException(status_code=503, detail="Semantic search is not available yet.",
+                            headers={"Retry-After": "30"})
+    stream = _wants_ndjson(request)
+    _check_search_params(top_k, fraction, backend, MAX_STREAM_RESULTS if stream else 100)
+    filters = _search_filter(year_from, year_to, min_citations, max_citations, oa_status)
+    fields = _fields(fields, list(PAPER_FIELDS))
+    query = normalize_query(q)
+    if not query:
+        raise HTTPException(status_code=400, detail="q must not be empty.")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"q must be at most {MAX_QUERY_LENGTH} characters.")
+    scope = f"semantic_search|{query}|{fraction}|{nprobe}|{backend}|{filters}"
+    after = _decode_cursor(cursor, scope, SEARCH_POSITION)
+
+    async def fetch_page(after, size):
+        size = _search_page_size(size, after)
+        async def search():
+            embedding = await query_encoder.encode(query)
+            return await vectorSearchByEmbeddingAsync(embedding, top_k=size, fraction=fraction, nprobe=nprobe,
+                                                      backend=backend, filters=filters, after=after, fields=fields)
+
+        cache_key = (query, size, fraction, nprobe, backend, filters, fields) + _position_key(after)
+        papers = await semantic_cache.get_or_load(cache_key, search)
+        return papers or [], _next_search_position(papers or [], size, after)
+
+    if stream:
+        return _stream_response(fetch_page, after, top_k, scope)
+
+    try:
+        papers, position = await fetch_page(after, top_k)
+    except Exception as e:
+        logging.error(f"Semantic search failed for '{query}': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching data: {e}")
+    return _page_response(papers, position, scope)
 
 
 @app.get("/titled_paper/{title}")
-async def get_titled_paper(title: str):
+async def get_titled_paper(request: Request, title: str, backend: Optional[str] = None, limit: int = 10,
+                           cursor: Optional[str] = None, fields: Optional[List[str]] = Query(None)):
     logging.info(f"request for titled paper with raw title: {title}")
+
+    if backend is not None and backend not in TITLE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unknown title backend '{backend}'.")
+    stream = _wants_ndjson(request)
+    max_limit = MAX_STREAM_RESULTS if stream else 100
+    if not 0 < limit <= max_limit:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {max_limit}.")
+    fields = _fields(fields, list(TITLE_FIELDS))
     
     decoded_title = urllib.parse.unquote(title)
+    # positions differ between the backends, so a cursor is only good for the one that made it
+    scope = f"titled_paper|{decoded_title}|{backend or TITLE_BACKEND}"
+    after = _decode_cursor(cursor, scope, TITLE_POSITIONS[backend or TITLE_BACKEND])
     
     logging.info(f"Decoded title for query: {decoded_title}")
+
+    async def fetch_page(after, size):
+        async def search():
+            papers, position = await titledPaperPageAsync(decoded_title, limit=size, after=after, backend=backend,
+                                                          fields=fields)
+            # a failed search is not cached
+            return None if papers is None else (papers, position)
+
+        page = await title_cache.get_or_load((decoded_title, backend, size, fields) + _position_key(after), search)
+        return page if page is not None else ([], None)
+
+    if stream:
+        return _stream_response(fetch_page, after, limit, scope)
     
     try:
-        papers = await asyncio.get_event_loop().run_in_executor(executor, titledPaper, decoded_title)
+        papers, position = await fetch_page(after, limit)
         logging.info(f"Titled paper search completed for title: {decoded_title}")
     except Exception as e:
         logging.error(f"error occurred during search for title '{decoded_title}': {e}")
@@ -118,16 +473,69 @@ async def get_titled_paper(title: str):
         
     if not papers:
         logging.warning(f"No papers found for title {decoded_title}")
-        return []
         
-    return papers
+    return _page_response(papers, position, scope)
+
+
+@app.get("/abstracts")
+async def get_abstracts(dois: List[str] = Query(...)):
+    """{doi: abstract} for search results fetched without their abstracts, null for
+    DOIs not in the works table."""
+    if len(dois) > MAX_ABSTRACT_DOIS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ABSTRACT_DOIS} DOIs per request.")
+    full_dois = {doi: _full_doi(doi) for doi in dois}
+
+    try:
+        found = await abstract_cache.get_many(full_dois.values(), abstractsByDoiAsync)
+    except Exception as e:
+        logging.error(f"Abstract lookup failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching data: {e}")
+    return {doi: found.get(full_doi) for doi, full_doi in full_dois.items()}
+
+
+# every list in the response is cut to limit, two hops gather up to limit times the fanout
+MAX_GRAPH_LIMIT = 200
+
+
+@app.get("/citation_graph/{work_id:path}")
+async def get_citation_graph_neighbourhood(work_id: str, hops: int = Query(1, ge=1, le=2),
+                                           limit: int = Query(25, ge=1, le=MAX_GRAPH_LIMIT)):
+    def lookup():
+        graph = get_citation_graph()
+        neighbourhood = graph.neighbourhood(work_id, hops=hops, limit=limit)
+        if neighbourhood is None:
+            return None
+        neighbourhood["co_cited"] = graph.co_cited(work_id, limit=limit)
+        neighbourhood["coupled"] = graph.bibliographically_coupled(work_id, limit=limit)
+        return neighbourhood
+
+    try:
+        neighbourhood = await run_cpu(lookup)
+    except Exception as e:
+        logging.error(f"Citation graph lookup failed for {work_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching data: {e}")
+    if neighbourhood is None:
+        raise HTTPException(status_code=404, detail=f"Work '{work_id}' not found in the citation graph.")
+    return neighbourhood
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return {
+        "paper_details": paper_cache.stats(),
+        "vector_search": vector_cache.stats(),
+        "titled_paper": title_cache.stats(),
+        "semantic_search": semantic_cache.stats(),
+        "abstracts": abstract_cache.stats(),
+        "query_encoder": query_encoder.stats(),
+    }
 
 
 @app.get("/test_bigquery")
 async def test_bigquery():
     def test_connection():
         try:
-            client = bigquery.Client()
+            client = get_client()
             # Simple test query
             sql_query = "SELECT 1 as test"
             results = client.query(sql_query).result()
@@ -135,6 +543,5 @@ async def test_bigquery():
         except Exception as e:
             return {"status": "error", "error": str(e)}
     
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(executor, test_connection)
+    result = await run_blocking(test_connection)
     return result
\ No newline at end of file
@@ -0,0 +1,79 @@
+import time
+import random
+import asyncio
+import urllib.parse
+from typing import List
+
+import numpy as np
+
+from benchmarks.fixtures import Corpus, FakeBigQueryClient, openalex_transport
+
+
+def _percentiles(latencies: List[float]) -> dict:
+    ms = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99))}
+
+
+async def _load(client, paths: List[str], concurrency: int) -> dict:
+    """Send every path with `concurrency` requests in flight; latency is per request."""
+    latencies, errors = [], 0
+    pending = iter(paths)
+
+    async def worker():
+        nonlocal errors
+        for path in pending:
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return dict(_percentiles(latencies), requests_per_sec=len(paths) / elapsed, errors=errors)
+
+
+def _paths(corpus: Corpus, requests: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    works = [rng.choice(corpus.works) for _ in range(requests)]
+    bare = lambda work: work["doi"].replace("https://doi.org/", "")
+    return {
+        "vector_search": [f"/vector_search/{bare(w)}" for w in works],
+        "paper_details": [f"/paper_details/{bare(w)}" for w in works],
+        # a word from the middle of the title, like a user typing part of it
+        "titled_paper": [f"/titled_paper/{urllib.parse.quote(rng.choice(w['title'].split()))}" for w in works],
+    }
+
+
+def run(corpus: Corpus, requests: int = 2000, concurrency: int = 32, bigquery_latency: float = 0.02,
+        openalex_latency: float = 0.05, seed: int = 0) -> dict:
+    """Latency percentiles and throughput of the endpoints under concurrent load, in
+    process through the ASGI app, with BigQuery and OpenAlex replaced by local fakes
+    that add the given round-trip latency. Caches are cleared before each endpoint."""
+    import httpx
+    from db import query
+    from db.openalex import RelatedWorksHydrator
+    from backend import main
+
+    query.set_client(FakeBigQueryClient(corpus, latency=bigquery_latency, seed=seed))
+    main.related_works = RelatedWorksHydrator(base_url="http://openalex.local",
+                                              transport=openalex_transport(corpus, latency=openalex_latency))
+
+    async def bench():
+        results = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for endpoint, paths in _paths(corpus, requests, seed).items():
+                for cache in (main.paper_cache, main.vector_cache, main.title_cache):
+                    cache.cache.clear()
+                results[endpoint] = await _load(client, paths, concurrency)
+        await main.related_works.close()
+        return results
+
+    metrics = {}
+    for endpoint, stats in asyncio.run(bench()).items():
+        for name, value in stats.items():
+            metrics[f"api.{endpoint}.{name}"] = value
+    return metrics
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import zlib
+import logging
+
+import numpy as np
+
+from benchmarks.fixtures import Corpus, FakeStorageClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pipelines", "embeddingsPipeline"))
+
+
+class FakeSentenceTransformer:
+    """Hash-seeded random vectors in place of the real model, to time the pipeline
+    around the encoder (download, parse, Arrow, upload) without model weights."""
+
+    tokenizer = None
+    device = "cpu"
+
+    def __init__(self, model_name: str, device: str = "cpu", dim: int = 384):
+        self.max_seq_length = 128
+        self._dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+    def encode(self, texts, **kwargs) -> np.ndarray:
+        out = np.empty((len(texts), self._dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            out[i] = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(self._dim)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def run(corpus: Corpus, files: int = 8, fake_model: bool = False, streaming: bool = False) -> dict:
+    """docs/sec through EmbeddingProcessor.process_file for every export file, against an
+    in-memory bucket. Without fake_model the real model must be in the local HF cache."""
+    import embedding_processor
+
+    storage = FakeStorageClient()
+    storage.bucket("paperrank").objects.update(corpus.bq_export_files(files))
+
+    os.environ["STREAMING"] = "1" if streaming else "0"
+    os.environ["OUTPUT_BUCKET"] = "bench-output"
+    embedding_processor.storage.Client = lambda *args, **kwargs: storage
+    if fake_model:
+        embedding_processor.SentenceTransformer = FakeSentenceTransformer
+
+    processor = embedding_processor.EmbeddingProcessor(backend="torch")
+    paths = processor.get_files_to_process()
+
+    # the processor logs every file and batch, keep that out of the timings
+    logging.disable(logging.INFO)
+    try:
+        start = time.perf_counter()
+        for path in paths:
+            processor.process_file(path)
+        elapsed = time.perf_counter() - start
+    finally:
+        logging.disable(logging.NOTSET)
+
+    mode = ("streaming" if streaming else "batch") + (".fake_model" if fake_model else "")
+    return {f"embedding.{mode}.docs_per_sec": len(corpus.works) / elapsed}
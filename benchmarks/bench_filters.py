@@ -0,0 +1,99 @@
+import time
+import tempfile
+from typing import Dict
+
+import numpy as np
+
+from db.attributes import AttributeIndex, SearchFilter, write
+
+OA_STATUSES = ["gold", "green", "hybrid", "bronze", "closed"]
+
+# from no filter down to a few hundred papers per million
+FILTERS: Dict[str, SearchFilter] = {
+    "none": SearchFilter(),
+    "recent": SearchFilter(year_from=2015),
+    "oa_gold": SearchFilter(oa_status=("gold",)),
+    "year_2020": SearchFilter(year_from=2020, year_to=2020),
+    "cited_100": SearchFilter(min_citations=100),
+    "year_2020_cited_100": SearchFilter(year_from=2020, year_to=2020, min_citations=100),
+    "gold_2020_cited_500": SearchFilter(year_from=2020, year_to=2020, min_citations=500, oa_status=("gold",)),
+}
+
+
+class ArrayStore:
+    """In-memory stand-in for EmbeddingStore, enough for IVFIndex and AttributeIndex."""
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def take(self, rows) -> np.ndarray:
+        return self.vectors[np.asarray(rows)]
+
+
+def _papers(n: int, dim: int, seed: int):
+    """Clustered unit vectors and attributes with a skew like OpenAlex: years weighted
+    to recent ones, citation counts heavy tailed."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, n // 500), dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    year_weights = np.linspace(1, 6, 35)
+    years = rng.choice(np.arange(1990, 2025), n, p=year_weights / year_weights.sum()).astype(np.int16)
+    citations = np.minimum(rng.pareto(1.2, n) * 3, 200000).astype(np.int32)
+    oa_codes = rng.choice(len(OA_STATUSES), n, p=[0.2, 0.15, 0.1, 0.1, 0.45]).astype(np.int16)
+    return vectors, years, citations, oa_codes
+
+
+def run(papers: int = 200000, dim: int = 384, queries: int = 200, top_k: int = 10, seed: int = 0) -> dict:
+    """Filtered top-k latency and recall of the local IVF index at a range of filter
+    selectivities. Recall is against an exact scan of the matching papers.
+    `postfilter_hits` is how many of an unfiltered top_k survive the same filter, what
+    over-fetch-and-discard would have returned."""
+    from db.ann import IVFIndex
+
+    vectors, years, citations, oa_codes = _papers(papers, dim, seed)
+    store = ArrayStore(vectors)
+    index = IVFIndex.build(store, n_iter=10, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    query_rows = rng.choice(papers, queries, replace=False)
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as out:
+        write(out, years, citations, oa_codes, OA_STATUSES)
+        attributes = AttributeIndex(out, store)
+
+        unfiltered = [index.search(vectors[row], top_k=top_k, exclude=row)[0] for row in query_rows]
+        for name, filters in FILTERS.items():
+            start = time.perf_counter()
+            allowed = attributes.select(filters)
+            select_ms = (time.perf_counter() - start) * 1000
+            matching = allowed.to_rows() if allowed is not None else np.arange(papers)
+
+            latencies, recall, postfilter = [], 0, 0
+            for row, plain in zip(query_rows, unfiltered):
+                start = time.perf_counter()
+                rows, _ = index.search(vectors[row], top_k=top_k, exclude=row, allowed=allowed)
+                latencies.append(time.perf_counter() - start)
+
+                candidates = matching[matching != row]
+                scores = vectors[candidates] @ vectors[row]
+                truth = candidates[np.argsort(-scores)[:top_k]]
+                # nothing matches: an empty answer is the exact one
+                recall += len(set(truth) & set(rows)) / len(truth) if len(truth) else 1.0
+                postfilter += int(allowed.contains(plain).sum()) if allowed is not None else len(plain)
+
+            ms = np.asarray(latencies) * 1000
+            prefix = f"filters.{name}"
+            metrics.update({
+                f"{prefix}.selectivity": len(matching) / papers,
+                f"{prefix}.select_ms": select_ms,
+                f"{prefix}.p50_ms": float(np.percentile(ms, 50)),
+                f"{prefix}.p95_ms": float(np.percentile(ms, 95)),
+                f"{prefix}.recall": recall / queries,
+                f"{prefix}.postfilter_hits": postfilter / queries,
+            })
+    return metrics
@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+import json
+import logging
+
+from benchmarks.fixtures import Corpus
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pipelines", "worksPipeline"))
+
+
+def run(corpus: Corpus, repeats: int = 3) -> dict:
+    """records/sec through ProcessOpenAlexRecord.process and reconstructAbstract."""
+    from openalex_pipeline import ProcessOpenAlexRecord
+
+    lines = corpus.openalex_lines()
+    indexes = [json.loads(line)["abstract_inverted_index"] for line in lines]
+    dofn = ProcessOpenAlexRecord()
+
+    # the DoFn logs every skipped record, keep that out of the timings
+    logging.disable(logging.WARNING)
+    try:
+        process = min(_timed(lambda: [record for line in lines for record in dofn.process(line)])
+                      for _ in range(repeats))
+        reconstruct = min(_timed(lambda: [dofn.reconstructAbstract(index) for index in indexes])
+                          for _ in range(repeats))
+    finally:
+        logging.disable(logging.NOTSET)
+
+    return {
+        "ingestion.process.records_per_sec": len(lines) / process,
+        "ingestion.reconstruct_abstract.records_per_sec": len(indexes) / reconstruct,
+    }
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
@@ -0,0 +1,250 @@
+import io
+import json
+import gzip
+import time
+import random
+from typing import Dict, Iterator, List, Optional
+
+# generated corpus, deterministic for a given seed so runs are comparable
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "ve", "zo", "phi", "qua", "tri", "gen", "bio", "neu", "ral", "cat"]
+
+
+def _vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+def work_id(n: int) -> str:
+    return f"W{1000000 + n}"
+
+
+def doi_of(n: int) -> str:
+    return f"https://doi.org/10.5555/bench.{n}"
+
+
+class Corpus:
+    """Synthetic OpenAlex works with abstracts of realistic length (~80-300 words)."""
+
+    def __init__(self, size: int = 2000, seed: int = 0, vocabulary: int = 5000):
+        rng = random.Random(seed)
+        self.words = _vocabulary(vocabulary, rng)
+        self.works = [self._work(n, rng) for n in range(size)]
+        self.by_doi = {work["doi"]: work for work in self.works}
+        self.by_id = {work["id"].rsplit("/", 1)[-1]: work for work in self.works}
+
+    def _work(self, n: int, rng: random.Random) -> dict:
+        abstract = [rng.choice(self.words) for _ in range(rng.randint(80, 300))]
+        inverted = {}
+        for position, word in enumerate(abstract):
+            inverted.setdefault(word, []).append(position)
+        year = rng.randint(1990, 2024)
+        return {
+            "id": f"https://openalex.org/{work_id(n)}",
+            "doi": doi_of(n),
+            "title": " ".join(rng.choice(self.words) for _ in range(rng.randint(4, 14))).capitalize(),
+            "type": rng.choice(["article", "article", "article", "preprint"]),
+            "created_date": f"{year}-01-01",
+            "publication_year": year,
+            "updated_date": "2024-06-01T00:00:00",
+            "cited_by_count": rng.randint(0, 500),
+            "cited_by_api_url": f"https://api.openalex.org/works?filter=cites:{work_id(n)}",
+            "abstract": " ".join(abstract),
+            "abstract_inverted_index": inverted,
+            "related_works": [f"https://openalex.org/{work_id(rng.randrange(n + 1))}" for _ in range(10)],
+            "referenced_works": [f"https://openalex.org/{work_id(rng.randrange(n + 1))}"
+                                 for _ in range(rng.randint(0, 40))],
+            "open_access": {"is_oa": True, "oa_status": rng.choice(["gold", "green", "hybrid"]),
+                            "oa_url": f"https://example.org/{n}.pdf"},
+            "authorships": [{"author": {"id": f"https://openalex.org/A{rng.randint(1, 10 ** 6)}",
+                                        "display_name": f"Author {rng.randint(1, 10 ** 6)}"}}
+                            for _ in range(rng.randint(1, 8))],
+        }
+
+    def openalex_lines(self) -> List[str]:
+        """Snapshot-style JSON lines, without the reconstructed abstract."""
+        return [json.dumps({k: v for k, v in work.items() if k != "abstract"}) for work in self.works]
+
+    def works_row(self, work: dict) -> dict:
+        """A row of the EWORKS table."""
+        return {
+            "paper_id": work["id"],
+            "doi": work["doi"],
+            "title": work["title"],
+            "abstract": work["abstract"],
+            "authors": [{"name": a["author"]["display_name"], "id": a["author"]["id"]} for a in work["authorships"]],
+            "related_works": work["related_works"],
+            "referenced_works": work["referenced_works"],
+            "oa_url": work["open_access"]["oa_url"],
+            "oa_status": work["open_access"]["oa_status"],
+            "cited_by_count": work["cited_by_count"],
+            "created_date": work["created_date"],
+            "publication_year": work["publication_year"],
+        }
+
+    def bq_export_files(self, files: int) -> Dict[str, bytes]:
+        """{blob name: gzipped JSON lines} in the layout EmbeddingProcessor reads."""
+        shards = [self.works[i::files] for i in range(files)]
+        out = {}
+        for i, shard in enumerate(shards):
+            lines = "".join(json.dumps({"doi": w["doi"], "abstract": w["abstract"]}) + "\n" for w in shard)
+            out[f"bq-export/part-{i:05d}.json.gz"] = gzip.compress(lines.encode("utf-8"))
+        return out
+
+
+# --- Google Cloud Storage -------------------------------------------------------------
+
+class _WriteHandle(io.BytesIO):
+    def __init__(self, blob):
+        super().__init__()
+        self._blob = blob
+
+    def close(self):
+        if not self.closed:
+            self._blob._store()[self._blob.name] = self.getvalue()
+        super().close()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+
+    def _store(self) -> Dict[str, bytes]:
+        return self.bucket.objects
+
+    @property
+    def size(self) -> Optional[int]:
+        data = self._store().get(self.name)
+        return None if data is None else len(data)
+
+    def exists(self) -> bool:
+        return self.name in self._store()
+
+    def open(self, mode: str = "rb", **kwargs):
+        if "w" in mode:
+            return _WriteHandle(self)
+        return io.BytesIO(self._store()[self.name])
+
+    def download_as_bytes(self) -> bytes:
+        return self._store()[self.name]
+
+    def download_to_filename(self, filename: str):
+        with open(filename, "wb") as f:
+            f.write(self._store()[self.name])
+
+    def upload_from_string(self, data, **kwargs):
+        self._store()[self.name] = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+
+    def upload_from_file(self, f, **kwargs):
+        self._store()[self.name] = f.read()
+
+    def delete(self, **kwargs):
+        self._store().pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self, name: str):
+        self.name = name
+        self.objects: Dict[str, bytes] = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "") -> Iterator[FakeBlob]:
+        return iter([FakeBlob(self, name) for name in sorted(self.objects) if name.startswith(prefix)])
+
+
+class FakeStorageClient:
+    """In-memory stand-in for google.cloud.storage.Client, covering what the pipelines use."""
+
+    def __init__(self):
+        self.buckets: Dict[str, FakeBucket] = {}
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self.buckets.setdefault(name, FakeBucket(name))
+
+
+# --- BigQuery ---------------------------------------------------------------------------
+
+class _QueryJob:
+    def __init__(self, rows: List[dict]):
+        self._rows = rows
+
+    def result(self):
+        return iter(self._rows)
+
+
+class FakeBigQueryClient:
+    """Answers the queries in db/query.py from a Corpus, with `latency` seconds of
+    simulated round trip per query. Install it with db.query.set_client."""
+
+    def __init__(self, corpus: Corpus, latency: float = 0.0, seed: int = 0):
+        self.corpus = corpus
+        self.latency = latency
+        self.rows = {doi: corpus.works_row(work) for doi, work in corpus.by_doi.items()}
+        self.dois = list(self.rows)
+        self.seed = seed
+        self.queries = 0
+
+    @staticmethod
+    def _params(job_config) -> dict:
+        params = {}
+        for param in getattr(job_config, "query_parameters", None) or []:
+            params[param.name] = param.values if hasattr(param, "values") else param.value
+        return params
+
+    def _neighbours(self, doi: str, k: int) -> List[dict]:
+        rng = random.Random(f"{self.seed}:{doi}")
+        picks = rng.sample(self.dois, min(k, len(self.dois)))
+        return [dict(self.rows[n], distance=rng.uniform(0.05, 0.6)) for n in picks if n != doi]
+
+    def query(self, sql: str, job_config=None):
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        params = self._params(job_config)
+
+        if "VECTOR_SEARCH" in sql:
+            top_k = int(sql.split("top_k =>")[1].split(",")[0]) - 1
+            if "query_doi" in sql:
+                rows = [dict(row, query_doi=doi) for doi in params["dois"] if doi in self.rows
+                        for row in sorted(self._neighbours(doi, top_k), key=lambda r: r["distance"])]
+                return _QueryJob(rows)
+            if params["doi"] not in self.rows:
+                return _QueryJob([])
+            return _QueryJob(sorted(self._neighbours(params["doi"], top_k), key=lambda r: r["distance"]))
+        if "LIKE" in sql:
+            needle = params["title"].lower()
+            return _QueryJob([row for row in self.rows.values() if needle in row["title"].lower()][:10])
+        if "paper_ids" in params:
+            wanted = set(params["paper_ids"])
+            return _QueryJob([row for row in self.rows.values() if row["paper_id"] in wanted])
+        if "dois" in params:
+            return _QueryJob([self.rows[d] for d in params["dois"] if d in self.rows])
+        if "doi" in params:
+            row = self.rows.get(params["doi"])
+            return _QueryJob([row] if row else [])
+        return _QueryJob([{"test": 1}])
+
+
+# --- OpenAlex API -----------------------------------------------------------------------
+
+def openalex_transport(corpus: Corpus, latency: float = 0.0):
+    """httpx.MockTransport serving GET /works?filter=openalex_id:a|b|c from the corpus."""
+    import asyncio
+    import httpx
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        ids = request.url.params.get("filter", "").split(":", 1)[-1].split("|")
+        results = [{"id": corpus.by_id[i]["id"], "doi": corpus.by_id[i]["doi"],
+                    "title": corpus.by_id[i]["title"],
+                    "publication_year": corpus.by_id[i]["publication_year"]}
+                   for i in ids if i in corpus.by_id]
+        return httpx.Response(200, json={"results": results})
+
+    return httpx.MockTransport(handler)
@@ -0,0 +1,107 @@
+import sys
+import json
+import argparse
+import platform
+import logging
+from datetime import datetime, timezone
+
+from benchmarks.fixtures import Corpus
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUITES = ("ingestion", "embedding", "api", "filters")
+
+
+def lower_is_better(metric: str) -> bool:
+    return metric.endswith("_ms") or metric.endswith(".errors")
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float) -> list:
+    """Metrics that got worse than the baseline by more than `tolerance` (a fraction)."""
+    regressions = []
+    for metric, value in metrics.items():
+        previous = baseline.get(metric)
+        if previous is None:
+            continue
+        if lower_is_better(metric):
+            worse = value > previous * (1 + tolerance) if previous else value > 0
+        else:
+            worse = value < previous * (1 - tolerance)
+        if worse:
+            regressions.append({"metric": metric, "baseline": previous, "value": value,
+                                "change": (value - previous) / previous if previous else None})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the ingestion, embedding, query and filtered search paths")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument("--works", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--files", type=int, default=8, help="bq-export files the corpus is split into")
+    parser.add_argument("--fake-model", action="store_true",
+                        help="replace the sentence transformer with random vectors, to time the pipeline only")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bigquery-latency-ms", type=float, default=20)
+    parser.add_argument("--openalex-latency-ms", type=float, default=50)
+    parser.add_argument("--filter-papers", type=int, default=200000, help="papers in the filtered search index")
+    parser.add_argument("--filter-queries", type=int, default=200)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    suites = [s for s in args.suites.split(",") if s]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites {sorted(unknown)}")
+
+    corpus = Corpus(size=args.works, seed=args.seed)
+    metrics = {}
+    if "ingestion" in suites:
+        from benchmarks import bench_ingestion
+        metrics.update(bench_ingestion.run(corpus))
+    if "embedding" in suites:
+        from benchmarks import bench_embedding
+        metrics.update(bench_embedding.run(corpus, files=args.files, fake_model=args.fake_model))
+        metrics.update(bench_embedding.run(corpus, files=args.files, fake_model=args.fake_model, streaming=True))
+    if "api" in suites:
+        from benchmarks import bench_api
+        metrics.update(bench_api.run(corpus, requests=args.requests, concurrency=args.concurrency,
+                                     bigquery_latency=args.bigquery_latency_ms / 1000,
+                                     openalex_latency=args.openalex_latency_ms / 1000, seed=args.seed))
+    if "filters" in suites:
+        from benchmarks import bench_filters
+        metrics.update(bench_filters.run(papers=args.filter_papers, queries=args.filter_queries, seed=args.seed))
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "processor": platform.processor() or platform.machine()},
+        "config": vars(args),
+        "metrics": metrics,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(metrics, baseline["metrics"], args.tolerance)
+        report["baseline"] = {"path": args.baseline, "created_at": baseline.get("created_at"),
+                              "tolerance": args.tolerance, "regressions": regressions}
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(metrics, indent=2))
+
+    for regression in regressions:
+        logger.error(f"Regression in {regression['metric']}: {regression['baseline']:.2f} -> {regression['value']:.2f}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import os
+import json
+import logging
+import argparse
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from db.embedding_store import EmbeddingStore
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = _normalize(np.asarray(vectors[start:start + chunk_size], dtype=np.float32))
+        assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def _train_centroids(sample: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    # spherical k-means, the centroids stay unit length so cosine == dot product
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = _assign(sample, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.cumsum(counts) - counts
+        nonempty = counts > 0
+
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = _normalize(sums).astype(np.float32)
+
+    return centroids
+
+
+class SearchAfter(NamedTuple):
+    """Keyset position of the last result already returned. Results are ordered by
+    (distance, row) and continue after it; `offset` of them came before."""
+    distance: float
+    row: int
+    offset: int
+
+
+class IVFIndex:
+    """Inverted-file index over unit-normalised embeddings.
+
+    Vectors are stored grouped by their coarse centroid, so probing a list is a
+    single contiguous matrix-vector product. Rows refer to the EmbeddingStore
+    the index was built from, which also resolves DOIs.
+    """
+
+    def __init__(self, centroids, offsets, rows, vectors, store, default_nprobe: int = 16):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.vectors = vectors
+        self.store = store
+        self.default_nprobe = default_nprobe
+        self._slots = None
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, store, n_lists: Optional[int] = None, sample_size: int = 256,
+              n_iter: int = 20, default_nprobe: int = 16, seed: int = 0, out: Optional[str] = None):
+        """Train the centroids and lay the vectors out by list. With `out` the list-ordered
+        vectors are written there chunk by chunk instead of being held in memory, and
+        save(out) only has to add the rest."""
+        embeddings = store.vectors
+        n = len(embeddings)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, n)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = rng.choice(n, min(n, n_lists * sample_size), replace=False)
+        sample = _normalize(np.asarray(embeddings[np.sort(sample_rows)], dtype=np.float32))
+        logging.info(f"Training {n_lists} IVF centroids on {len(sample)} vectors")
+        centroids = _train_centroids(sample, n_lists, n_iter=n_iter, seed=seed)
+
+        assignments = _assign(embeddings, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        shape = (n, embeddings.shape[1])
+        if out is None:
+            vectors = np.empty(shape, dtype=np.float32)
+        else:
+            os.makedirs(out, exist_ok=True)
+            vectors = np.lib.format.open_memmap(os.path.join(out, "vectors.npy"), mode="w+",
+                                                dtype=np.float32, shape=shape)
+        for start in range(0, n, 65536):
+            chunk_rows = rows[start:start + 65536]
+            # gathered in row order, which reads the store sequentially
+            order = np.argsort(chunk_rows)
+            chunk = np.empty((len(chunk_rows), shape[1]), dtype=np.float32)
+            chunk[order] = _normalize(np.asarray(embeddings[chunk_rows[order]], dtype=np.float32))
+            vectors[start:start + len(chunk_rows)] = chunk
+        if out is not None:
+            vectors.flush()
+
+        return cls(centroids, offsets, rows, vectors, store, default_nprobe=default_nprobe)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "rows.npy"), self.rows)
+        vectors_path = os.path.join(path, "vectors.npy")
+        written = isinstance(self.vectors, np.memmap) and os.path.exists(vectors_path) \
+            and os.path.samefile(self.vectors.filename, vectors_path)
+        if not written:
+            np.save(vectors_path, self.vectors)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"n_lists": self.n_lists,
+                       "dim": int(self.centroids.shape[1]),
+                       "count": len(self.rows),
+                       "default_nprobe": self.default_nprobe}, f)
+
+    @classmethod
+    def load(cls, path: str, store, vectors: bool = True):
+        """Load an index saved by save(). With vectors=False only the centroids and the
+        list layout are read, for callers that score from their own codes or the store."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["count"] != len(store):
+            raise ValueError(f"Index at {path} has {meta['count']} rows but the store has {len(store)}")
+        return cls(np.load(os.path.join(path, "centroids.npy")),
+                   np.load(os.path.join(path, "offsets.npy")),
+                   np.load(os.path.join(path, "rows.npy")),
+                   np.load(os.path.join(path, "vectors.npy"), mmap_mode="r") if vectors else None,
+                   store,
+                   default_nprobe=meta.get("default_nprobe", 16))
+
+    def resolve_nprobe(self, nprobe: Optional[int] = None, fraction: Optional[float] = None) -> int:
+        if nprobe is None and fraction is not None:
+            nprobe = int(np.ceil(fraction * self.n_lists))
+        return max(1, min(nprobe or self.default_nprobe, self.n_lists))
+
+    def _top_k(self, scores, rows, top_k: int, exclude: Optional[int] = None,
+               after: Optional[SearchAfter] = None):
+        if not scores:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        scores = np.concatenate(scores)
+        rows = np.concatenate(rows)
+        if exclude is not None:
+            keep = rows != exclude
+            scores, rows = scores[keep], rows[keep]
+        if after is not None:
+            distances = 1.0 - scores
+            keep = (distances > after.distance) | ((distances == after.distance) & (rows > after.row))
+            scores, rows = scores[keep], rows[keep]
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        # ties go to the lower row, so a page boundary is a strict (distance, row) order
+        top = top[np.lexsort((rows[top], -scores[top]))]
+        return rows[top], 1.0 - scores[top]
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: Optional[int] = None,
+               fraction: Optional[float] = None, exclude: Optional[int] = None, allowed=None,
+               after: Optional[SearchAfter] = None):
+        """Return (rows, cosine distances) of the approximate top_k neighbours of query,
+        restricted to the rows of the `allowed` Bitmap when one is given, and to those
+        ranked after `after` for a following page."""
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        nprobe = self.resolve_nprobe(nprobe, fraction)
+        if allowed is not None:
+            return self._search_allowed(q, allowed, top_k, nprobe, exclude, after)
+
+        centroid_scores = self.centroids @ q
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        scores, rows = [], []
+        for lst in probe:
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            if start == end:
+                continue
+            scores.append(self.vectors[start:end] @ q)
+            rows.append(self.rows[start:end])
+        return self._top_k(scores, rows, top_k, exclude, after)
+
+    def exact_filter_limit(self, nprobe: int) -> int:
+        # scoring this many rows straight from the store costs about what an
+        # unfiltered probe of nprobe lists does, and the answer is exact
+        return int(nprobe * len(self.rows) / self.n_lists)
+
+    def slots_of(self, rows: np.ndarray) -> np.ndarray:
+        """Positions of store rows in the list-ordered vectors."""
+        if self._slots is None:
+            slots = np.empty(len(self.rows), dtype=np.int32)
+            slots[self.rows] = np.arange(len(self.rows), dtype=np.int32)
+            self._slots = slots
+        return self._slots[rows]
+
+    def _search_allowed(self, q: np.ndarray, allowed, top_k: int, nprobe: int, exclude: Optional[int],
+                        after: Optional[SearchAfter] = None):
+        if len(allowed) <= self.exact_filter_limit(nprobe):
+            rows = allowed.to_rows()
+            slots = self.slots_of(rows)
+            order = np.argsort(slots)
+            # gathered in slot order, the vectors are already normalised
+            return self._top_k([self.vectors[slots[order]] @ q], [rows[order]], top_k, exclude, after)
+
+        # probe lists nearest first and keep going past nprobe until top_k allowed
+        # rows have been scored, only the allowed rows of a list are read
+        wanted = top_k + (exclude is not None) + (after.offset + 1 if after is not None else 0)
+        scores, rows, found = [], [], 0
+        for i, lst in enumerate(np.argsort(-(self.centroids @ q))):
+            if i >= nprobe and found >= wanted:
+                break
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            keep = np.flatnonzero(allowed.contains(self.rows[start:end]))
+            if len(keep) == 0:
+                continue
+            scores.append(self.vectors[start + keep] @ q)
+            rows.append(self.rows[start + keep])
+            found += len(keep)
+        return self._top_k(scores, rows, top_k, exclude, after)
+
+    def search_batch(self, queries: np.ndarray, top_k: int = 10, nprobe: Optional[int] = None,
+                     fraction: Optional[float] = None, exclude=None):
+        """search() for many queries at once; every probed list is scored against all
+        the queries probing it with a single matrix product."""
+        qs = _normalize(np.asarray(queries, dtype=np.float32))
+        nprobe = self.resolve_nprobe(nprobe, fraction)
+        probes = np.argpartition(-(qs @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        flat_lists = probes.ravel()
+        flat_queries = np.repeat(np.arange(len(qs)), nprobe)
+        order = np.argsort(flat_lists, kind="stable")
+        flat_lists, flat_queries = flat_lists[order], flat_queries[order]
+        lists, starts = np.unique(flat_lists, return_index=True)
+        ends = np.append(starts[1:], len(flat_lists))
+
+        scores = [[] for _ in range(len(qs))]
+        rows = [[] for _ in range(len(qs))]
+        for lst, q_start, q_end in zip(lists, starts, ends):
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            if start == end:
+                continue
+            query_ids = flat_queries[q_start:q_end]
+            block = self.vectors[start:end] @ qs[query_ids].T
+            list_rows = self.rows[start:end]
+            for j, qi in enumerate(query_ids):
+                scores[qi].append(block[:, j])
+                rows[qi].append(list_rows)
+
+        return [self._top_k(scores[qi], rows[qi], top_k, None if exclude is None else exclude[qi])
+                for qi in range(len(qs))]
+
+    def search_doi(self, doi: str, top_k: int = 10, nprobe: Optional[int] = None,
+                   fraction: Optional[float] = None, allowed=None, after: Optional[SearchAfter] = None):
+        """Neighbours of an indexed paper as [(doi, distance)], or None if the DOI is not indexed."""
+        row = self.store.row_of(doi)
+        if row is None:
+            return None
+        rows, distances = self.search(self.store.vectors[row], top_k=top_k, nprobe=nprobe,
+                                      fraction=fraction, exclude=row, allowed=allowed, after=after)
+        return [(self.store.doi_at(r), float(d)) for r, d in zip(rows, distances)]
+
+    def search_doi_batch(self, dois, top_k: int = 10, nprobe: Optional[int] = None,
+                         fraction: Optional[float] = None, allowed=None) -> dict:
+        """{doi: [(doi, distance)]} for the indexed DOIs, {doi: None} for the rest."""
+        if allowed is not None:
+            # filtered queries stop probing at different lists, there is no shared product
+            return {doi: self.search_doi(doi, top_k=top_k, nprobe=nprobe, fraction=fraction, allowed=allowed)
+                    for doi in dois}
+        query_rows = self.store.rows_of(dois)
+        found = np.flatnonzero(query_rows >= 0)
+        results = {doi: None for doi in dois}
+        if len(found) == 0:
+            return results
+
+        hits = self.search_batch(self.store.take(query_rows[found]), top_k=top_k, nprobe=nprobe,
+                                 fraction=fraction, exclude=query_rows[found])
+        for i, (rows, distances) in zip(found, hits):
+            results[dois[i]] = [(self.store.doi_at(r), float(d)) for r, d in zip(rows, distances)]
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a local IVF index over a compacted embedding store")
+    parser.add_argument("--store", required=True, help="directory written by db.embedding_store")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=16)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.store)
+    logging.info(f"Opened store with {len(store)} embeddings from {args.store}")
+    index = IVFIndex.build(store, n_lists=args.lists, default_nprobe=args.nprobe, out=args.out)
+    index.save(args.out)
+    logging.info(f"Saved IVF index with {index.n_lists} lists to {args.out}")
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
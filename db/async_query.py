@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from db.query import (doiEntered, vectorSearch, vectorSearchBatch, vectorSearchByEmbedding, titledPaper,
+                      titledPaperPage, abstractsByDoi, worksByOpenAlexId, BIGQUERY_MAX_CONCURRENCY,
+                      get_cpu_executor)
+from db.telemetry import track_executor
+
+# the BigQuery client is synchronous, so queries run on a bounded pool sized to
+# the client's connection pool; the event loop only ever awaits them. Local index
+# scans inside those calls are handed on to db.query's CPU-sized pool
+_executor = ThreadPoolExecutor(max_workers=BIGQUERY_MAX_CONCURRENCY, thread_name_prefix="bigquery")
+track_executor(_executor, "bigquery")
+
+
+def get_executor() -> ThreadPoolExecutor:
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # carry the caller's context over, so spans opened in the thread nest under the request's
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def run_cpu(func, *args, **kwargs):
+    """run_blocking for CPU-bound work that makes no BigQuery calls: it runs on db.query's
+    CPU-sized pool and does not hold one of the query slots."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_cpu_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+async def doiEnteredAsync(doi: str, fields=None):
+    return await run_blocking(doiEntered, doi, fields=fields)
+
+
+async def vectorSearchAsync(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                            backend: str = None, filters=None, after=None, fields=None):
+    return await run_blocking(vectorSearch, doi, top_k=top_k, fraction=fraction, nprobe=nprobe, backend=backend,
+                              filters=filters, after=after, fields=fields)
+
+
+async def vectorSearchBatchAsync(dois, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                                 backend: str = None, filters=None, fields=None):
+    return await run_blocking(vectorSearchBatch, dois, top_k=top_k, fraction=fraction, nprobe=nprobe,
+                              backend=backend, filters=filters, fields=fields)
+
+
+async def vectorSearchByEmbeddingAsync(embedding, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                                      backend: str = None, filters=None, after=None, fields=None):
+    return await run_blocking(vectorSearchByEmbedding, embedding, top_k=top_k, fraction=fraction, nprobe=nprobe,
+                              backend=backend, filters=filters, after=after, fields=fields)
+
+
+async def titledPaperAsync(title: str, backend: str = None):
+    return await run_blocking(titledPaper, title, backend=backend)
+
+
+async def titledPaperPageAsync(title: str, limit: int = 10, after=None, backend: str = None, fields=None):
+    return await run_blocking(titledPaperPage, title, limit=limit, after=after, backend=backend, fields=fields)
+
+
+async def abstractsByDoiAsync(dois):
+    return await run_blocking(abstractsByDoi, dois)
+
+
+async def worksByOpenAlexIdAsync(work_ids):
+    return await run_blocking(worksByOpenAlexId, work_ids)
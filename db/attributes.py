@@ -0,0 +1,216 @@
+import os
+import json
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from db.bitmap import Bitmap
+from db.cache import TTLCache
+from db.embedding_store import EmbeddingStore
+
+# cited_by_count is bucketed on a roughly logarithmic scale; a range predicate is the
+# union of the buckets it covers, and only the (at most two) buckets it cuts through
+# are checked against the exact counts
+CITATION_EDGES = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000)
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Predicates a vector search is restricted to; None leaves a bound open. Years
+    are the work's publication_year, or the year of created_date where that is missing."""
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    min_citations: Optional[int] = None
+    max_citations: Optional[int] = None
+    oa_status: Tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return any(v is not None for v in (self.year_from, self.year_to, self.min_citations, self.max_citations)) \
+            or bool(self.oa_status)
+
+
+def _bitmaps_by_value(values: np.ndarray, missing) -> Dict[int, Bitmap]:
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    bounds = np.flatnonzero(np.diff(sorted_values)) + 1
+    bitmaps = {}
+    for rows in np.split(order, bounds):
+        if len(rows) and values[rows[0]] != missing:
+            bitmaps[int(values[rows[0]])] = Bitmap.from_rows(rows)
+    return bitmaps
+
+
+def _save_bitmaps(path: str, bitmaps: Dict) -> None:
+    arrays = {}
+    for value, bitmap in bitmaps.items():
+        arrays.update({f"{value}/{name}": array for name, array in bitmap.to_arrays().items()})
+    np.savez(path, **arrays)
+
+
+def _load_bitmaps(path: str) -> Dict[str, Bitmap]:
+    parts = {}
+    with np.load(path) as arrays:
+        for key in arrays.files:
+            value, name = key.rsplit("/", 1)
+            parts.setdefault(value, {})[name] = arrays[key]
+    return {value: Bitmap.from_arrays(**fields) for value, fields in parts.items()}
+
+
+def build(source: str, store_path: str, out: str):
+    """Build attribute bitmaps over the rows of a compacted embedding store from a
+    Parquet export of the works table (doi, publication_year, created_date, cited_by_count,
+    oa_status; exports from before publication_year was ingested may lack it).
+
+    Works whose DOI has no embedding are skipped; see write() for the layout.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    store = EmbeddingStore(store_path)
+    n = len(store)
+    # the store's DOI column as an Arrow array, so DOIs are matched with one hash join per batch
+    store_dois = pa.LargeBinaryArray.from_buffers(
+        pa.large_binary(), n, [None, pa.py_buffer(np.ascontiguousarray(store._doi_offsets, dtype=np.int64)),
+                               pa.py_buffer(np.asarray(store._doi_bytes))])
+
+    years = np.zeros(n, dtype=np.int16)
+    citations = np.full(n, -1, dtype=np.int32)
+    oa_codes = np.full(n, -1, dtype=np.int16)
+    oa_statuses = {}
+
+    dataset = ds.dataset(source, format="parquet")
+    has_publication_year = "publication_year" in dataset.schema.names
+    columns = ["doi", "created_date", "cited_by_count", "oa_status"] + ["publication_year"] * has_publication_year
+    matched = 0
+    for batch in dataset.to_batches(columns=columns):
+        rows = pc.index_in(batch.column("doi").cast(pa.large_binary()), value_set=store_dois)
+        found = pc.is_valid(rows).to_numpy(zero_copy_only=False)
+        if not found.any():
+            continue
+        rows = rows.filter(pc.is_valid(rows)).to_numpy().astype(np.int64)
+        matched += len(rows)
+
+        year = pc.utf8_slice_codeunits(batch.column("created_date").filter(found), 0, 4)
+        year = pc.if_else(pc.fill_null(pc.match_substring_regex(year, "^[0-9]{4}$"), False), year, "0")
+        year = pc.cast(year, pa.int16())
+        if has_publication_year:
+            published = pc.cast(batch.column("publication_year").filter(found), pa.int16())
+            year = pc.coalesce(published, year)
+        years[rows] = year.to_numpy(zero_copy_only=False)
+
+        cited = batch.column("cited_by_count").filter(found)
+        citations[rows] = pc.fill_null(cited, -1).to_numpy(zero_copy_only=False).astype(np.int32)
+
+        statuses = batch.column("oa_status").filter(found).to_pylist()
+        oa_codes[rows] = [-1 if s is None else oa_statuses.setdefault(s, len(oa_statuses)) for s in statuses]
+
+    logging.info(f"Matched {matched} works to the {n} store rows")
+    # codes were handed out in insertion order
+    write(out, years, citations, oa_codes, list(oa_statuses), matched=matched, store=store_path)
+
+
+def write(out: str, years: np.ndarray, citations: np.ndarray, oa_codes: np.ndarray, oa_names, **meta):
+    """Write bitmaps of per-row attribute columns: publication year (0 where unknown),
+    cited_by_count (-1 where unknown) and an index into oa_names (-1 where unknown).
+
+    One bitmap per year, per citation bucket and per oa_status, citations.npy with the
+    exact counts for the buckets a range cuts through, and meta.json.
+    """
+    n = len(years)
+    buckets = np.searchsorted(CITATION_EDGES, citations, side="right").astype(np.int16) - 1
+
+    os.makedirs(out, exist_ok=True)
+    np.save(os.path.join(out, "citations.npy"), citations.astype(np.int32))
+    _save_bitmaps(os.path.join(out, "years.npz"), _bitmaps_by_value(years, missing=0))
+    _save_bitmaps(os.path.join(out, "citation_buckets.npz"), _bitmaps_by_value(buckets, missing=-1))
+    _save_bitmaps(os.path.join(out, "oa_status.npz"),
+                  {oa_names[code]: bitmap for code, bitmap in _bitmaps_by_value(oa_codes, missing=-1).items()})
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump(dict(meta, count=n, citation_edges=list(CITATION_EDGES), oa_statuses=sorted(oa_names)), f)
+    logging.info(f"Wrote attribute bitmaps for {n} papers to {out}")
+
+
+class AttributeIndex:
+    """Year, citation and open-access bitmaps over the rows of the EmbeddingStore they
+    were built from. Every bitmap is loaded into memory, they are a few bytes per row."""
+
+    def __init__(self, path: str, store, cache_size: int = 256):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["count"] != len(store):
+            raise ValueError(f"Attribute index at {path} has {self.meta['count']} rows but the store has {len(store)}")
+        self.store = store
+        self.edges = np.asarray(self.meta["citation_edges"], dtype=np.int64)
+        self.citations = np.load(os.path.join(path, "citations.npy"), mmap_mode="r")
+        self.years = {int(y): b for y, b in _load_bitmaps(os.path.join(path, "years.npz")).items()}
+        self.citation_buckets = {int(b): bitmap
+                                 for b, bitmap in _load_bitmaps(os.path.join(path, "citation_buckets.npz")).items()}
+        self.oa_status = _load_bitmaps(os.path.join(path, "oa_status.npz"))
+        # the same few filters come back again and again, keep their combined bitmaps
+        self._selections = TTLCache(maxsize=cache_size, ttl=float("inf"))
+        self._lock = threading.Lock()
+
+    def _year_range(self, year_from: Optional[int], year_to: Optional[int]) -> Bitmap:
+        return Bitmap.union(b for y, b in self.years.items()
+                            if (year_from is None or y >= year_from) and (year_to is None or y <= year_to))
+
+    def _citation_range(self, low: Optional[int], high: Optional[int]) -> Bitmap:
+        low = 0 if low is None else low
+        high = np.iinfo(np.int32).max if high is None else high
+        parts = []
+        for bucket, bitmap in self.citation_buckets.items():
+            bucket_low = self.edges[bucket]
+            bucket_high = self.edges[bucket + 1] - 1 if bucket + 1 < len(self.edges) else np.iinfo(np.int32).max
+            if bucket_high < low or bucket_low > high:
+                continue
+            if low <= bucket_low and bucket_high <= high:
+                parts.append(bitmap)
+            else:
+                rows = bitmap.to_rows()
+                counts = self.citations[rows]
+                parts.append(Bitmap.from_rows(rows[(counts >= low) & (counts <= high)]))
+        return Bitmap.union(parts)
+
+    def select(self, filters: SearchFilter) -> Optional[Bitmap]:
+        """Rows matching every predicate of the filter, None for an empty filter."""
+        if not filters:
+            return None
+        with self._lock:
+            selection = self._selections.get(filters)
+        if selection is not None:
+            return selection
+
+        parts = []
+        if filters.year_from is not None or filters.year_to is not None:
+            parts.append(self._year_range(filters.year_from, filters.year_to))
+        if filters.min_citations is not None or filters.max_citations is not None:
+            parts.append(self._citation_range(filters.min_citations, filters.max_citations))
+        if filters.oa_status:
+            parts.append(Bitmap.union(self.oa_status[s] for s in filters.oa_status if s in self.oa_status))
+        # intersect the smallest first, every step can only shrink the set
+        parts.sort(key=len)
+        selection = parts[0]
+        for part in parts[1:]:
+            selection = selection & part
+        with self._lock:
+            self._selections.set(filters, selection)
+        return selection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build year, citation and open-access bitmaps for filtered search")
+    parser.add_argument("--parquet", required=True, help="Parquet export of the works table")
+    parser.add_argument("--store", required=True, help="directory written by db.embedding_store")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    build(args.parquet, args.store, args.out)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
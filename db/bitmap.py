@@ -0,0 +1,165 @@
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+# roaring layout: row ids are split into chunks of 2^16 by their high bits, and each
+# chunk holds its low bits either as a sorted uint16 array or as a 2^16-bit bitset,
+# whichever is smaller
+_CHUNK_BITS = 16
+_WORDS = (1 << _CHUNK_BITS) // 64
+_ARRAY_MAX = 4096
+
+
+def _array_to_words(low: np.ndarray) -> np.ndarray:
+    words = np.zeros(_WORDS, dtype=np.uint64)
+    np.bitwise_or.at(words, low >> 6, np.left_shift(np.uint64(1), (low & 63).astype(np.uint64)))
+    return words
+
+
+def _words_to_array(words: np.ndarray) -> np.ndarray:
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _cardinality(container: np.ndarray) -> int:
+    if container.dtype == np.uint16:
+        return len(container)
+    return int(np.unpackbits(container.view(np.uint8)).sum())
+
+
+def _compact(container: np.ndarray) -> Optional[np.ndarray]:
+    """Pick the smaller representation; None for an empty container."""
+    if container.dtype == np.uint16:
+        return container if len(container) else None
+    count = _cardinality(container)
+    if count == 0:
+        return None
+    return _words_to_array(container) if count <= _ARRAY_MAX else container
+
+
+def _test_bits(words: np.ndarray, low: np.ndarray) -> np.ndarray:
+    return ((words[low >> 6] >> (low & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+
+class Bitmap:
+    """Compressed set of row ids with roaring-style containers."""
+
+    def __init__(self, containers: Optional[Dict[int, np.ndarray]] = None):
+        self.containers = containers or {}
+        self._words = None
+
+    @classmethod
+    def from_rows(cls, rows) -> "Bitmap":
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[rows >= 0]
+        containers = {}
+        highs = rows >> _CHUNK_BITS
+        bounds = np.flatnonzero(np.diff(highs)) + 1
+        for chunk in np.split(rows, bounds):
+            if len(chunk) == 0:
+                continue
+            low = (chunk & 0xFFFF).astype(np.uint16)
+            containers[int(chunk[0] >> _CHUNK_BITS)] = low if len(low) <= _ARRAY_MAX else _array_to_words(low)
+        return cls(containers)
+
+    def __len__(self) -> int:
+        return sum(_cardinality(c) for c in self.containers.values())
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            a, b = self.containers[high], other.containers[high]
+            if a.dtype == np.uint64 and b.dtype == np.uint64:
+                result = a & b
+            elif a.dtype == np.uint16 and b.dtype == np.uint16:
+                result = np.intersect1d(a, b, assume_unique=True)
+            else:
+                array, dense = (a, b) if a.dtype == np.uint16 else (b, a)
+                result = array[_test_bits(dense, array)]
+            result = _compact(result)
+            if result is not None:
+                containers[high] = result
+        return Bitmap(containers)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        containers = dict(self.containers)
+        for high, b in other.containers.items():
+            a = containers.get(high)
+            if a is None:
+                containers[high] = b
+                continue
+            if a.dtype == np.uint16 and b.dtype == np.uint16 and len(a) + len(b) <= _ARRAY_MAX:
+                containers[high] = np.union1d(a, b)
+            else:
+                words_a = a if a.dtype == np.uint64 else _array_to_words(a)
+                words_b = b if b.dtype == np.uint64 else _array_to_words(b)
+                containers[high] = _compact(words_a | words_b)
+        return Bitmap(containers)
+
+    @staticmethod
+    def union(bitmaps: Iterable["Bitmap"]) -> "Bitmap":
+        result = Bitmap()
+        for bitmap in bitmaps:
+            result = result | bitmap
+        return result
+
+    def to_rows(self) -> np.ndarray:
+        """Sorted int64 row ids."""
+        parts = []
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            low = container if container.dtype == np.uint16 else _words_to_array(container)
+            parts.append((np.int64(high) << _CHUNK_BITS) + low.astype(np.int64))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def to_words(self) -> np.ndarray:
+        """Uncompressed bitset over rows [0, 2^16 * (highest chunk + 1))."""
+        size = (max(self.containers) + 1) * _WORDS if self.containers else 0
+        words = np.zeros(size, dtype=np.uint64)
+        for high, container in self.containers.items():
+            words[high * _WORDS:(high + 1) * _WORDS] = \
+                container if container.dtype == np.uint64 else _array_to_words(container)
+        return words
+
+    def contains(self, rows) -> np.ndarray:
+        """Boolean mask of which rows are in the set.
+
+        Probes go through an uncompressed copy of the set, built on first use; a
+        bitmap is never modified, so the copy stays valid.
+        """
+        if self._words is None:
+            self._words = self.to_words()
+        rows = np.asarray(rows, dtype=np.int64)
+        word = rows >> 6
+        inside = word < len(self._words)
+        mask = np.zeros(len(rows), dtype=bool)
+        mask[inside] = _test_bits(self._words, rows[inside])
+        return mask
+
+    def to_arrays(self) -> dict:
+        """Flat arrays for np.savez; from_arrays() reverses it."""
+        highs = np.array(sorted(self.containers), dtype=np.int64)
+        dense = np.array([self.containers[h].dtype == np.uint64 for h in highs], dtype=bool)
+        arrays = [self.containers[h] for h, d in zip(highs, dense) if not d]
+        words = [self.containers[h] for h, d in zip(highs, dense) if d]
+        return {
+            "highs": highs,
+            "dense": dense,
+            "array_lengths": np.array([len(a) for a in arrays], dtype=np.int64),
+            "arrays": np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint16),
+            "words": np.concatenate(words) if words else np.empty(0, dtype=np.uint64),
+        }
+
+    @classmethod
+    def from_arrays(cls, highs, dense, array_lengths, arrays, words) -> "Bitmap":
+        containers = {}
+        array_offsets = np.concatenate([[0], np.cumsum(array_lengths)])
+        a = w = 0
+        for high, is_dense in zip(highs, dense):
+            if is_dense:
+                containers[int(high)] = words[w * _WORDS:(w + 1) * _WORDS]
+                w += 1
+            else:
+                containers[int(high)] = arrays[array_offsets[a]:array_offsets[a + 1]]
+                a += 1
+        return cls(containers)
@@ -0,0 +1,168 @@
+import json
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class TTLCache:
+    """LRU cache whose entries also expire after `ttl` seconds.
+
+    Evicts least-recently-used entries once either `maxsize` entries or
+    `max_bytes` (as measured by `sizeof`) is exceeded.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600.0, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = _json_size, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at, size = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if key in self._entries:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (value, self.clock() + self.ttl, size)
+        self.bytes += size
+        while len(self._entries) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self.bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
+
+
+class AsyncCache:
+    """TTLCache front for async loaders with single-flight request coalescing:
+    concurrent misses on the same key await one shared load.
+
+    The load runs in a task of its own, so a caller that is cancelled (e.g. its client
+    disconnected) stops waiting without cancelling it for the others; the result is
+    still cached when it arrives.
+    """
+
+    def __init__(self, cache: TTLCache, cache_none: bool = False):
+        self.cache = cache
+        self.cache_none = cache_none
+        self._in_flight = {}
+        self.coalesced = 0
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        value = await loader()
+        if value is not None or self.cache_none:
+            self.cache.set(key, value)
+        return value
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # mark retrieved so an exception nobody is left to await is not logged as unhandled
+            task.exception()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._load(key, loader))
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        return await asyncio.shield(task)
+
+    async def _load_many(self, keys: List[Hashable], loader: Callable[[List[Hashable]], Awaitable[Dict]]):
+        values = await loader(keys)
+        for key in keys:
+            value = values.get(key)
+            if value is not None or self.cache_none:
+                self.cache.set(key, value)
+        return values
+
+    @staticmethod
+    async def _pick(batch: asyncio.Task, key: Hashable):
+        return (await batch).get(key)
+
+    async def get_many(self, keys: Iterable[Hashable], loader: Callable[[List[Hashable]], Awaitable[Dict]]) -> Dict:
+        """{key: value} for every key. Keys already being loaded are awaited, the other
+        misses go to one `loader(misses)` call returning {key: value} (absent keys are
+        None), and each of them is in flight on its own so get_or_load and other
+        get_many callers coalesce onto the batch."""
+        found, waiting, misses = {}, {}, []
+        for key in dict.fromkeys(keys):
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                found[key] = value
+            elif key in self._in_flight:
+                self.coalesced += 1
+                waiting[key] = self._in_flight[key]
+            else:
+                misses.append(key)
+
+        if misses:
+            loop = asyncio.get_running_loop()
+            batch = loop.create_task(self._load_many(misses, loader))
+            for key in misses:
+                task = loop.create_task(self._pick(batch, key))
+                self._in_flight[key] = task
+                task.add_done_callback(functools.partial(self._done, key))
+                waiting[key] = task
+
+        if waiting:
+            values = await asyncio.shield(asyncio.gather(*waiting.values()))
+            found.update(zip(waiting, values))
+        return found
+
+    def stats(self) -> dict:
+        stats = self.cache.stats()
+        stats.update({"in_flight": len(self._in_flight), "coalesced": self.coalesced})
+        return stats
+
+
+_MISSING = object()
@@ -0,0 +1,210 @@
+import os
+import json
+import logging
+import argparse
+from typing import List, Optional
+
+import numpy as np
+
+
+def work_number(work: str) -> Optional[int]:
+    """'https://openalex.org/W2741809807' -> 2741809807."""
+    tail = work.rstrip("/").rsplit("/", 1)[-1]
+    if tail[:1] not in ("W", "w") or not tail[1:].isdigit():
+        return None
+    return int(tail[1:])
+
+
+def _parse_works(values) -> np.ndarray:
+    numbers = [work_number(v) for v in values if v]
+    return np.array([n for n in numbers if n is not None], dtype=np.int64)
+
+
+def _write_csr(path: str, name: str, src: np.ndarray, dst: np.ndarray, n_nodes: int):
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+    # drop duplicate edges the snapshot may repeat
+    if len(src):
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src, dst = src[keep], dst[keep]
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(src, minlength=n_nodes))
+    np.save(os.path.join(path, f"{name}_indptr.npy"), indptr)
+    np.save(os.path.join(path, f"{name}_indices.npy"), dst.astype(np.int32))
+
+
+def build(source: str, out: str):
+    """Build the citation graph from a Parquet export of the works table
+    (paper_id, doi, title, referenced_works, related_works).
+
+    Every OpenAlex work id seen, in the table or only as a reference, is interned
+    to a dense int32 node id; node ids follow the numeric part of the work id, so
+    node_ids.npy is sorted and lookups are a binary search.
+    """
+    import pyarrow.dataset as ds
+
+    os.makedirs(out, exist_ok=True)
+    dataset = ds.dataset(source, format="parquet")
+
+    papers, cites_src, cites_dst, related_src, related_dst, meta = [], [], [], [], [], {}
+    for batch in dataset.to_batches(columns=["paper_id", "doi", "title", "referenced_works", "related_works"]):
+        for row in batch.to_pylist():
+            paper = work_number(row["paper_id"] or "")
+            if paper is None:
+                continue
+            papers.append(paper)
+            meta[paper] = (row["doi"], row["title"])
+            refs = _parse_works(row["referenced_works"] or [])
+            cites_src.append(np.full(len(refs), paper, dtype=np.int64))
+            cites_dst.append(refs)
+            related = _parse_works(row["related_works"] or [])
+            related_src.append(np.full(len(related), paper, dtype=np.int64))
+            related_dst.append(related)
+
+    concat = lambda parts: np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+    cites_src, cites_dst = concat(cites_src), concat(cites_dst)
+    related_src, related_dst = concat(related_src), concat(related_dst)
+    node_ids = np.unique(np.concatenate([np.array(papers, dtype=np.int64), cites_dst, related_dst]))
+    n_nodes = len(node_ids)
+    if n_nodes >= 2 ** 31:
+        raise ValueError(f"{n_nodes} nodes do not fit int32 node ids")
+    logging.info(f"Interned {n_nodes} works, {len(cites_src)} citations from {len(papers)} papers")
+
+    np.save(os.path.join(out, "node_ids.npy"), node_ids)
+    intern = lambda works: np.searchsorted(node_ids, works).astype(np.int64)
+    cites_src, cites_dst = intern(cites_src), intern(cites_dst)
+    related_src, related_dst = intern(related_src), intern(related_dst)
+
+    _write_csr(out, "references", cites_src, cites_dst, n_nodes)
+    _write_csr(out, "cited_by", cites_dst, cites_src, n_nodes)
+    _write_csr(out, "related", related_src, related_dst, n_nodes)
+
+    # node metadata, empty for works only known as a reference
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    with open(os.path.join(out, "nodes.bin"), "wb") as f:
+        for node, work in enumerate(node_ids.tolist()):
+            encoded = b""
+            if work in meta:
+                doi, title = meta[work]
+                encoded = json.dumps({"doi": doi, "title": title}).encode("utf-8")
+                f.write(encoded)
+            offsets[node + 1] = offsets[node] + len(encoded)
+    np.save(os.path.join(out, "node_offsets.npy"), offsets)
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump({"nodes": n_nodes, "papers": len(papers), "citations": int(len(cites_src)),
+                   "source": source}, f)
+
+
+class _CSR:
+    def __init__(self, path: str, name: str):
+        self.indptr = np.load(os.path.join(path, f"{name}_indptr.npy"), mmap_mode="r")
+        self.indices = np.load(os.path.join(path, f"{name}_indices.npy"), mmap_mode="r")
+
+    def __getitem__(self, node: int) -> np.ndarray:
+        return np.asarray(self.indices[self.indptr[node]:self.indptr[node + 1]])
+
+    def degree(self, node: int) -> int:
+        return int(self.indptr[node + 1] - self.indptr[node])
+
+    def gather(self, nodes, max_fanout: Optional[int] = None) -> np.ndarray:
+        parts = [self[n] for n in nodes]
+        if max_fanout is not None:
+            parts = [p[:max_fanout] for p in parts]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+
+class CitationGraph:
+    """Memory-mapped CSR citation graph: references (outgoing), cited_by
+    (incoming) and OpenAlex related works, all over dense node ids."""
+
+    def __init__(self, path: str, max_fanout: int = 5000):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.node_ids = np.load(os.path.join(path, "node_ids.npy"), mmap_mode="r")
+        self.references = _CSR(path, "references")
+        self.cited_by = _CSR(path, "cited_by")
+        self.related = _CSR(path, "related")
+        self._node_offsets = np.load(os.path.join(path, "node_offsets.npy"), mmap_mode="r")
+        self._nodes = np.memmap(os.path.join(path, "nodes.bin"), dtype=np.uint8, mode="r") \
+            if self._node_offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+        # cap on neighbours expanded per node, so a hub paper cannot blow up a 2-hop query
+        self.max_fanout = max_fanout
+
+    def node_of(self, work: str) -> Optional[int]:
+        number = work_number(work)
+        if number is None:
+            return None
+        node = int(np.searchsorted(self.node_ids, number))
+        if node < len(self.node_ids) and self.node_ids[node] == number:
+            return node
+        return None
+
+    def work_of(self, node: int) -> str:
+        return f"https://openalex.org/W{int(self.node_ids[node])}"
+
+    def describe(self, node: int, **extra) -> dict:
+        raw = self._nodes[self._node_offsets[node]:self._node_offsets[node + 1]].tobytes()
+        info = json.loads(raw) if raw else {"doi": None, "title": None}
+        info["id"] = self.work_of(node)
+        info.update(extra)
+        return info
+
+    def _ranked(self, nodes: np.ndarray, exclude, limit: int) -> List[dict]:
+        if len(nodes) == 0:
+            return []
+        unique, counts = np.unique(nodes, return_counts=True)
+        keep = ~np.isin(unique, np.asarray(list(exclude), dtype=np.int64))
+        unique, counts = unique[keep], counts[keep]
+        top = np.argsort(-counts, kind="stable")[:limit]
+        return [self.describe(int(unique[i]), count=int(counts[i])) for i in top]
+
+    def neighbourhood(self, work: str, hops: int = 1, limit: int = 50) -> Optional[dict]:
+        """1-hop references/citations and, for hops=2, the works reachable in two
+        steps ranked by the number of paths to them."""
+        node = self.node_of(work)
+        if node is None:
+            return None
+        references = self.references[node]
+        cited_by = self.cited_by[node]
+        result = {
+            "paper": self.describe(node, references=self.references.degree(node),
+                                   cited_by=self.cited_by.degree(node)),
+            "references": [self.describe(int(n)) for n in references[:limit]],
+            "cited_by": [self.describe(int(n)) for n in cited_by[:limit]],
+        }
+        if hops >= 2:
+            first = np.concatenate([references, cited_by])
+            second = np.concatenate([self.references.gather(first, self.max_fanout),
+                                     self.cited_by.gather(first, self.max_fanout)])
+            result["two_hop"] = self._ranked(second, set(first.tolist()) | {node}, limit)
+        return result
+
+    def co_cited(self, work: str, limit: int = 20) -> Optional[List[dict]]:
+        """Works most often cited together with this one."""
+        node = self.node_of(work)
+        if node is None:
+            return None
+        citers = self.cited_by[node][:self.max_fanout]
+        return self._ranked(self.references.gather(citers, self.max_fanout), {node}, limit)
+
+    def bibliographically_coupled(self, work: str, limit: int = 20) -> Optional[List[dict]]:
+        """Works sharing the most references with this one."""
+        node = self.node_of(work)
+        if node is None:
+            return None
+        references = self.references[node]
+        return self._ranked(self.cited_by.gather(references, self.max_fanout), {node}, limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the CSR citation graph from a works table Parquet export")
+    parser.add_argument("--works", required=True, help="directory or gs:// prefix of the works Parquet export")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    build(args.works, args.out)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
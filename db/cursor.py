@@ -0,0 +1,76 @@
+import os
+import json
+import math
+import hmac
+import base64
+import hashlib
+import logging
+import secrets
+
+# deepest result a cursor may point at, bounds the top_k / rerank a later page asks for
+MAX_RESULT_DEPTH = int(os.environ.get("MAX_RESULT_DEPTH", "1000"))
+
+
+def _load_secret() -> bytes:
+    secret = os.environ.get("CURSOR_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    logging.warning("CURSOR_SECRET is not set, cursors are signed with a per-process key "
+                    "and do not carry over between instances or restarts")
+    return secrets.token_bytes(32)
+
+
+_secret = _load_secret()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode((text + "=" * (-len(text) % 4)).encode("ascii"))
+
+
+def _signature(payload: bytes, scope: str) -> bytes:
+    # the scope is signed along with the position, so a cursor only works for the query it came from
+    return hmac.new(_secret, payload + b"\0" + scope.encode("utf-8"), hashlib.sha256).digest()
+
+
+def encode_cursor(position: dict, scope: str) -> str:
+    """Opaque, URL-safe, signed token for a result position. `scope` identifies the
+    query the position belongs to."""
+    payload = json.dumps(position, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload, scope))}"
+
+
+def decode_cursor(token: str, scope: str, fields: dict) -> dict:
+    """The position in a cursor made by encode_cursor for the same scope. `fields` maps
+    each key the position must have, and no others, to its type."""
+    try:
+        payload_part, signature_part = token.split(".")
+        payload, signature = _b64decode(payload_part), _b64decode(signature_part)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if not hmac.compare_digest(signature, _signature(payload, scope)):
+        raise InvalidCursor("Cursor does not belong to this query")
+    try:
+        position = json.loads(payload)
+    except ValueError as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if not isinstance(position, dict) or set(position) != set(fields):
+        raise InvalidCursor("Malformed cursor")
+    for key, kind in fields.items():
+        value = position[key]
+        # bool is an int subclass, it is never a valid position value
+        if isinstance(value, bool) or not isinstance(value, kind):
+            raise InvalidCursor("Malformed cursor")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise InvalidCursor("Malformed cursor")
+    offset = position.get("offset")
+    if offset is not None and not 0 < offset < MAX_RESULT_DEPTH:
+        raise InvalidCursor(f"Cursor is past the maximum depth of {MAX_RESULT_DEPTH} results")
+    return position
@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import logging
+import argparse
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def _embedding_matrix(column) -> np.ndarray:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if hasattr(column, "combine_chunks"):
+        column = column.combine_chunks()
+    if pa.types.is_fixed_size_list(column.type):
+        # float32/float16 shards: a view of the Arrow values buffer
+        flat = column.flatten().to_numpy(zero_copy_only=False)
+        return flat.reshape(len(column), column.type.list_size)
+    # older shards store list<double>
+    flat = pc.list_flatten(column).to_numpy(zero_copy_only=False)
+    return flat.reshape(len(column), -1)
+
+
+def read_embeddings(source: str, dtype: str = "float32"):
+    """Load embedding shards into (doi Arrow array, one contiguous (n, dim) matrix).
+
+    The matrix is allocated once from the Parquet row counts and filled batch by
+    batch, so no per-row Python objects are created.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(source, format="parquet")
+    total = dataset.count_rows()
+    matrix, dois, position = None, [], 0
+    for batch in dataset.to_batches(columns=["doi", "embedding"]):
+        if batch.num_rows == 0:
+            continue
+        embeddings = _embedding_matrix(batch.column("embedding"))
+        if matrix is None:
+            matrix = np.empty((total, embeddings.shape[1]), dtype=dtype)
+        matrix[position:position + batch.num_rows] = embeddings
+        dois.append(batch.column("doi"))
+        position += batch.num_rows
+
+    if matrix is None:
+        raise ValueError(f"No embeddings found under {source}")
+    return pa.concat_arrays(dois), matrix[:position]
+
+
+def _fingerprint(path: str) -> str:
+    """Hash of a store's files, so tables built over a store can tell it was rebuilt."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ("doi_offsets.npy", "dois.bin", "embeddings.npy"):
+        with open(os.path.join(path, name), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compact(source: str, out: str, dtype: str = "float32"):
+    """Compact the embeddings Parquet shards into a DOI-sorted, memory-mappable store.
+
+    Writes embeddings.npy (one contiguous row per paper), dois.bin/doi_offsets.npy
+    (the sorted DOIs, so a row number is the DOI's rank) and meta.json with a hash of
+    their content.
+    Duplicate DOIs keep the copy from the last shard.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    os.makedirs(out, exist_ok=True)
+    fragments = list(ds.dataset(source, format="parquet").get_fragments())
+    if not fragments:
+        raise ValueError(f"No Parquet shards found under {source}")
+
+    doi_arrays = []
+    for fragment in fragments:
+        doi_arrays.append(fragment.to_table(columns=["doi"]).column("doi").combine_chunks()
+                          .cast(pa.large_binary()))
+    shard_sizes = [len(a) for a in doi_arrays]
+    all_dois = pa.concat_arrays(doi_arrays)
+    total = len(all_dois)
+    logging.info(f"Read {total} DOIs from {len(fragments)} shards")
+
+    # sort_indices is stable, so within a run of equal DOIs the last one is the newest shard
+    order = pc.sort_indices(all_dois).to_numpy()
+    sorted_dois = all_dois.take(pa.array(order))
+    keep = pc.is_valid(sorted_dois).to_numpy(zero_copy_only=False)
+    if total > 1:
+        same_as_next = pc.equal(sorted_dois.slice(0, total - 1), sorted_dois.slice(1)) \
+            .fill_null(False).to_numpy(zero_copy_only=False)
+        keep[:-1] &= ~same_as_next
+
+    count = int(keep.sum())
+    dest_of_source = np.full(total, -1, dtype=np.int64)
+    dest_of_source[order[keep]] = np.arange(count)
+
+    kept_dois = sorted_dois.filter(pa.array(keep))
+    offsets = np.frombuffer(kept_dois.buffers()[1], dtype=np.int64)[kept_dois.offset:kept_dois.offset + count + 1]
+    data = np.frombuffer(kept_dois.buffers()[2], dtype=np.uint8)[offsets[0]:offsets[-1]]
+    np.save(os.path.join(out, "doi_offsets.npy"), offsets - offsets[0])
+    data.tofile(os.path.join(out, "dois.bin"))
+
+    matrix = None
+    position = 0
+    for fragment, size in zip(fragments, shard_sizes):
+        embeddings = _embedding_matrix(fragment.to_table(columns=["embedding"]).column("embedding"))
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(os.path.join(out, "embeddings.npy"), mode="w+",
+                                               dtype=np.dtype(dtype), shape=(count, embeddings.shape[1]))
+        dest = dest_of_source[position:position + size]
+        mask = dest >= 0
+        matrix[dest[mask]] = embeddings[mask].astype(dtype)
+        position += size
+    matrix.flush()
+
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump({"count": count, "dim": int(matrix.shape[1]), "dtype": dtype, "source": source,
+                   "fingerprint": _fingerprint(out)}, f)
+    logging.info(f"Wrote {count} x {matrix.shape[1]} {dtype} embeddings to {out}")
+
+
+class EmbeddingStore:
+    """Read-only view over a compacted store; every array is memory-mapped, so
+    opening is cheap and worker processes share the page cache."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self._doi_offsets = np.load(os.path.join(path, "doi_offsets.npy"), mmap_mode="r")
+        self._doi_bytes = np.memmap(os.path.join(path, "dois.bin"), dtype=np.uint8, mode="r") \
+            if self._doi_offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @property
+    def fingerprint(self) -> str:
+        """Content hash written by compact(); stores compacted before it existed are hashed once here."""
+        if "fingerprint" not in self.meta:
+            logging.info(f"Hashing embedding store at {self.path}")
+            self.meta["fingerprint"] = _fingerprint(self.path)
+        return self.meta["fingerprint"]
+
+    def _doi_bytes_at(self, row: int) -> bytes:
+        return self._doi_bytes[self._doi_offsets[row]:self._doi_offsets[row + 1]].tobytes()
+
+    def doi_at(self, row: int) -> str:
+        return self._doi_bytes_at(row).decode("utf-8")
+
+    def row_of(self, doi: str) -> Optional[int]:
+        key = doi.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._doi_bytes_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self._doi_bytes_at(lo) == key:
+            return lo
+        return None
+
+    def rows_of(self, dois: Iterable[str]) -> np.ndarray:
+        """Row for each DOI, -1 where the DOI is not in the store."""
+        return np.array([r if (r := self.row_of(doi)) is not None else -1 for doi in dois], dtype=np.int64)
+
+    def get(self, doi: str) -> Optional[np.ndarray]:
+        row = self.row_of(doi)
+        if row is None:
+            return None
+        return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def take(self, rows) -> np.ndarray:
+        return np.asarray(self.vectors[np.asarray(rows)], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact embeddings Parquet shards into a memory-mapped store")
+    parser.add_argument("--parquet", required=True, help="directory or gs:// prefix of embeddings/parquet/data")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    args = parser.parse_args()
+    compact(args.parquet, args.out, dtype=args.dtype)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -0,0 +1,48 @@
+import logging
+import argparse
+
+# every works table the backend reads; the pipeline only adds columns to the one it writes
+WORKS_TABLES = (
+    "hazel-quanta-470113-h4.openAlexDataset.EWORKS",
+    "hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST",
+)
+
+# columns the backend selects that tables loaded by older pipeline runs lack
+COLUMNS = (
+    ("updated_date", "STRING"),
+    ("publication_year", "INT64"),
+)
+
+
+def statements(table: str):
+    return [f"ALTER TABLE `{table}` ADD COLUMN IF NOT EXISTS {name} {kind}" for name, kind in COLUMNS]
+
+
+def migrate(client, tables=WORKS_TABLES):
+    """Add the missing columns to the works tables. Existing rows get NULL, which the
+    backend reads as unknown, and running it again is a no-op."""
+    for table in tables:
+        for sql in statements(table):
+            logging.info(sql)
+            client.query(sql).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the columns the backend reads to the works tables; "
+                                                 "run before deploying a backend that selects them")
+    parser.add_argument("--tables", nargs="+", default=list(WORKS_TABLES))
+    parser.add_argument("--dry-run", action="store_true", help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        for table in args.tables:
+            print(";\n".join(statements(table)) + ";")
+        return
+
+    from google.cloud import bigquery
+    migrate(bigquery.Client(), args.tables)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
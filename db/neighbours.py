@@ -0,0 +1,191 @@
+import os
+import json
+import logging
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from db.ann import _normalize
+from db.embedding_store import EmbeddingStore
+
+
+def _normalized_block(vectors, start: int, end: int) -> np.ndarray:
+    block = np.asarray(vectors[start:end], dtype=np.float32)
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k: int):
+    """Keep the k highest scores per query row out of the running best and a new block."""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    return scores, rows
+
+
+def _exact_block(store_path: str, out: str, start: int, end: int, k: int, corpus_block: int):
+    """Exact top-k for query rows [start, end) against the whole store, written into the
+    memory-mapped output. Runs in a worker process."""
+    store = EmbeddingStore(store_path)
+    queries = _normalized_block(store.vectors, start, end)
+    n = len(store)
+    best_scores = np.full((end - start, 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((end - start, 0), dtype=np.int32)
+
+    for c_start in range(0, n, corpus_block):
+        c_end = min(c_start + corpus_block, n)
+        scores = queries @ _normalized_block(store.vectors, c_start, c_end).T
+        # a paper is not its own neighbour
+        overlap_start, overlap_end = max(start, c_start), min(end, c_end)
+        if overlap_start < overlap_end:
+            diagonal = np.arange(overlap_start, overlap_end)
+            scores[diagonal - start, diagonal - c_start] = -np.inf
+
+        block_k = min(k, c_end - c_start)
+        top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+        best_scores, best_rows = _merge_top_k(best_scores, best_rows, np.take_along_axis(scores, top, axis=1),
+                                              (top + c_start).astype(np.int32), k)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    # stores with fewer than k + 1 papers leave -inf padding, marked as row -1
+    best_rows[~np.isfinite(best_scores)] = -1
+
+    neighbours = np.load(os.path.join(out, "neighbours.npy"), mmap_mode="r+")
+    distances = np.load(os.path.join(out, "distances.npy"), mmap_mode="r+")
+    neighbours[start:end] = best_rows
+    distances[start:end] = np.where(best_rows >= 0, 1.0 - best_scores, np.inf).astype(np.float16)
+    neighbours.flush()
+    distances.flush()
+    return end - start
+
+
+def build(store_path: str, out: str, k: int = 50, query_block: int = 1024, corpus_block: int = 16384,
+          workers: Optional[int] = None):
+    """Exact cosine top-k neighbours of every paper in a compacted embedding store.
+
+    Query rows are split into blocks that run in parallel worker processes, one BLAS
+    thread each; every block is scored against the store corpus_block rows at a time
+    with a matrix product and a running top-k merge. Writes neighbours.npy (int32 store
+    rows), distances.npy (float16 cosine distances), both (n, k) and nearest first, and
+    meta.json with the store's fingerprint.
+    """
+    store = EmbeddingStore(store_path)
+    n = len(store)
+    k = min(k, max(n - 1, 1))
+    workers = workers or os.cpu_count() or 4
+    os.makedirs(out, exist_ok=True)
+    np.lib.format.open_memmap(os.path.join(out, "neighbours.npy"), mode="w+", dtype=np.int32, shape=(n, k)).flush()
+    np.lib.format.open_memmap(os.path.join(out, "distances.npy"), mode="w+", dtype=np.float16, shape=(n, k)).flush()
+
+    # parallelism comes from the processes, so each one's BLAS stays single-threaded;
+    # spawned workers read these when they import numpy
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+
+    blocks = [(start, min(start + query_block, n)) for start in range(0, n, query_block)]
+    logging.info(f"Computing top-{k} neighbours of {n} papers in {len(blocks)} blocks on {workers} processes")
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as executor:
+        futures = [executor.submit(_exact_block, store_path, out, start, end, k, corpus_block)
+                   for start, end in blocks]
+        for future in futures:
+            done += future.result()
+            logging.info(f"{done}/{n} papers done")
+
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump({"count": n, "k": k, "store": store_path, "store_fingerprint": store.fingerprint}, f)
+    logging.info(f"Wrote top-{k} neighbour table for {n} papers to {out}")
+
+
+class NeighbourTable:
+    """Memory-mapped precomputed neighbours; rows refer to the EmbeddingStore the table
+    was built from, which also resolves DOIs."""
+
+    def __init__(self, path: str, store):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["count"] != len(store):
+            raise ValueError(f"Neighbour table at {path} has {self.meta['count']} rows but the store has {len(store)}")
+        # a store rebuilt with the same number of papers shifts rows all the same
+        if "store_fingerprint" not in self.meta:
+            logging.warning(f"Neighbour table at {path} has no store fingerprint, rebuild it to have it checked")
+        elif self.meta["store_fingerprint"] != store.fingerprint:
+            raise ValueError(f"Neighbour table at {path} was built from a different embedding store, rebuild it")
+        self.store = store
+        self.neighbours = np.load(os.path.join(path, "neighbours.npy"), mmap_mode="r")
+        self.distances = np.load(os.path.join(path, "distances.npy"), mmap_mode="r")
+
+    @property
+    def k(self) -> int:
+        return self.neighbours.shape[1]
+
+    def _exact_distances(self, row: int, rows: np.ndarray) -> np.ndarray:
+        # scored like the live search, so a cursor from either continues in the other
+        query = _normalize(self.store.take([row]))[0]
+        return 1.0 - _normalize(self.store.take(rows)) @ query
+
+    def _hits(self, row: int, top_k: int, allowed=None, after=None):
+        rows = np.asarray(self.neighbours[row])
+        full = rows[-1] >= 0
+        keep = rows >= 0
+        if allowed is not None:
+            keep &= allowed.contains(rows)
+        rows = rows[keep]
+        # the float16 table only picks the candidates, results and cursors carry exact
+        # float32 distances
+        distances = self._exact_distances(row, rows)
+        if after is not None:
+            keep = (distances > after.distance) | ((distances == after.distance) & (rows > after.row))
+            rows, distances = rows[keep], distances[keep]
+        # a full row of neighbours with too few passing says nothing about the ones
+        # beyond k, that needs a live search
+        if len(rows) < top_k and full and (allowed is not None or after is not None):
+            return None
+        # ties go to the lower row as in the live search
+        top = np.lexsort((rows, distances))[:top_k]
+        return [(self.store.doi_at(int(r)), float(d)) for r, d in zip(rows[top], distances[top])]
+
+    def lookup(self, doi: str, top_k: int = 10, allowed=None, after=None):
+        """[(doi, distance)] nearest first, or None if the DOI is not in the table or
+        more neighbours are asked for than were precomputed. With an `allowed` Bitmap
+        only neighbours in it count, with a db.ann.SearchAfter only those ranked after
+        it; None then also means fewer than top_k of the precomputed ones passed."""
+        if top_k > self.k:
+            return None
+        row = self.store.row_of(doi)
+        if row is None:
+            return None
+        return self._hits(row, top_k, allowed, after)
+
+    def lookup_batch(self, dois, top_k: int = 10, allowed=None) -> dict:
+        """{doi: [(doi, distance)]}, {doi: None} where lookup would return None."""
+        if top_k > self.k:
+            return {doi: None for doi in dois}
+        return {doi: self._hits(row, top_k, allowed) if row >= 0 else None
+                for doi, row in zip(dois, self.store.rows_of(dois))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the exact top-k neighbours of every paper")
+    parser.add_argument("--store", required=True, help="directory written by db.embedding_store")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--query-block", type=int, default=1024)
+    parser.add_argument("--corpus-block", type=int, default=16384)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build(args.store, args.out, k=args.k, query_block=args.query_block, corpus_block=args.corpus_block,
+          workers=args.workers)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
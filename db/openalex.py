@@ -0,0 +1,124 @@
+import os
+import ssl
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import certifi
+import httpx
+
+from db.cache import TTLCache
+from db.telemetry import set_attributes, stage
+
+OPENALEX_API_URL = os.environ.get("OPENALEX_API_URL", "https://api.openalex.org")
+OPENALEX_MAILTO = os.environ.get("OPENALEX_MAILTO")
+OPENALEX_SELECT = "id,doi,title,publication_year"
+
+
+def openalex_id(work: str) -> str:
+    """'https://openalex.org/W123' or 'W123' -> 'W123'."""
+    return work.rstrip("/").rsplit("/", 1)[-1]
+
+
+class RelatedWorksHydrator:
+    """Resolves OpenAlex work ids to {title, doi, publication_year}.
+
+    Ids are looked up in a per-id cache, then optionally in our own works table,
+    and whatever is left is fetched from the OpenAlex API in batched
+    `filter=openalex_id:a|b|c` requests over one shared HTTP/2 client.
+    """
+
+    def __init__(self, base_url: str = OPENALEX_API_URL, batch_size: int = 50, max_concurrency: int = 8,
+                 timeout: float = 5.0, cache: Optional[TTLCache] = None,
+                 works_lookup: Optional[Callable[[List[str]], Awaitable[Dict[str, dict]]]] = None,
+                 mailto: Optional[str] = OPENALEX_MAILTO, verify=None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache = cache if cache is not None else TTLCache(maxsize=200000, ttl=24 * 3600)
+        self.works_lookup = works_lookup
+        self.mailto = mailto
+        self.verify = ssl.create_default_context(cafile=certifi.where()) if verify is None else verify
+        # e.g. an httpx.MockTransport standing in for the API in benchmarks
+        self.transport = transport
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.base_url.startswith("https://"),
+                verify=self.verify,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                transport=self.transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _fetch_batch(self, ids: List[str]) -> Dict[str, dict]:
+        client = self._get_client()
+        params = {"filter": "openalex_id:" + "|".join(ids), "per-page": len(ids), "select": OPENALEX_SELECT}
+        if self.mailto:
+            params["mailto"] = self.mailto
+        async with self._semaphore:
+            with stage("openalex.fetch_batch", **{"openalex.batch_size": len(ids)}) as span:
+                response = await client.get(f"{self.base_url}/works", params=params)
+                set_attributes(span, **{"http.status_code": response.status_code})
+        response.raise_for_status()
+        return {openalex_id(work["id"]): {"title": work.get("title"),
+                                          "doi": work.get("doi"),
+                                          "publication_year": work.get("publication_year")}
+                for work in response.json().get("results", [])}
+
+    async def _fetch(self, ids: List[str]) -> Dict[str, dict]:
+        batches = [ids[i:i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+        responses = await asyncio.gather(*[self._fetch_batch(batch) for batch in batches],
+                                         return_exceptions=True)
+        found = {}
+        for batch, response in zip(batches, responses):
+            if isinstance(response, Exception):
+                logging.warning(f"OpenAlex batch of {len(batch)} works failed: {response}")
+                continue
+            found.update(response)
+            # ids OpenAlex did not return are cached as empty so they are not asked for again
+            for work_id in batch:
+                self.cache.set(work_id, found.get(work_id, {}))
+        return found
+
+    async def hydrate(self, works: List[str]) -> List[dict]:
+        """Details of each work that has a DOI, in input order."""
+        ids = list(dict.fromkeys(openalex_id(w) for w in works or []))
+        details, missing = {}, []
+        for work_id in ids:
+            cached = self.cache.get(work_id)
+            if cached is None:
+                missing.append(work_id)
+            else:
+                details[work_id] = cached
+
+        if missing and self.works_lookup is not None:
+            try:
+                with stage("related_works.works_table"):
+                    local = await self.works_lookup(missing)
+            except Exception as e:
+                logging.warning(f"Works table lookup for related works failed: {e}")
+                local = {}
+            for work_id, work in local.items():
+                self.cache.set(work_id, work)
+            details.update(local)
+            missing = [work_id for work_id in missing if work_id not in local]
+
+        if missing:
+            with stage("openalex.fetch", **{"openalex.works": len(missing)}):
+                details.update(await self._fetch(missing))
+
+        return [details[work_id] for work_id in ids if details.get(work_id, {}).get("doi")]
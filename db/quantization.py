@@ -0,0 +1,346 @@
+import os
+import json
+import logging
+import argparse
+from typing import Optional
+
+import numpy as np
+
+from db.ann import IVFIndex, SearchAfter, _normalize
+from db.embedding_store import EmbeddingStore
+
+
+def _kmeans(x: np.ndarray, k: int, n_iter: int, rng) -> np.ndarray:
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _nearest(x, centroids)
+        counts = np.bincount(assignments, minlength=k)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.cumsum(counts) - counts
+        nonempty = counts > 0
+
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(x[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    return np.argmax(x @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+class ProductQuantizer:
+    """Splits each vector into m sub-vectors and stores the id of the nearest of
+    256 sub-centroids for each, i.e. m bytes per vector."""
+
+    kind = "pq"
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = codebooks.astype(np.float32)
+        self.m, self.ks, self.dsub = codebooks.shape
+
+    @property
+    def code_size(self) -> int:
+        return self.m
+
+    @classmethod
+    def train(cls, sample: np.ndarray, m: int = 48, ks: int = 256, n_iter: int = 20, seed: int = 0):
+        dim = sample.shape[1]
+        if dim % m:
+            raise ValueError(f"dimension {dim} is not divisible into {m} sub-vectors")
+        if len(sample) == 0:
+            raise ValueError("cannot train a product quantizer on an empty sample")
+        if ks > 256:
+            raise ValueError(f"{ks} sub-centroids do not fit in one byte")
+        if len(sample) < ks:
+            # k-means needs at least one training row per centroid
+            logging.warning(f"Only {len(sample)} training vectors, using {len(sample)} sub-centroids instead of {ks}")
+            ks = len(sample)
+        rng = np.random.default_rng(seed)
+        dsub = dim // m
+        codebooks = np.stack([_kmeans(sample[:, j * dsub:(j + 1) * dsub].copy(), ks, n_iter, rng)
+                              for j in range(m)])
+        return cls(codebooks)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = vectors[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = _nearest(sub, self.codebooks[j])
+        return codes
+
+    def scorer(self, query: np.ndarray):
+        """Approximate dot products of query against a block of codes."""
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, self.dsub))
+        columns = np.arange(self.m)
+        return lambda codes: table[columns, codes].sum(axis=1)
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["codebooks"])
+
+
+class ScalarQuantizer:
+    """Per-dimension 8-bit quantization, one byte per dimension."""
+
+    kind = "sq8"
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray):
+        self.low = low.astype(np.float32)
+        self.scale = scale.astype(np.float32)
+
+    @property
+    def code_size(self) -> int:
+        return len(self.low)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, **kwargs):
+        low, high = sample.min(axis=0), sample.max(axis=0)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        return cls(low, scale)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def scorer(self, query: np.ndarray):
+        weights = query * self.scale
+        bias = float(query @ self.low)
+        return lambda codes: codes.astype(np.float32) @ weights + bias
+
+    def state(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["low"], state["scale"])
+
+
+QUANTIZERS = {
+    ProductQuantizer.kind: ProductQuantizer,
+    ScalarQuantizer.kind: ScalarQuantizer,
+}
+
+
+class CompressedIndex:
+    """IVF index whose lists hold quantized codes instead of float vectors.
+
+    Candidates are ranked on the codes, then the best `rerank` of them are
+    re-scored with exact cosine similarity against the embedding store.
+    """
+
+    def __init__(self, quantizer, codes: np.ndarray, ivf: IVFIndex, default_rerank: int = 100):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.ivf = ivf
+        self.store = ivf.store
+        self.default_rerank = default_rerank
+
+    @classmethod
+    def build(cls, ivf: IVFIndex, kind: str = "pq", sample_size: int = 100000, seed: int = 0, **kwargs):
+        # vectors come straight from the store, the IVF only provides the list layout
+        store = ivf.store
+        rng = np.random.default_rng(seed)
+        n = len(ivf.rows)
+        sample_rows = np.sort(rng.choice(n, min(n, sample_size), replace=False))
+        sample = _normalize(store.take(sample_rows))
+        logging.info(f"Training {kind} quantizer on {len(sample)} vectors")
+        quantizer = QUANTIZERS[kind].train(sample, seed=seed, **kwargs)
+
+        codes = np.empty((n, quantizer.code_size), dtype=np.uint8)
+        for start in range(0, n, 65536):
+            codes[start:start + 65536] = quantizer.encode(_normalize(store.take(ivf.rows[start:start + 65536])))
+        return cls(quantizer, codes, ivf)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of everything search() reads besides the embedding store: the codes,
+        the quantizer and the IVF centroids and list layout."""
+        state = sum(np.asarray(value).nbytes for value in self.quantizer.state().values())
+        return int(self.codes.nbytes + state + self.ivf.centroids.nbytes
+                   + self.ivf.offsets.nbytes + self.ivf.rows.nbytes)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), self.codes)
+        np.savez(os.path.join(path, "quantizer.npz"), **self.quantizer.state())
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"kind": self.quantizer.kind,
+                       "count": len(self.codes),
+                       "code_size": self.quantizer.code_size,
+                       "default_rerank": self.default_rerank}, f)
+
+    @classmethod
+    def load(cls, path: str, ivf: IVFIndex):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with np.load(os.path.join(path, "quantizer.npz")) as state:
+            quantizer = QUANTIZERS[meta["kind"]].from_state(dict(state))
+        return cls(quantizer,
+                   np.load(os.path.join(path, "codes.npy"), mmap_mode="r"),
+                   ivf,
+                   default_rerank=meta.get("default_rerank", 100))
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: Optional[int] = None,
+               fraction: Optional[float] = None, rerank: Optional[int] = None,
+               exclude: Optional[int] = None, allowed=None, after: Optional[SearchAfter] = None):
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        nprobe = self.ivf.resolve_nprobe(nprobe, fraction)
+        rerank = max(top_k, rerank if rerank is not None else self.default_rerank)
+        if after is not None:
+            # the earlier pages came out of the reranked candidates too
+            rerank = max(rerank, after.offset + 1 + top_k)
+        if allowed is not None and len(allowed) <= self.ivf.exact_filter_limit(nprobe):
+            # few enough rows to score them all exactly against the store
+            rows = np.sort(allowed.to_rows())
+            exact = _normalize(self.store.take(rows)) @ q
+            return self.ivf._top_k([exact], [rows], top_k, exclude, after)
+
+        score = self.quantizer.scorer(q)
+        scores, slots = [], []
+        if allowed is None:
+            for lst in np.argpartition(-(self.ivf.centroids @ q), nprobe - 1)[:nprobe]:
+                start, end = self.ivf.offsets[lst], self.ivf.offsets[lst + 1]
+                if start == end:
+                    continue
+                scores.append(score(np.asarray(self.codes[start:end])))
+                slots.append(np.arange(start, end))
+        else:
+            # nearest lists first, past nprobe until enough allowed candidates to rerank
+            found = 0
+            for i, lst in enumerate(np.argsort(-(self.ivf.centroids @ q))):
+                if i >= nprobe and found >= rerank:
+                    break
+                start, end = self.ivf.offsets[lst], self.ivf.offsets[lst + 1]
+                keep = start + np.flatnonzero(allowed.contains(self.ivf.rows[start:end]))
+                if len(keep) == 0:
+                    continue
+                scores.append(score(np.asarray(self.codes[keep])))
+                slots.append(keep)
+                found += len(keep)
+        if not scores:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        scores = np.concatenate(scores)
+        rows = self.ivf.rows[np.concatenate(slots)]
+        if exclude is not None:
+            keep = rows != exclude
+            scores, rows = scores[keep], rows[keep]
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        candidates = rows[np.argpartition(-scores, min(rerank, len(scores)) - 1)[:rerank]]
+        candidates = np.sort(candidates)
+        exact = _normalize(self.store.take(candidates)) @ q
+        return self.ivf._top_k([exact], [candidates], top_k, after=after)
+
+    def search_doi(self, doi: str, top_k: int = 10, nprobe: Optional[int] = None,
+                   fraction: Optional[float] = None, rerank: Optional[int] = None, allowed=None,
+                   after: Optional[SearchAfter] = None):
+        row = self.store.row_of(doi)
+        if row is None:
+            return None
+        rows, distances = self.search(self.store.vectors[row], top_k=top_k, nprobe=nprobe,
+                                      fraction=fraction, rerank=rerank, exclude=row, allowed=allowed, after=after)
+        return [(self.store.doi_at(r), float(d)) for r, d in zip(rows, distances)]
+
+    def search_doi_batch(self, dois, top_k: int = 10, nprobe: Optional[int] = None,
+                         fraction: Optional[float] = None, rerank: Optional[int] = None, allowed=None) -> dict:
+        # the code scan is a table gather per query, there is no shared product to batch
+        return {doi: self.search_doi(doi, top_k=top_k, nprobe=nprobe, fraction=fraction, rerank=rerank,
+                                     allowed=allowed)
+                for doi in dois}
+
+
+def _exact_top_k(store: EmbeddingStore, query: np.ndarray, top_k: int, exclude: int) -> set:
+    q = _normalize(np.asarray(query, dtype=np.float32))
+    best_rows, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    for start in range(0, len(store), 262144):
+        scores = _normalize(np.asarray(store.vectors[start:start + 262144], dtype=np.float32)) @ q
+        rows = np.arange(start, start + len(scores))
+        best_rows = np.concatenate([best_rows, rows])
+        best_scores = np.concatenate([best_scores, scores])
+        keep = best_rows != exclude
+        best_rows, best_scores = best_rows[keep], best_scores[keep]
+        if len(best_scores) > top_k:
+            top = np.argpartition(-best_scores, top_k - 1)[:top_k]
+            best_rows, best_scores = best_rows[top], best_scores[top]
+    return set(best_rows.tolist())
+
+
+def evaluate(index: CompressedIndex, n_queries: int = 100, top_k: int = 10,
+             nprobe: Optional[int] = None, rerank: Optional[int] = None, seed: int = 0) -> dict:
+    """Compression ratio and recall@top_k of the IVF, code-only and re-ranked searches
+    against an exhaustive exact search."""
+    store = index.store
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(len(store), min(n_queries, len(store)), replace=False)
+
+    hits = {"codes_only": 0, "reranked": 0}
+    if index.ivf.vectors is not None:
+        hits["ivf_flat"] = 0
+    for row in queries:
+        query = store.vectors[row]
+        truth = _exact_top_k(store, query, top_k, exclude=row)
+        if "ivf_flat" in hits:
+            hits["ivf_flat"] += len(truth & set(index.ivf.search(query, top_k, nprobe=nprobe,
+                                                                 exclude=row)[0].tolist()))
+        hits["codes_only"] += len(truth & set(index.search(query, top_k, nprobe=nprobe, rerank=top_k,
+                                                           exclude=row)[0].tolist()))
+        hits["reranked"] += len(truth & set(index.search(query, top_k, nprobe=nprobe, rerank=rerank,
+                                                         exclude=row)[0].tolist()))
+
+    raw_bytes = store.dim * 4
+    bytes_per_vector = index.nbytes / len(store)
+    report = {
+        "kind": index.quantizer.kind,
+        "count": len(store),
+        "code_bytes_per_vector": index.quantizer.code_size,
+        "bytes_per_vector": bytes_per_vector,
+        "compression_ratio": raw_bytes / bytes_per_vector,
+        "index_mb": index.nbytes / 2 ** 20,
+        "float32_store_mb": len(store) * raw_bytes / 2 ** 20,
+        "nprobe": index.ivf.resolve_nprobe(nprobe),
+        "rerank": rerank if rerank is not None else index.default_rerank,
+        "queries": len(queries),
+    }
+    for name, hit in hits.items():
+        report[f"recall@{top_k}_{name}"] = hit / (len(queries) * top_k)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a quantized code store over an IVF index and report recall")
+    parser.add_argument("--store", required=True)
+    parser.add_argument("--index", required=True, help="IVF index directory written by db.ann")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--kind", choices=sorted(QUANTIZERS), default="pq")
+    parser.add_argument("--m", type=int, default=48, help="pq sub-vectors, i.e. bytes per vector")
+    parser.add_argument("--rerank", type=int, default=100)
+    parser.add_argument("--eval-queries", type=int, default=100)
+    parser.add_argument("--skip-ivf-flat", action="store_true",
+                        help="do not read the IVF's float vectors, nor report its recall")
+    args = parser.parse_args()
+
+    ivf = IVFIndex.load(args.index, EmbeddingStore(args.store), vectors=not args.skip_ivf_flat)
+    kwargs = {"m": args.m} if args.kind == "pq" else {}
+    index = CompressedIndex.build(ivf, kind=args.kind, **kwargs)
+    index.default_rerank = args.rerank
+    index.save(args.out)
+
+    report = evaluate(index, n_queries=args.eval_queries, rerank=args.rerank)
+    with open(os.path.join(args.out, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
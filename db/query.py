@@ -1,16 +1,110 @@
 import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import bigquery
 import logging
 
+from db.telemetry import record_query, stage, track_executor
+
+BIGQUERY_MAX_CONCURRENCY = int(os.environ.get("BIGQUERY_MAX_CONCURRENCY", "32"))
+# local index scans are CPU bound, running more of them at once than there are cores
+# only makes each one slower, so they get their own pool apart from the BigQuery one
+LOCAL_SEARCH_THREADS = int(os.environ.get("LOCAL_SEARCH_THREADS", str(os.cpu_count() or 1)))
+
+_client = None
+_client_lock = threading.Lock()
+
+_cpu_executor = ThreadPoolExecutor(max_workers=LOCAL_SEARCH_THREADS, thread_name_prefix="local-search")
+track_executor(_cpu_executor, "local_search")
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    return _cpu_executor
+
+
+def _on_cpu(func, *args, **kwargs):
+    """Run a CPU-bound index call on the local search pool and wait for it."""
+    if threading.current_thread().name.startswith("local-search"):
+        return func(*args, **kwargs)
+    # carry the caller's context over, so the call's stage nests under the request's span
+    context = contextvars.copy_context()
+    return _cpu_executor.submit(context.run, func, *args, **kwargs).result()
+
+
+def _new_client():
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    credentials, project = google.auth.default(scopes=bigquery.Client.SCOPE)
+    session = AuthorizedSession(credentials)
+    # the default pool keeps 10 connections, size it to the number of concurrent queries instead
+    adapter = HTTPAdapter(pool_connections=BIGQUERY_MAX_CONCURRENCY, pool_maxsize=BIGQUERY_MAX_CONCURRENCY)
+    session.mount("https://", adapter)
+    return bigquery.Client(project=project, credentials=credentials, _http=session)
+
+
+def get_client():
+    """The process-wide BigQuery client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _new_client()
+    return _client
+
+
+def set_client(client):
+    """Replace the shared client, e.g. with a local fake exposing query(sql, job_config).result()."""
+    global _client
+    _client = client
+
+
+def _run_query(name: str, sql_query: str, job_config, client=None):
+    """Run a query and wait for its first page, timed as the bigquery.<name> stage."""
+    client = client or get_client()
+    with stage(f"bigquery.{name}") as span:
+        queryJob = client.query(sql_query, job_config)
+        results = queryJob.result()
+        record_query(name, queryJob, span)
+    return results
+
 
 def _get_field(paper,field):
     return paper[field]
 
-def doiEntered(doi: str):
-    client = bigquery.Client()
+
+# fields a caller can project results to, and the works table columns each is read from
+DETAIL_FIELDS = {
+    'authors': ('authors',), 'author_ids': ('authors',), 'title': ('title',), 'abstract': ('abstract',),
+    'related_works': ('related_works',), 'referenced_works': ('referenced_works',), 'oa_url': ('oa_url',),
+    'cited_by_count': ('cited_by_count',), 'paper_id': ('paper_id',),
+}
+PAPER_FIELDS = {
+    'authors': ('authors',), 'title': ('title',), 'distance': (), 'doi': ('doi',), 'abstract': ('abstract',),
+    'year': ('publication_year', 'created_date'), 'citations': ('cited_by_count',),
+}
+TITLE_FIELDS = {'authors': ('authors',), 'title': ('title',), 'doi': ('doi',)}
+
+
+def _columns(field_columns: dict, fields=None, required=('doi',)):
+    """Works table columns to select for `fields`, all of them when fields is None."""
+    fields = field_columns if fields is None else fields
+    return list(dict.fromkeys([*required, *(column for field in fields for column in field_columns[field])]))
+
+
+def _project(paper: dict, fields=None, keep=()):
+    if fields is None:
+        return paper
+    return {key: value for key, value in paper.items() if key in fields or key in keep}
+
+
+def doiEntered(doi: str, fields=None):
     full_doi_url = f"https://doi.org/{doi}"
-    sql_query = """
-    SELECT * FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS` WHERE doi = @doi
+    sql_query = f"""
+    SELECT {", ".join(_columns(DETAIL_FIELDS, fields, required=()) or ["doi"])}
+    FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS` WHERE doi = @doi
     """
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
@@ -18,30 +112,25 @@ def doiEntered(doi: str):
         ]
     )
     try:
-        queryJob = client.query(sql_query, job_config=job_config)
-
-        results = queryJob.result() 
+        results = _run_query("doi_entered", sql_query, job_config)
 
         paper = next(results, None)
         if paper:
             logging.info("Paper is found")
-            authors = [author.get('name') for author in paper['authors']] 
-            author_ids = [author.get('id') for author in paper['authors']]
-            title = _get_field(paper, "title")
-            abstract = _get_field(paper,"abstract")
-            related_works = _get_field(paper,"related_works") 
-            referenced_works = _get_field(paper,"referenced_works") 
-            oa_url = _get_field(paper,"oa_url") 
-            cited_by_count = _get_field(paper,"cited_by_count")
-
-            return {'authors':authors,
-                    'author_ids': author_ids,
-                    'title': title, 
-                    'abstract': abstract, 
-                    'related_works': related_works, 
-                    'referenced_works': referenced_works,
-                    'oa_url': oa_url,
-                    'cited_by_count':cited_by_count}
+            selected = set(paper.keys())
+            field = lambda name: _get_field(paper, name) if name in selected else None
+            authors = paper['authors'] if 'authors' in selected else []
+            authors, author_ids = [author.get('name') for author in authors], [author.get('id') for author in authors]
+
+            return _project({'authors':authors,
+                             'author_ids': author_ids,
+                             'title': field("title"), 
+                             'abstract': field("abstract"), 
+                             'related_works': field("related_works"), 
+                             'referenced_works': field("referenced_works"),
+                             'oa_url': field("oa_url"),
+                             'cited_by_count': field("cited_by_count"),
+                             'paper_id': field("paper_id")}, fields)
         #This should return a dictionary of author_names, title and abstract
         else:
             logging.warning(f"No results found in BigQuery for DOI: {doi}")
@@ -51,51 +140,284 @@ def doiEntered(doi: str):
         logging.error(f"An exception occurred while querying for DOI {doi}: {e}", exc_info=True)
         return None
     
-def vectorSearch(doi: str): 
-    client = bigquery.Client()
-    #may need to tweak fraction of lists searched as we go
-    sql_query = """SELECT 
-        works.doi, 
-        works.title, 
-        works.authors, 
-        works.abstract,
-        results.distance
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "bigquery")
+LOCAL_INDEX_PATH = os.environ.get("LOCAL_INDEX_PATH", "index")
+EMBEDDING_STORE_PATH = os.environ.get("EMBEDDING_STORE_PATH", "embedding_store")
+COMPRESSED_INDEX_PATH = os.environ.get("COMPRESSED_INDEX_PATH", "compressed_index")
+TITLE_BACKEND = os.environ.get("TITLE_BACKEND", "bigquery")
+TITLE_INDEX_PATH = os.environ.get("TITLE_INDEX_PATH", "title_index")
+CITATION_GRAPH_PATH = os.environ.get("CITATION_GRAPH_PATH", "citation_graph")
+NEIGHBOUR_TABLE_PATH = os.environ.get("NEIGHBOUR_TABLE_PATH", "neighbour_table")
+# live search used by the precomputed backend for papers missing from the table
+NEIGHBOUR_FALLBACK_BACKEND = os.environ.get("NEIGHBOUR_FALLBACK_BACKEND", "bigquery")
+ATTRIBUTE_INDEX_PATH = os.environ.get("ATTRIBUTE_INDEX_PATH", "attribute_index")
+DEFAULT_FRACTION_LISTS = 0.10
+
+_embedding_store = None
+_local_index = None
+_compressed_index = None
+_title_index = None
+_citation_graph = None
+_neighbour_table = None
+_attribute_index = None
+
+
+def get_embedding_store():
+    global _embedding_store
+    if _embedding_store is None:
+        from db.embedding_store import EmbeddingStore
+        logging.info(f"Opening embedding store at {EMBEDDING_STORE_PATH}")
+        _embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH)
+    return _embedding_store
+
+
+def _get_local_index():
+    global _local_index
+    if _local_index is None:
+        from db.ann import IVFIndex
+        logging.info(f"Loading local vector index from {LOCAL_INDEX_PATH}")
+        _local_index = IVFIndex.load(LOCAL_INDEX_PATH, get_embedding_store())
+    return _local_index
+
+
+def _get_compressed_index():
+    global _compressed_index
+    if _compressed_index is None:
+        from db.quantization import CompressedIndex
+        from db.ann import IVFIndex
+        logging.info(f"Loading compressed vector index from {COMPRESSED_INDEX_PATH}")
+        # only the coarse centroids and list layout, candidates are reranked from the store
+        ivf = IVFIndex.load(LOCAL_INDEX_PATH, get_embedding_store(), vectors=False)
+        _compressed_index = CompressedIndex.load(COMPRESSED_INDEX_PATH, ivf)
+    return _compressed_index
+
+
+def _get_neighbour_table():
+    global _neighbour_table
+    if _neighbour_table is None:
+        from db.neighbours import NeighbourTable
+        logging.info(f"Loading neighbour table from {NEIGHBOUR_TABLE_PATH}")
+        _neighbour_table = NeighbourTable(NEIGHBOUR_TABLE_PATH, get_embedding_store())
+    return _neighbour_table
+
+
+def _get_attribute_index():
+    global _attribute_index
+    if _attribute_index is None:
+        from db.attributes import AttributeIndex
+        logging.info(f"Loading attribute index from {ATTRIBUTE_INDEX_PATH}")
+        _attribute_index = AttributeIndex(ATTRIBUTE_INDEX_PATH, get_embedding_store())
+    return _attribute_index
+
+
+def _allowedRows(filters):
+    """Bitmap of the store rows passing the filter, None when there is nothing to filter on."""
+    if not filters:
+        return None
+    with stage("attributes.select"):
+        return _get_attribute_index().select(filters)
+
+
+def worksByOpenAlexId(work_ids):
+    """{'W123': {title, doi, publication_year}} for the ids present in the works table.
+    Needs the publication_year column, see db.migrate_works."""
+    sql_query = """SELECT paper_id, doi, title, publication_year
+        FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS`
+        WHERE paper_id IN UNNEST(@paper_ids)"""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("paper_ids", "STRING",
+                                         [f"https://openalex.org/{work_id}" for work_id in work_ids]),
+        ]
+    )
+    works = {}
+    results = _run_query("works_by_openalex_id", sql_query, job_config)
+    with stage("parse.works_by_openalex_id"):
+        for row in results:
+            works[row['paper_id'].rsplit('/', 1)[-1]] = {
+                'title': row['title'],
+                'doi': row['doi'],
+                'publication_year': row['publication_year'],
+            }
+    return works
+
+
+def _get_title_index():
+    global _title_index
+    if _title_index is None:
+        from db.title_index import TitleIndex
+        logging.info(f"Loading title index from {TITLE_INDEX_PATH}")
+        _title_index = TitleIndex(TITLE_INDEX_PATH)
+    return _title_index
+
+
+def get_citation_graph():
+    global _citation_graph
+    if _citation_graph is None:
+        from db.citation_graph import CitationGraph
+        logging.info(f"Loading citation graph from {CITATION_GRAPH_PATH}")
+        _citation_graph = CitationGraph(CITATION_GRAPH_PATH)
+    return _citation_graph
+
+
+def _worksByDoi(client, dois, fields=None):
+    sql_query = f"""SELECT {", ".join(_columns(PAPER_FIELDS, fields))}
+        FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST`
+        WHERE doi IN UNNEST(@dois)"""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("dois", "STRING", dois),
+        ]
+    )
+    results = _run_query("works_by_doi", sql_query, job_config, client=client)
+    with stage("parse.works_by_doi"):
+        return {row['doi']: row for row in results}
+
+
+def _paperFromRow(row, distance, fields=None):
+    """A search result from a works row holding the columns of `fields`. doi and distance
+    are always kept, results are keyed and paged by them."""
+    paper = {'distance': distance, 'doi': row['doi']}
+    if fields is None or 'authors' in fields:
+        paper['authors'] = [author.get('name') for author in row['authors']]
+    if fields is None or 'title' in fields:
+        paper['title'] = row['title']
+    if fields is None or 'abstract' in fields:
+        paper['abstract'] = row['abstract']
+    if fields is None or 'year' in fields:
+        # rows merged before publication_year was ingested only have the record's created_date
+        created_date = row['created_date']
+        paper['year'] = row['publication_year'] or (int(created_date[:4]) if created_date else None)
+    if fields is None or 'citations' in fields:
+        paper['citations'] = row['cited_by_count']
+    return paper
+
+
+def _worksJoin(fields, extra: str = ""):
+    """SELECT list and joined works subquery of a VECTOR_SEARCH over only the columns
+    `fields` needs, so an unread abstract is neither scanned nor sent back."""
+    columns = _columns(PAPER_FIELDS, fields)
+    select = ",\n        ".join([*(f"works.{c}" for c in columns), "results.distance"])
+    return extra + select, f"""JOIN (
+            SELECT {", ".join(columns)}
+            FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST`
+        ) AS works"""
+
+
+def _filterConditions(filters, alias: str):
+    """WHERE conditions and query parameters of a SearchFilter over the works table."""
+    conditions, params = [], []
+    year = f"COALESCE({alias}.publication_year, SAFE_CAST(SUBSTR({alias}.created_date, 1, 4) AS INT64))"
+    if filters.year_from is not None:
+        conditions.append(f"{year} >= @year_from")
+        params.append(bigquery.ScalarQueryParameter("year_from", "INT64", filters.year_from))
+    if filters.year_to is not None:
+        conditions.append(f"{year} <= @year_to")
+        params.append(bigquery.ScalarQueryParameter("year_to", "INT64", filters.year_to))
+    if filters.min_citations is not None:
+        conditions.append(f"{alias}.cited_by_count >= @min_citations")
+        params.append(bigquery.ScalarQueryParameter("min_citations", "INT64", filters.min_citations))
+    if filters.max_citations is not None:
+        conditions.append(f"{alias}.cited_by_count <= @max_citations")
+        params.append(bigquery.ScalarQueryParameter("max_citations", "INT64", filters.max_citations))
+    if filters.oa_status:
+        conditions.append(f"{alias}.oa_status IN UNNEST(@oa_status)")
+        params.append(bigquery.ArrayQueryParameter("oa_status", "STRING", list(filters.oa_status)))
+    return conditions, params
+
+
+def _vectorSearchBase(filters):
+    """Base table argument of VECTOR_SEARCH and its query parameters. A filter becomes a
+    subquery, so BigQuery ranks only the matching papers instead of the top k being
+    filtered afterwards; it may search such a subquery without the vector index."""
+    if not filters:
+        return "TABLE `hazel-quanta-470113-h4.openAlexDataset.EMBED_TEST`", []
+    conditions, params = _filterConditions(filters, "w")
+    return f"""(SELECT e.doi, e.embedding
+                FROM `hazel-quanta-470113-h4.openAlexDataset.EMBED_TEST` AS e
+                JOIN `hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST` AS w ON e.doi = w.doi
+                WHERE {" AND ".join(conditions)})""", params
+
+
+# keys and types of a search position, what db.cursor.decode_cursor checks cursors against
+SEARCH_POSITION = {'distance': (int, float), 'doi': str, 'offset': int}
+
+
+def _afterOffset(after) -> int:
+    """How many results precede the page after `after`. Bounded, since BigQuery and the
+    compressed index's rerank fetch that many again."""
+    from db.cursor import MAX_RESULT_DEPTH
+    if after is None:
+        return 0
+    offset = int(after['offset'])
+    if not 0 < offset < MAX_RESULT_DEPTH:
+        raise ValueError(f"Result offset {offset} is outside (0, {MAX_RESULT_DEPTH})")
+    return offset
+
+
+def _afterCondition(after):
+    """Keyset condition and query parameters resuming a distance-ordered search after
+    the position {distance, doi, offset} of the previous page's last paper. Ties on
+    distance go by DOI, the order of the local store's rows."""
+    if after is None:
+        return "", []
+    return ("AND (results.distance > @after_distance OR "
+            "(results.distance = @after_distance AND works.doi > @after_doi))"), [
+        bigquery.ScalarQueryParameter("after_distance", "FLOAT64", float(after["distance"])),
+        bigquery.ScalarQueryParameter("after_doi", "STRING", after["doi"]),
+    ]
+
+
+def _searchAfter(after):
+    """db.ann.SearchAfter of a {distance, doi, offset} position, for the local indexes."""
+    if after is None:
+        return None
+    from db.ann import SearchAfter
+    row = get_embedding_store().row_of(after["doi"])
+    return SearchAfter(float(after["distance"]), -1 if row is None else row, _afterOffset(after))
+
+
+def _bigqueryVectorSearch(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None, filters=None,
+                          after=None, fields=None):
+    fraction = float(fraction or DEFAULT_FRACTION_LISTS)
+    base_table, filter_params = _vectorSearchBase(filters)
+    select, works_join = _worksJoin(fields)
+    after_condition, after_params = _afterCondition(after)
+    # VECTOR_SEARCH has no offset, a later page asks for the earlier ones again and skips them
+    offset = _afterOffset(after)
+    # the query paper itself comes back at distance 0 and is filtered out below
+    sql_query = f"""SELECT 
+        {select}
     FROM 
         VECTOR_SEARCH(
-            TABLE `hazel-quanta-470113-h4.openAlexDataset.EMBED_TEST`,
+            {base_table},
             'embedding',
             (SELECT embedding FROM `hazel-quanta-470113-h4.openAlexDataset.EMBED_TEST` WHERE doi = @doi),
-            top_k => 10,
+            top_k => {offset + int(top_k) + 1},
             distance_type => 'COSINE',
-            options => '{"fraction_lists_to_search": 0.10}'  
+            options => '{{"fraction_lists_to_search": {fraction}}}'  
         ) AS results
-        JOIN (
-            SELECT doi, authors, title, abstract 
-            FROM `hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST`
-        ) AS works
+        {works_join}
             ON results.base.doi = works.doi
-        WHERE results.distance > 0
-        ORDER BY results.distance ASC;"""
+        WHERE results.distance > 0 {after_condition}
+        ORDER BY results.distance ASC, works.doi ASC
+        LIMIT {int(top_k)};"""
 
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("doi", "STRING", doi),
+            *filter_params,
+            *after_params,
         ]
     )
     logging.info(f"trying to find reccomendations for {doi}")
     try:
-        queryJob = client.query(sql_query, job_config)
-        results = queryJob.result()
+        results = _run_query("vector_search", sql_query, job_config)
         papers = []
         
-        for row in results:
-            author_names = [author.get('name') for author in row['authors']]  
-            paper_title = row['title']  
-            distance = row['distance']    
-            doi = row['doi']  
-            abstract = row['abstract']  
-            paper = {'authors': author_names, 'title': paper_title, 'distance': distance, 'doi': doi, 'abstract': abstract}
-            papers.append(paper)
+        with stage("parse.vector_search"):
+            for row in results:
+                papers.append(_paperFromRow(row, row['distance'], fields))
         
         return papers
 
@@ -103,22 +425,317 @@ def vectorSearch(doi: str):
         return None
 
 
-def titledPaper(title: str):
-    client = bigquery.Client()
-    sql_query = """SELECT
-            t.title,
-            t.doi,
-            t.authors
+# the index calls below run on the local search pool, see _on_cpu
+
+def _indexSearchDoi(get_index, doi: str, top_k: int, nprobe: int, fraction: float, filters, after):
+    allowed = _allowedRows(filters)
+    with stage("index.search"):
+        return get_index().search_doi(doi, top_k=top_k, nprobe=nprobe, fraction=fraction, allowed=allowed,
+                                      after=_searchAfter(after))
+
+
+def _indexSearchEmbedding(get_index, embedding, top_k: int, nprobe: int, fraction: float, filters, after):
+    index = get_index()
+    allowed = _allowedRows(filters)
+    with stage("index.search"):
+        rows, distances = index.search(embedding, top_k=top_k, nprobe=nprobe, fraction=fraction, allowed=allowed,
+                                       after=_searchAfter(after))
+    return [(index.store.doi_at(int(r)), float(d)) for r, d in zip(rows, distances)]
+
+
+def _indexSearchDoiBatch(get_index, dois, top_k: int, nprobe: int, fraction: float, filters):
+    allowed = _allowedRows(filters)
+    with stage("index.search_batch"):
+        return get_index().search_doi_batch(list(dois), top_k=top_k, nprobe=nprobe, fraction=fraction,
+                                            allowed=allowed)
+
+
+def _neighbourLookup(doi: str, top_k: int, filters, after):
+    allowed = _allowedRows(filters)
+    with stage("neighbour_table.lookup"):
+        return _get_neighbour_table().lookup(doi, top_k=top_k, allowed=allowed, after=_searchAfter(after))
+
+
+def _neighbourLookupBatch(dois, top_k: int, filters):
+    allowed = _allowedRows(filters)
+    with stage("neighbour_table.lookup_batch"):
+        return _get_neighbour_table().lookup_batch(list(dois), top_k=top_k, allowed=allowed)
+
+
+def _titleIndexSearch(title: str, limit: int, after):
+    with stage("title_index.search"):
+        return _get_title_index().search_after(title, limit=limit, after=after)
+
+
+def _hydrateNeighbours(neighbours, works, fields=None):
+    papers = []
+    with stage("parse.hydrate_neighbours"):
+        for n_doi, distance in neighbours:
+            row = works.get(n_doi)
+            if row is None:
+                continue
+            papers.append(_paperFromRow(row, distance, fields))
+    return papers
+
+
+def _indexVectorSearch(get_index, doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                       filters=None, after=None, fields=None):
+    try:
+        neighbours = _on_cpu(_indexSearchDoi, get_index, doi, top_k=top_k, nprobe=nprobe, fraction=fraction,
+                             filters=filters, after=after)
+    except Exception as e:
+        logging.error(f"Local vector search failed for {doi}: {e}", exc_info=True)
+        neighbours = None
+
+    if neighbours is None:
+        logging.warning(f"{doi} not in local index, falling back to BigQuery")
+        return _bigqueryVectorSearch(doi, top_k=top_k, fraction=fraction, filters=filters, after=after,
+                                     fields=fields)
+
+    try:
+        works = _worksByDoi(get_client(), [n_doi for n_doi, _ in neighbours], fields)
+        return _hydrateNeighbours(neighbours, works, fields)
+
+    except Exception as e:
+        logging.error(f"Failed to load works for neighbours of {doi}: {e}", exc_info=True)
+        return None
+
+
+def _localVectorSearch(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None, filters=None,
+                       after=None, fields=None):
+    return _indexVectorSearch(_get_local_index, doi, top_k=top_k, fraction=fraction, nprobe=nprobe, filters=filters,
+                              after=after, fields=fields)
+
+
+def _compressedVectorSearch(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None, filters=None,
+                            after=None, fields=None):
+    return _indexVectorSearch(_get_compressed_index, doi, top_k=top_k, fraction=fraction, nprobe=nprobe,
+                              filters=filters, after=after, fields=fields)
+
+
+def _precomputedVectorSearch(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                             filters=None, after=None, fields=None):
+    # the table holds exact neighbours, so fraction and nprobe only matter for the fallback
+    try:
+        neighbours = _on_cpu(_neighbourLookup, doi, top_k=top_k, filters=filters, after=after)
+    except Exception as e:
+        logging.error(f"Neighbour table lookup failed for {doi}: {e}", exc_info=True)
+        neighbours = None
+
+    if neighbours is None:
+        logging.info(f"{doi} not in the neighbour table, running a live {NEIGHBOUR_FALLBACK_BACKEND} search")
+        return SEARCH_BACKENDS[NEIGHBOUR_FALLBACK_BACKEND](doi, top_k=top_k, fraction=fraction, nprobe=nprobe,
+                                                          filters=filters, after=after, fields=fields)
+
+    try:
+        works = _worksByDoi(get_client(), [n_doi for n_doi, _ in neighbours], fields)
+        return _hydrateNeighbours(neighbours, works, fields)
+
+    except Exception as e:
+        logging.error(f"Failed to load works for neighbours of {doi}: {e}", exc_info=True)
+        return None
+
+
+SEARCH_BACKENDS = {
+    "bigquery": _bigqueryVectorSearch,
+    "local": _localVectorSearch,
+    "compressed": _compressedVectorSearch,
+    "precomputed": _precomputedVectorSearch,
+}
+
+
+def vectorSearch(doi: str, top_k: int = 10, fraction: float = None, nprobe: int = None, backend: str = None,
+                 filters=None, after=None, fields=None):
+    # fraction is the share of IVF lists probed (both backends), nprobe overrides it for the local index;
+    # filters is a db.attributes.SearchFilter the neighbours must pass; after is the
+    # {distance, doi, offset} position of the previous page's last paper; fields, a subset
+    # of PAPER_FIELDS, limits what is read and returned for each neighbour
+    search = SEARCH_BACKENDS[backend or VECTOR_BACKEND]
+    return search(doi, top_k=top_k, fraction=fraction, nprobe=nprobe, filters=filters, after=after, fields=fields)
+
+
+def _bigqueryEmbeddingSearch(embedding, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                             filters=None, after=None, fields=None):
+    fraction = float(fraction or DEFAULT_FRACTION_LISTS)
+    base_table, filter_params = _vectorSearchBase(filters)
+    select, works_join = _worksJoin(fields)
+    after_condition, after_params = _afterCondition(after)
+    offset = _afterOffset(after)
+    sql_query = f"""SELECT
+        {select}
+    FROM
+        VECTOR_SEARCH(
+            {base_table},
+            'embedding',
+            (SELECT @embedding AS embedding),
+            top_k => {offset + int(top_k)},
+            distance_type => 'COSINE',
+            options => '{{"fraction_lists_to_search": {fraction}}}'
+        ) AS results
+        {works_join}
+            ON results.base.doi = works.doi
+        WHERE TRUE {after_condition}
+        ORDER BY results.distance ASC, works.doi ASC
+        LIMIT {int(top_k)};"""
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("embedding", "FLOAT64", [float(x) for x in embedding]),
+            *filter_params,
+            *after_params,
+        ]
+    )
+    results = _run_query("embedding_search", sql_query, job_config)
+    with stage("parse.embedding_search"):
+        return [_paperFromRow(row, row['distance'], fields) for row in results]
+
+
+def _indexEmbeddingSearch(get_index, embedding, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                          filters=None, after=None, fields=None):
+    neighbours = _on_cpu(_indexSearchEmbedding, get_index, embedding, top_k=top_k, nprobe=nprobe,
+                         fraction=fraction, filters=filters, after=after)
+    works = _worksByDoi(get_client(), [n_doi for n_doi, _ in neighbours], fields)
+    return _hydrateNeighbours(neighbours, works, fields)
+
+
+EMBEDDING_SEARCH_BACKENDS = {
+    "bigquery": _bigqueryEmbeddingSearch,
+    "local": lambda embedding, **kwargs: _indexEmbeddingSearch(_get_local_index, embedding, **kwargs),
+    "compressed": lambda embedding, **kwargs: _indexEmbeddingSearch(_get_compressed_index, embedding, **kwargs),
+}
+
+
+def vectorSearchByEmbedding(embedding, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                            backend: str = None, filters=None, after=None, fields=None):
+    """Papers nearest to a query embedding, e.g. an encoded free-text query. The
+    precomputed table only covers existing papers, so it searches its fallback instead."""
+    backend = backend or VECTOR_BACKEND
+    if backend == "precomputed":
+        backend = NEIGHBOUR_FALLBACK_BACKEND
+    return EMBEDDING_SEARCH_BACKENDS[backend](embedding, top_k=top_k, fraction=fraction, nprobe=nprobe,
+                                              filters=filters, after=after, fields=fields)
+
+
+def _bigqueryVectorSearchBatch(dois, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                               filters=None, fields=None):
+    fraction = float(fraction or DEFAULT_FRACTION_LISTS)
+    base_table, filter_params = _vectorSearchBase(filters)
+    select, works_join = _worksJoin(fields, extra="results.query.doi AS query_doi,\n        ")
+    # one VECTOR_SEARCH with a query table, top_k applies per query row
+    sql_query = f"""SELECT
+        {select}
+    FROM
+        VECTOR_SEARCH(
+            {base_table},
+            'embedding',
+            (SELECT doi, embedding FROM `hazel-quanta-470113-h4.openAlexDataset.EMBED_TEST`
+             WHERE doi IN UNNEST(@dois)),
+            'embedding',
+            top_k => {int(top_k) + 1},
+            distance_type => 'COSINE',
+            options => '{{"fraction_lists_to_search": {fraction}}}'
+        ) AS results
+        {works_join}
+            ON results.base.doi = works.doi
+        WHERE results.distance > 0
+        ORDER BY query_doi, results.distance ASC;"""
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("dois", "STRING", list(dois)),
+            *filter_params,
+        ]
+    )
+    results = {doi: None for doi in dois}
+    rows = _run_query("vector_search_batch", sql_query, job_config)
+    with stage("parse.vector_search_batch"):
+        for row in rows:
+            papers = results.get(row['query_doi'])
+            if papers is None:
+                papers = results[row['query_doi']] = []
+            if len(papers) < top_k:
+                papers.append(_paperFromRow(row, row['distance'], fields))
+    return results
+
+
+def _indexVectorSearchBatch(get_index, dois, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                            filters=None, fields=None):
+    neighbours = _on_cpu(_indexSearchDoiBatch, get_index, dois, top_k=top_k, nprobe=nprobe, fraction=fraction,
+                         filters=filters)
+    works = _worksByDoi(get_client(), list({n_doi for hits in neighbours.values() if hits
+                                            for n_doi, _ in hits}), fields)
+    results = {doi: _hydrateNeighbours(hits, works, fields) if hits is not None else None
+               for doi, hits in neighbours.items()}
+
+    missing = [doi for doi, papers in results.items() if papers is None]
+    if missing:
+        logging.warning(f"{len(missing)} DOIs not in local index, falling back to BigQuery")
+        results.update(_bigqueryVectorSearchBatch(missing, top_k=top_k, fraction=fraction, filters=filters,
+                                                  fields=fields))
+    return results
+
+
+def _precomputedVectorSearchBatch(dois, top_k: int = 10, fraction: float = None, nprobe: int = None,
+                                  filters=None, fields=None):
+    neighbours = _on_cpu(_neighbourLookupBatch, dois, top_k=top_k, filters=filters)
+    works = _worksByDoi(get_client(), list({n_doi for hits in neighbours.values() if hits
+                                            for n_doi, _ in hits}), fields)
+    results = {doi: _hydrateNeighbours(hits, works, fields) if hits is not None else None
+               for doi, hits in neighbours.items()}
+
+    missing = [doi for doi, papers in results.items() if papers is None]
+    if missing:
+        logging.info(f"{len(missing)} DOIs not in the neighbour table, running a live search")
+        results.update(BATCH_SEARCH_BACKENDS[NEIGHBOUR_FALLBACK_BACKEND](missing, top_k=top_k, fraction=fraction,
+                                                                         nprobe=nprobe, filters=filters,
+                                                                         fields=fields))
+    return results
+
+
+BATCH_SEARCH_BACKENDS = {
+    "bigquery": _bigqueryVectorSearchBatch,
+    "precomputed": _precomputedVectorSearchBatch,
+    "local": lambda dois, **kwargs: _indexVectorSearchBatch(_get_local_index, dois, **kwargs),
+    "compressed": lambda dois, **kwargs: _indexVectorSearchBatch(_get_compressed_index, dois, **kwargs),
+}
+
+
+def vectorSearchBatch(dois, top_k: int = 10, fraction: float = None, nprobe: int = None, backend: str = None,
+                      filters=None, fields=None):
+    """{doi: [papers]} for every requested DOI, None where the DOI has no embedding.
+    Raises if the batch query itself fails."""
+    search = BATCH_SEARCH_BACKENDS[backend or VECTOR_BACKEND]
+    return search(list(dict.fromkeys(dois)), top_k=top_k, fraction=fraction, nprobe=nprobe, filters=filters,
+                  fields=fields)
+
+
+def abstractsByDoi(dois):
+    """{doi: abstract} for the requested DOIs found in the works table, read on their own
+    so search results do not have to carry them."""
+    works = _worksByDoi(get_client(), list(dict.fromkeys(dois)), fields=('abstract',))
+    with stage("parse.abstracts"):
+        return {doi: row['abstract'] for doi, row in works.items()}
+
+
+def _bigqueryTitledPaper(title: str, limit: int = 10, after=None, fields=None):
+    """A page of papers whose title contains `title` in DOI order, and the position
+    {doi} of its last paper when there are more. Resuming after that DOI skips the
+    earlier pages in the scan instead of offsetting past them."""
+    sql_query = f"""SELECT
+            {", ".join(f"t.{c}" for c in _columns(TITLE_FIELDS, fields))}
         FROM
             `hazel-quanta-470113-h4.openAlexDataset.EWORKS_TEST` AS t
         WHERE
             LOWER(t.title) LIKE LOWER(CONCAT('%', @title, '%'))
-        LIMIT 10
+            {"AND t.doi > @after_doi" if after is not None else ""}
+        ORDER BY t.doi
+        LIMIT {int(limit) + 1}
     """
     
     job_config = bigquery.QueryJobConfig(
         query_parameters=[
             bigquery.ScalarQueryParameter("title", "STRING", title), 
+            *([bigquery.ScalarQueryParameter("after_doi", "STRING", after["doi"])] if after is not None else []),
         ]
     )
 
@@ -126,21 +743,61 @@ def titledPaper(title: str):
     
     try:
 
-        queryJob = client.query(sql_query, job_config) 
-        results = queryJob.result()
+        results = _run_query("titled_paper", sql_query, job_config)
         papers = []
 
-        for row in results:
-            authors = [author['name'] for author in row['authors']]
-            title = row['title']
-            doi = row['doi']
-            paper = {'authors': authors, 'title': title, 'doi':doi}
-            papers.append(paper)
+        with stage("parse.titled_paper"):
+            for row in results:
+                paper = {'doi': row['doi']}
+                if fields is None or 'authors' in fields:
+                    paper['authors'] = [author['name'] for author in row['authors']]
+                if fields is None or 'title' in fields:
+                    paper['title'] = row['title']
+                papers.append(paper)
 
-        if not papers:
-            return None
+        if len(papers) > limit:
+            papers = papers[:limit]
+            return papers, {'doi': papers[-1]['doi']}
+        return papers, None
 
-        return papers
+    except Exception as e:
+        return None, None
 
+
+def _localTitledPaper(title: str, limit: int = 10, after=None, fields=None):
+    try:
+        rank = (after['tier'], -after['score'], after['doc_id']) if after is not None else None
+        docs, position = _on_cpu(_titleIndexSearch, title, limit=limit, after=rank)
     except Exception as e:
-        return None
\ No newline at end of file
+        logging.error(f"Local title search failed for '{title}': {e}", exc_info=True)
+        return None, None
+    papers = [_project({'authors': doc['authors'], 'title': doc['title'], 'doi': doc['doi']}, fields, keep=('doi',))
+              for doc in docs]
+    if position is None:
+        return papers, None
+    tier, negative_score, doc_id = position
+    return papers, {'tier': int(tier), 'score': -float(negative_score), 'doc_id': int(doc_id)}
+
+
+TITLE_BACKENDS = {
+    "bigquery": _bigqueryTitledPaper,
+    "local": _localTitledPaper,
+}
+# keys and types of each backend's page position
+TITLE_POSITIONS = {
+    "bigquery": {'doi': str},
+    "local": {'tier': int, 'score': (int, float), 'doc_id': int},
+}
+
+
+def titledPaperPage(title: str, limit: int = 10, after=None, backend: str = None, fields=None):
+    """(papers, position) for one page of title matches; pass the position back as
+    `after` for the next page, it is None on the last one. Positions are specific to
+    the backend that returned them. fields is a subset of TITLE_FIELDS, doi is always kept."""
+    search = TITLE_BACKENDS[backend or TITLE_BACKEND]
+    return search(title, limit=limit, after=after, fields=fields)
+
+
+def titledPaper(title: str, backend: str = None):
+    papers, _ = titledPaperPage(title, backend=backend)
+    return papers or None
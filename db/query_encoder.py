@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from db.cache import TTLCache
+from db.telemetry import stage
+
+QUERY_MODEL_NAME = os.environ.get("QUERY_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+
+
+def normalize_query(text: str) -> str:
+    # the MiniLM tokenizer is uncased, so case and spacing do not change the embedding
+    return " ".join(text.lower().split())
+
+
+class QueryEncoder:
+    """Encodes search queries with the model the abstracts were embedded with.
+
+    The model is loaded once and kept warm. Concurrent encode() calls are collected into
+    micro-batches of up to max_batch_size, waiting at most max_wait_ms for the batch to
+    fill, and each batch is one forward pass on a dedicated thread. Query embeddings are
+    kept in an LRU, and identical queries already in flight share one slot in the batch.
+    """
+
+    def __init__(self, model_name: str = QUERY_MODEL_NAME, quantize: bool = False, max_batch_size: int = 32,
+                 max_wait_ms: float = 2.0, cache_size: int = 10000, num_threads: Optional[int] = None):
+        self.model_name = model_name
+        self.quantize = quantize
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_threads = num_threads
+        self.cache = TTLCache(maxsize=cache_size, ttl=float("inf"))
+        self.model = None
+        self.batches = 0
+        self.encoded = 0
+        # one forward pass at a time, torch parallelises inside it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-encoder")
+        self._queue = None
+        self._pending = {}
+        self._batcher = None
+
+    def load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        logging.info(f"Loading query encoder {self.model_name} (quantize={self.quantize})")
+        model = SentenceTransformer(self.model_name, device="cpu")
+        # same truncation as embedding_processor.py, so queries and abstracts share a space
+        model.max_seq_length = 128
+        if self.quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        # the first forward pass allocates, keep it off the first request
+        model.encode(["warm up"], show_progress_bar=False)
+        self.model = model
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=len(texts), show_progress_bar=False,
+                                 convert_to_numpy=True, normalize_embeddings=True)
+
+    async def encode(self, text: str) -> np.ndarray:
+        key = normalize_query(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        future = self._pending.get(key)
+        if future is None:
+            if self._batcher is None or self._batcher.done():
+                self._queue = asyncio.Queue()
+                self._batcher = asyncio.create_task(self._run_batches())
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait(key)
+        return await asyncio.shield(future)
+
+    async def _next_batch(self) -> List[str]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                with stage("query_encoder.encode", **{"query_encoder.batch_size": len(batch)}):
+                    embeddings = await loop.run_in_executor(self._executor, self._encode_batch, batch)
+            except Exception as e:
+                for key in batch:
+                    future = self._pending.pop(key, None)
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                        # mark retrieved in case every waiter was cancelled
+                        future.exception()
+                continue
+            self.batches += 1
+            self.encoded += len(batch)
+            for key, embedding in zip(batch, embeddings):
+                self.cache.set(key, embedding)
+                future = self._pending.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_result(embedding)
+
+    async def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return dict(self.cache.stats(), ready=self.ready, batches=self.batches, encoded=self.encoded,
+                    mean_batch_size=self.encoded / self.batches if self.batches else 0.0)
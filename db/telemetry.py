@@ -0,0 +1,106 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+try:
+    from opentelemetry import trace
+    _tracer = trace.get_tracer("paperrank")
+except ImportError:
+    # spans are optional, metrics are always on
+    trace = None
+    _tracer = None
+
+# request latencies are dominated by BigQuery round trips, so the buckets go up to 30s
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram("paperrank_request_seconds", "End to end request latency",
+                            ["endpoint", "method", "status"], buckets=_LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge("paperrank_requests_in_flight", "Requests being handled", ["endpoint"])
+STAGE_LATENCY = Histogram("paperrank_stage_seconds",
+                          "Latency of each downstream call and processing stage", ["stage"],
+                          buckets=_LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("paperrank_stage_errors_total", "Stages that raised", ["stage"])
+EXECUTOR_QUEUE_DEPTH = Gauge("paperrank_executor_queue_depth",
+                             "Blocking calls waiting for a thread of an executor", ["executor"])
+BIGQUERY_BYTES = Counter("paperrank_bigquery_bytes_processed_total", "Bytes processed by BigQuery",
+                         ["query"])
+BIGQUERY_BYTES_BILLED = Counter("paperrank_bigquery_bytes_billed_total", "Bytes billed by BigQuery",
+                                ["query"])
+BIGQUERY_SLOT_SECONDS = Counter("paperrank_bigquery_slot_seconds_total", "BigQuery slot time", ["query"])
+BIGQUERY_CACHE_HITS = Counter("paperrank_bigquery_cache_hits_total",
+                              "Queries answered from BigQuery's result cache", ["query"])
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a block into paperrank_stage_seconds{stage=name} and, when OpenTelemetry is
+    installed, wrap it in a span of the same name."""
+    start = time.perf_counter()
+    try:
+        if _tracer is None:
+            yield None
+        else:
+            # the span records the exception and sets an error status itself
+            with _tracer.start_as_current_span(name, attributes=attributes) as span:
+                yield span
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+
+def set_attributes(span, **attributes):
+    if span is not None:
+        span.set_attributes({k: v for k, v in attributes.items() if v is not None})
+
+
+def record_query(name: str, job, span=None):
+    """Bytes and slot time of a finished BigQuery job. Jobs without statistics (local
+    fakes, or a job that failed) are skipped."""
+    processed = getattr(job, "total_bytes_processed", None)
+    billed = getattr(job, "total_bytes_billed", None)
+    slot_millis = getattr(job, "slot_millis", None)
+    if processed:
+        BIGQUERY_BYTES.labels(name).inc(processed)
+    if billed:
+        BIGQUERY_BYTES_BILLED.labels(name).inc(billed)
+    if slot_millis:
+        BIGQUERY_SLOT_SECONDS.labels(name).inc(slot_millis / 1000)
+    if getattr(job, "cache_hit", None):
+        BIGQUERY_CACHE_HITS.labels(name).inc()
+    set_attributes(span, **{"bigquery.bytes_processed": processed, "bigquery.bytes_billed": billed,
+                            "bigquery.slot_millis": slot_millis, "bigquery.job_id": getattr(job, "job_id", None)})
+
+
+def track_executor(executor, name: str = "bigquery"):
+    # ThreadPoolExecutor keeps pending calls in a private SimpleQueue
+    EXECUTOR_QUEUE_DEPTH.labels(name).set_function(lambda: executor._work_queue.qsize())
+
+
+def metrics_payload():
+    """(body, content type) for a /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def configure_tracing(service_name: str = "paperrank-backend"):
+    """Export spans over OTLP when OTEL_EXPORTER_OTLP_ENDPOINT is set and the
+    OpenTelemetry SDK is installed; otherwise spans stay no-ops."""
+    if trace is None or not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logging.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK is not installed")
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    # batched export off the request path
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return True
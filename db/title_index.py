@@ -0,0 +1,318 @@
+import os
+import re
+import json
+import logging
+import argparse
+import unicodedata
+from array import array
+from collections import defaultdict
+from itertools import islice
+from typing import List, Optional
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_title(text: str) -> str:
+    """Case-folded, accent-insensitive title with punctuation collapsed to single spaces."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+def _trigrams(normalized: str):
+    return {normalized[i:i + 3] for i in range(len(normalized) - 2)}
+
+
+def encode_postings(doc_ids: np.ndarray) -> bytes:
+    """Delta + LEB128 varint encoding of a sorted doc id list."""
+    deltas = np.diff(np.asarray(doc_ids, dtype=np.uint64), prepend=np.uint64(0))
+    n_bytes = np.ones(len(deltas), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        n_bytes += deltas >= (np.uint64(1) << np.uint64(shift))
+
+    value_index = np.repeat(np.arange(len(deltas)), n_bytes)
+    position = np.arange(len(value_index)) - np.repeat(np.cumsum(n_bytes) - n_bytes, n_bytes)
+    out = ((deltas[value_index] >> (np.uint64(7) * position.astype(np.uint64))) & np.uint64(0x7F)).astype(np.uint8)
+    # every byte but the last of a value carries the continuation bit
+    out[position < n_bytes[value_index] - 1] |= 0x80
+    return out.tobytes()
+
+
+def decode_postings(buffer) -> np.ndarray:
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    values = (data & 0x7F).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+    return np.cumsum(np.add.reduceat(values, starts)).astype(np.int64)
+
+
+class SortedStrings:
+    """Memory-mapped sorted UTF-8 strings (blob + offsets) with binary search."""
+
+    def __init__(self, path: str, name: str):
+        self._offsets = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode="r")
+        self._bytes = np.memmap(os.path.join(path, f"{name}.bin"), dtype=np.uint8, mode="r") \
+            if self._offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+
+    @staticmethod
+    def write(path: str, name: str, strings: List[str]):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        np.save(os.path.join(path, f"{name}_offsets.npy"), offsets)
+        with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return self._bytes[self._offsets[i]:self._offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key: str) -> Optional[int]:
+        raw = key.encode("utf-8")
+        i = self.lower_bound(raw)
+        return i if i < len(self) and self.raw(i) == raw else None
+
+    def prefix_range(self, prefix: str):
+        raw = prefix.encode("utf-8")
+        start = self.lower_bound(raw)
+        end = start
+        while end < len(self) and self.raw(end).startswith(raw):
+            end += 1
+        return start, end
+
+
+class _Postings:
+    def __init__(self, path: str, name: str):
+        self.terms = SortedStrings(path, f"{name}_terms")
+        self.offsets = np.load(os.path.join(path, f"{name}_postings_offsets.npy"), mmap_mode="r")
+        self.df = np.load(os.path.join(path, f"{name}_df.npy"), mmap_mode="r")
+        self.data = np.memmap(os.path.join(path, f"{name}_postings.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+
+    @staticmethod
+    def write(path: str, name: str, postings: dict):
+        terms = sorted(postings, key=lambda t: t.encode("utf-8"))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        df = np.empty(len(terms), dtype=np.int64)
+        with open(os.path.join(path, f"{name}_postings.bin"), "wb") as f:
+            for i, term in enumerate(terms):
+                ids = np.frombuffer(postings[term], dtype=np.uint32)
+                encoded = encode_postings(ids)
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+                df[i] = len(ids)
+        SortedStrings.write(path, f"{name}_terms", terms)
+        np.save(os.path.join(path, f"{name}_postings_offsets.npy"), offsets)
+        np.save(os.path.join(path, f"{name}_df.npy"), df)
+
+    def doc_ids(self, term_index: int) -> np.ndarray:
+        return decode_postings(self.data[self.offsets[term_index]:self.offsets[term_index + 1]])
+
+    def lookup(self, term: str) -> Optional[int]:
+        return self.terms.find(term)
+
+
+def build(source: str, out: str):
+    """Build the title index from a Parquet export of the works table (doi, title, authors, cited_by_count).
+
+    Doc ids are assigned by descending cited_by_count, so every postings list is
+    already in popularity order.
+    """
+    import pyarrow.dataset as ds
+
+    os.makedirs(out, exist_ok=True)
+    dataset = ds.dataset(source, format="parquet")
+    columns = [c for c in ["doi", "title", "authors", "cited_by_count"] if c in dataset.schema.names]
+    table = dataset.to_table(columns=columns)
+    table = table.filter(table.column("title").is_valid())
+    if "cited_by_count" in columns:
+        table = table.sort_by([("cited_by_count", "descending")])
+    logging.info(f"Indexing {table.num_rows} titles from {source}")
+
+    token_postings = defaultdict(lambda: array("I"))
+    trigram_postings = defaultdict(lambda: array("I"))
+    docs = []
+    for batch in table.to_batches():
+        for row in batch.to_pylist():
+            doc_id = len(docs)
+            normalized = normalize_title(row["title"])
+            for token in set(normalized.split()):
+                token_postings[token].append(doc_id)
+            for trigram in _trigrams(normalized):
+                trigram_postings[trigram].append(doc_id)
+            authors = [a.get("name") for a in row.get("authors") or [] if a]
+            docs.append(json.dumps({"doi": row["doi"], "title": row["title"], "authors": authors}))
+
+    logging.info(f"Writing {len(token_postings)} token and {len(trigram_postings)} trigram postings")
+    _Postings.write(out, "token", token_postings)
+    _Postings.write(out, "trigram", trigram_postings)
+
+    offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    with open(os.path.join(out, "docs.bin"), "wb") as f:
+        for i, doc in enumerate(docs):
+            encoded = doc.encode("utf-8")
+            f.write(encoded)
+            offsets[i + 1] = offsets[i] + len(encoded)
+    np.save(os.path.join(out, "doc_offsets.npy"), offsets)
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump({"count": len(docs), "source": source}, f)
+
+
+class TitleIndex:
+    """Ranked title lookup: exact substring matches first (verified against the
+    title, candidates from trigram postings), then documents containing every
+    query token with the last one completed as a prefix, then any-token matches
+    ranked by idf. Ties keep doc id order, i.e. most cited first."""
+
+    def __init__(self, path: str, max_candidates: int = 20000, max_prefix_terms: int = 64):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.tokens = _Postings(path, "token")
+        self.trigrams = _Postings(path, "trigram")
+        self._doc_offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r")
+        self._docs = np.memmap(os.path.join(path, "docs.bin"), dtype=np.uint8, mode="r")
+        self.max_candidates = max_candidates
+        self.max_prefix_terms = max_prefix_terms
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def doc(self, doc_id: int) -> dict:
+        return json.loads(self._docs[self._doc_offsets[doc_id]:self._doc_offsets[doc_id + 1]].tobytes())
+
+    def _substring_candidates(self, normalized: str) -> np.ndarray:
+        terms = []
+        for trigram in _trigrams(normalized):
+            term = self.trigrams.lookup(trigram)
+            if term is None:
+                return np.empty(0, dtype=np.int64)
+            terms.append(term)
+        terms.sort(key=lambda t: self.trigrams.df[t])
+
+        candidates = self.trigrams.doc_ids(terms[0])
+        for term in terms[1:]:
+            if len(candidates) <= 64:
+                break
+            candidates = np.intersect1d(candidates, self.trigrams.doc_ids(term), assume_unique=True)
+        return candidates
+
+    def _prefix_docs(self, prefix: str) -> np.ndarray:
+        start, end = self.tokens.terms.prefix_range(prefix)
+        if start == end:
+            return np.empty(0, dtype=np.int64)
+        terms = np.arange(start, end)
+        if len(terms) > self.max_prefix_terms:
+            terms = terms[np.argsort(-np.asarray(self.tokens.df[start:end]))[:self.max_prefix_terms]]
+        return np.unique(np.concatenate([self.tokens.doc_ids(t) for t in terms]))
+
+    def _ranked(self, normalized: str, after: Optional[tuple] = None):
+        """(position, doc) in rank order. A position is (tier, -score, doc_id) and
+        ranking resumes strictly after `after`; a doc only shows up in its best tier."""
+        def resume(tier, doc_ids):
+            if after is None or after[0] < tier:
+                return doc_ids
+            if after[0] > tier:
+                return doc_ids[:0]
+            return doc_ids[np.searchsorted(doc_ids, after[2], side="right"):]
+
+        substring = np.empty(0, dtype=np.int64)
+        if len(normalized) >= 3:
+            substring = self._substring_candidates(normalized)[:self.max_candidates]
+        in_substring = set(substring.tolist())
+        is_substring = lambda doc_id, doc: doc_id in in_substring and normalized in normalize_title(doc["title"])
+
+        for doc_id in resume(0, substring):
+            doc = self.doc(int(doc_id))
+            if normalized in normalize_title(doc["title"]):
+                doc["score"] = 3.0
+                yield (0, -3.0, int(doc_id)), doc
+
+        # all complete tokens must match, the last one may still be being typed
+        tokens = normalized.split()
+        all_tokens = np.empty(0, dtype=np.int64)
+        found = [self.tokens.lookup(t) for t in tokens[:-1]]
+        if all(t is not None for t in found):
+            all_tokens = self._prefix_docs(tokens[-1])
+            for t in sorted(found, key=lambda t: self.tokens.df[t]):
+                if len(all_tokens) == 0:
+                    break
+                all_tokens = np.intersect1d(all_tokens, self.tokens.doc_ids(t), assume_unique=True)
+            all_tokens = all_tokens[:self.max_candidates]
+        for doc_id in resume(1, all_tokens):
+            doc = self.doc(int(doc_id))
+            if not is_substring(int(doc_id), doc):
+                doc["score"] = 2.0
+                yield (1, -2.0, int(doc_id)), doc
+
+        if len(tokens) < 2 or (after is not None and after[0] > 2):
+            return
+        scores = defaultdict(float)
+        for token in set(tokens):
+            term = self.tokens.lookup(token)
+            if term is None:
+                continue
+            idf = float(np.log(len(self) / self.tokens.df[term]))
+            for doc_id in self.tokens.doc_ids(term)[:self.max_candidates]:
+                scores[int(doc_id)] += idf
+        top = max(scores.values(), default=1.0) or 1.0
+        in_all_tokens = set(all_tokens.tolist())
+        for doc_id in sorted(scores, key=lambda d: (-scores[d], d)):
+            position = (2, -scores[doc_id] / top, doc_id)
+            if after is not None and after[0] == 2 and position[1:] <= tuple(after[1:]):
+                continue
+            if doc_id in in_all_tokens:
+                continue
+            doc = self.doc(doc_id)
+            if not is_substring(doc_id, doc):
+                doc["score"] = scores[doc_id] / top
+                yield position, doc
+
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> List[dict]:
+        normalized = normalize_title(query)
+        if not normalized:
+            return []
+        return [doc for _, doc in islice(self._ranked(normalized), offset, offset + limit)]
+
+    def search_after(self, query: str, limit: int = 10, after: Optional[tuple] = None):
+        """A page of search() that resumes after the position of the previous page's
+        last doc instead of ranking the earlier pages again. Returns (docs, position of
+        the last doc), the position is None on the last page."""
+        normalized = normalize_title(query)
+        if not normalized:
+            return [], None
+        page = list(islice(self._ranked(normalized, tuple(after) if after is not None else None), limit + 1))
+        more = len(page) > limit
+        page = page[:limit]
+        return [doc for _, doc in page], (list(page[-1][0]) if more else None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the title search index from a works table Parquet export")
+    parser.add_argument("--works", required=True, help="directory or gs:// prefix of the works Parquet export")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    build(args.works, args.out)
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
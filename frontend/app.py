@@ -1,7 +1,18 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import re
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# the image copies shared_modules next to app.py, a checkout has it one level up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_modules.flowers import display_influence_flower
 
 st.set_page_config(
     page_title="PaperRank",
@@ -11,6 +22,12 @@ st.set_page_config(
 
 # Backend URL
 backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
+# (connect, read) seconds, a stalled backend should not hang the page
+BACKEND_TIMEOUT = (3.05, float(os.getenv("BACKEND_TIMEOUT", "30")))
+CACHE_TTL_SECONDS = int(os.getenv("FRONTEND_CACHE_TTL", "600"))
+CACHE_MAX_ENTRIES = int(os.getenv("FRONTEND_CACHE_MAX_ENTRIES", "512"))
+# similar papers of this many top results are fetched before anyone clicks "Find Similar"
+PREFETCH_TOP = int(os.getenv("PREFETCH_TOP", "3"))
 
 if 'search_results' not in st.session_state:
     st.session_state.search_results = []
@@ -18,30 +35,150 @@ if 'similar_papers' not in st.session_state:
     st.session_state.similar_papers = []
 if 'viewing_similar_for' not in st.session_state:
     st.session_state.viewing_similar_for = None
+if 'next_page' not in st.session_state:
+    st.session_state.next_page = None
+
+@st.cache_resource
+def get_session():
+    # one keep-alive connection pool for every session of the app, instead of a new
+    # connection per call
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch(path: str, params=None):
+    """(json, cursor of the next page) of a backend GET, raises if it fails."""
+    response = get_session().get(f"{backend_url}{path}", params=params, timeout=BACKEND_TIMEOUT)
+    response.raise_for_status()
+    return response.json(), response.headers.get("X-Next-Cursor")
+
+class Prefetcher:
+    """Runs backend GETs on a small thread pool ahead of time. cached_fetch picks up a
+    prefetched response instead of sending the request again."""
+
+    def __init__(self, workers: int = 4, max_entries: int = 256, ttl: float = CACHE_TTL_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path, params):
+        return path, json.dumps(params, sort_keys=True)
+
+    def submit(self, path: str, params=None):
+        key = self._key(path, params)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._futures.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                return
+            self._futures[key] = (self.executor.submit(fetch, path, params), now)
+            self._futures.move_to_end(key)
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+
+    def get(self, path: str, params=None):
+        with self._lock:
+            entry = self._futures.get(self._key(path, params))
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            return None
+        return entry[0]
+
+@st.cache_resource
+def get_prefetcher():
+    return Prefetcher()
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_fetch(path: str, params=None):
+    # memoized per path and params; a failed request raises, so it is not cached
+    future = get_prefetcher().get(path, params)
+    if future is not None:
+        try:
+            return future.result(timeout=BACKEND_TIMEOUT[1])
+        except Exception:
+            pass
+    return fetch(path, params)
 
 def get_paper(doi: str):
     try:
-        response = requests.get(f"{backend_url}/paper_details/{doi}")
-        response.raise_for_status()
-        return response.json()
+        return cached_fetch(f"/paper_details/{doi}")[0]
     except:
         return None
 
-def get_recommendations(doi: str):
+# what a result card shows; abstracts are only fetched when a card is expanded
+RESULT_FIELDS = "title,authors,year,citations"
+
+def recommendations_request(doi: str, filters=None):
+    return f"/vector_search/{doi}", {"fields": RESULT_FIELDS, **(filters or {})}
+
+def get_recommendations(doi: str, filters=None):
     try:
-        response = requests.get(f"{backend_url}/vector_search/{doi}")
-        response.raise_for_status()
-        return response.json()
+        return cached_fetch(*recommendations_request(doi, filters))[0]
     except:
         return []
 
-def get_titled_paper(title: str):
+def prefetch_recommendations(papers, filters=None):
+    prefetcher = get_prefetcher()
+    for paper in papers[:PREFETCH_TOP]:
+        if paper.get('doi'):
+            prefetcher.submit(*recommendations_request(paper['doi'], filters))
+
+# both return a page of results and the cursor of the next page, None on the last one
+def get_titled_paper(title: str, cursor=None):
     try:
-        response = requests.get(f"{backend_url}/titled_paper/{title}")
-        response.raise_for_status()
-        return response.json()
+        params = {"fields": "title,authors"}
+        if cursor:
+            params["cursor"] = cursor
+        return cached_fetch(f"/titled_paper/{title}", params)
     except:
-        return []
+        return [], None
+
+def get_semantic_search(query: str, filters=None, cursor=None):
+    try:
+        params = {"q": query, "fields": RESULT_FIELDS, **(filters or {})}
+        if cursor:
+            params["cursor"] = cursor
+        return cached_fetch("/semantic_search", params)
+    except:
+        return None, None
+
+def get_citation_graph(work_id: str):
+    try:
+        return cached_fetch(f"/citation_graph/{work_id}", {"limit": 12})[0]
+    except:
+        return None
+
+def get_work_id(doi: str):
+    try:
+        return cached_fetch(f"/paper_details/{doi}", {"fields": "paper_id"})[0].get('paper_id')
+    except:
+        return None
+
+def show_influence_flower(paper):
+    # the graph is keyed by OpenAlex work id, search results only carry the DOI
+    work_id = get_work_id(doi_strip(paper.get('doi') or ''))
+    graph = get_citation_graph(work_id.rsplit('/', 1)[-1]) if work_id else None
+    if graph:
+        display_influence_flower({'Title': paper.get('title', 'Untitled')}, graph)
+    else:
+        st.caption("No citation network available for this paper.")
+
+def get_abstract(doi: str):
+    try:
+        return cached_fetch("/abstracts", {"dois": doi})[0].get(doi)
+    except:
+        return None
+
+def load_next_page(next_page):
+    if next_page["kind"] == "semantic":
+        results, cursor = get_semantic_search(next_page["query"], next_page["filters"], next_page["cursor"])
+    else:
+        results, cursor = get_titled_paper(next_page["query"], next_page["cursor"])
+    return results or [], ({**next_page, "cursor": cursor} if cursor else None)
 
 def detect_search_type(query):
     doi_pattern = r'10\.\d{4,9}/[-._;()/:\w]+'
@@ -72,20 +209,66 @@ def format_authors(authors):
         return ', '.join(authors)
     return authors
 
-def perform_search(query):
+def sort_papers(papers, sort_by):
+    # the backend ranks by relevance, the other orders are newest / most cited first
+    key = {"Year": "year", "Citations": "citations"}.get(sort_by)
+    if key is None:
+        return papers
+    return sorted(papers, key=lambda paper: paper.get(key) or 0, reverse=True)
+
+def perform_search(query, filters=None):
+    """(results, search type, what "Load More" fetches next or None)."""
     if not query:
-        return [], None
+        return [], None, None
     
     search_type = detect_search_type(query)
     
     if search_type == 'doi':
         paper = get_paper(query)
-        return [paper] if paper else [], 'doi'
-    else:
-        # For both author and general searches, use the same endpoint
-        # Your backend should handle searching across all fields
-        results = get_titled_paper(query)
-        return results, search_type
+        return [paper] if paper else [], 'doi', None
+
+    kind = "title"
+    results = None
+    if search_type == 'general':
+        # keyword queries are matched by meaning, the title scan is only a fallback
+        results, cursor = get_semantic_search(query, filters)
+        kind = "semantic"
+    if results is None:
+        results, cursor = get_titled_paper(query)
+        kind = "title"
+    next_page = {"kind": kind, "query": query, "filters": filters, "cursor": cursor} if cursor else None
+    return results, search_type, next_page
+
+with st.sidebar:
+    st.markdown("### About PaperRank")
+    
+    st.markdown("---")
+    
+    # applied on the backend, so similar papers are the closest ones that match
+    with st.expander("Filters"):
+        filter_years = st.checkbox("Filter by year")
+        adv_year_from = st.number_input("Year from", 1900, 2024, 2020, disabled=not filter_years)
+        adv_year_to = st.number_input("Year to", 1900, 2024, 2024, disabled=not filter_years)
+        min_citations = st.number_input("Minimum citations", 0, value=0, step=10)
+        oa_status = st.multiselect("Open access", ["gold", "green", "hybrid", "bronze"],
+                                   help="Only open access works are indexed")
+        st.caption("Filters apply to similar papers and keyword searches.")
+    
+    # Advanced search in sidebar (optional)
+    with st.expander("Advanced Search"):
+        adv_title = st.text_input("Title contains")
+        adv_author = st.text_input("Author name")
+        
+        if st.button("Advanced Search"):
+            st.info("Advanced search coming soon!")
+
+search_filters = {}
+if filter_years:
+    search_filters.update(year_from=int(adv_year_from), year_to=int(adv_year_to))
+if min_citations:
+    search_filters["min_citations"] = int(min_citations)
+if oa_status:
+    search_filters["oa_status"] = oa_status
 
 st.title("PaperRank")
 st.markdown("Find research papers and discover similar work through the power of sentence embeddings and vector search!")
@@ -102,8 +285,9 @@ with col1:
 
 if search_button and search_query:
     with st.spinner("Searching..."):
-        results, search_type = perform_search(search_query)
+        results, search_type, next_page = perform_search(search_query, search_filters)
         st.session_state.search_results = results
+        st.session_state.next_page = next_page
         st.session_state.viewing_similar_for = None  # Reset similar papers view
     
     # Provide feedback about search type
@@ -133,7 +317,7 @@ if st.session_state.viewing_similar_for:
         st.rerun()
     
     with st.spinner("Finding similar papers..."):
-        similar = get_recommendations(st.session_state.viewing_similar_for.get('doi', ''))
+        similar = get_recommendations(st.session_state.viewing_similar_for.get('doi', ''), search_filters)
         st.session_state.similar_papers = similar
     
     if similar:
@@ -145,7 +329,11 @@ if st.session_state.viewing_similar_for:
         
         st.markdown("### Similar Papers")
         
-        for idx, paper in enumerate(similar[:20]):  
+        shown = sort_papers(similar, sort_by)[:20]
+        # one more hop is usually the next click
+        prefetch_recommendations(shown, search_filters)
+        
+        for idx, paper in enumerate(shown):
             similarity = 1 - paper.get('distance', 0.5)
             percent = int(similarity * 100)
             with st.container(border=True):
@@ -160,7 +348,7 @@ if st.session_state.viewing_similar_for:
                 st.markdown(f"#### {paper.get('title', 'Untitled')}")
                 st.caption(format_authors(paper.get('authors', 'Unknown')))
                 
-                if 'year' in paper:
+                if paper.get('year'):
                     st.caption(f"Published: {paper['year']}")
                 
                 col_a, col_b = st.columns(2)
@@ -168,8 +356,10 @@ if st.session_state.viewing_similar_for:
                     if st.button("View", key=f"view_sim_{idx}", use_container_width=True):
                         with st.expander("Paper Details", expanded=True):
                             st.write(f"**DOI:** {paper.get('doi', 'Not available')}")
-                            if 'abstract' in paper:
-                                st.write(f"**Abstract:** {paper['abstract']}")
+                            abstract = paper.get('abstract') or get_abstract(paper.get('doi', ''))
+                            if abstract:
+                                st.write(f"**Abstract:** {abstract}")
+                            show_influence_flower(paper)
                 
                 with col_b:
                     if st.button("Find Similar", key=f"similar_sim_{idx}", type="primary", use_container_width=True):
@@ -192,10 +382,14 @@ elif st.session_state.search_results:
     with col3:
         if st.button("Clear Results"):
             st.session_state.search_results = []
+            st.session_state.next_page = None
             st.rerun()
     
     
-    for idx, paper in enumerate(st.session_state.search_results[:20]):  # Limit to 20
+    shown = sort_papers(st.session_state.search_results, sort_by)
+    prefetch_recommendations(shown, search_filters)
+    
+    for idx, paper in enumerate(shown):
         with st.container(border=True):
             # Paper title
             st.markdown(f"#### {paper.get('title', 'Untitled')}")
@@ -204,9 +398,9 @@ elif st.session_state.search_results:
             st.caption(format_authors(paper.get('authors', 'Unknown')))
             
             metadata = []
-            if 'year' in paper:
+            if paper.get('year'):
                 metadata.append(f"{paper['year']}")
-            if 'citations' in paper:
+            if paper.get('citations') is not None:
                 metadata.append(f"{paper['citations']:,} citations")
             if 'field' in paper:
                 metadata.append(paper['field'])
@@ -220,22 +414,26 @@ elif st.session_state.search_results:
                 if st.button("View Details", key=f"view_{idx}", use_container_width=True):
                     with st.expander("Paper Details", expanded=True):
                         st.write(f"**DOI:** {paper.get('doi', 'Not available')}")
-                        if 'abstract' in paper:
-                            st.write(f"**Abstract:** {paper.get('abstract', 'Not available')}")
+                        abstract = paper.get('abstract') or get_abstract(paper.get('doi', ''))
+                        st.write(f"**Abstract:** {abstract or 'Not available'}")
                         if 'url' in paper:
                             st.write(f"**URL:** {paper['url']}")
                         if 'year' in paper:
                             st.write(f"**Year:** {paper['year']}")
+                        show_influence_flower(paper)
             
             with col_b:
                 if st.button("Find Similar", key=f"similar_{idx}", type="primary", use_container_width=True):
                     st.session_state.viewing_similar_for = paper
                     st.rerun()
     
-    if len(st.session_state.search_results) > 20:
+    if st.session_state.next_page:
         st.markdown("---")
         if st.button("Load More Results", use_container_width=True):
-            st.info("Showing first 20 results. Pagination coming soon!")
+            with st.spinner("Loading more..."):
+                more, st.session_state.next_page = load_next_page(st.session_state.next_page)
+            st.session_state.search_results = st.session_state.search_results + more
+            st.rerun()
 
 else:
     st.markdown("---")
@@ -281,18 +479,3 @@ else:
         - **github**: https://github.com/lhickey87""", unsafe_allow_html = True)
     with col2:
         st.markdown("""Please feel free to reach out!""")
-        
-with st.sidebar:
-    st.markdown("### About PaperRank")
-    
-    st.markdown("---")
-    
-    # Advanced search in sidebar (optional)
-    with st.expander("Advanced Search"):
-        adv_title = st.text_input("Title contains")
-        adv_author = st.text_input("Author name")
-        adv_year_from = st.number_input("Year from", 1900, 2024, 2020)
-        adv_year_to = st.number_input("Year to", 1900, 2024, 2024)
-        
-        if st.button("Advanced Search"):
-            st.info("Advanced search coming soon!")
\ No newline at end of file
@@ -0,0 +1,92 @@
+import os
+import json
+import gzip
+import time
+import argparse
+import logging
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from encoding_scheduler import LengthBucketedEncoder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_abstracts(path: str, limit: int):
+    """First `limit` abstracts of a bq-export style .json.gz file (local path or gs://)."""
+    if path.startswith("gs://"):
+        from google.cloud import storage
+        bucket_name, blob_name = path.replace("gs://", "").split("/", 1)
+        raw = storage.Client().bucket(bucket_name).blob(blob_name).open("rb")
+    else:
+        raw = open(path, "rb")
+
+    texts = []
+    with raw, gzip.open(raw, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                abstract = json.loads(line).get("abstract")
+            except json.JSONDecodeError:
+                continue
+            if abstract:
+                texts.append(abstract)
+            if len(texts) >= limit:
+                break
+    return texts
+
+
+def timed(fn, texts, repeats: int):
+    best, result = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(texts)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="docs/sec of fixed-size vs length-bucketed encoding")
+    parser.add_argument("--sample", required=True, help="bq-export .json.gz file, local or gs://")
+    parser.add_argument("--limit", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--max-tokens", type=int, default=32768)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default=None, help="write the report as JSON here")
+    args = parser.parse_args()
+
+    torch.set_num_threads(os.cpu_count() or 4)
+    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device="cpu")
+    model.max_seq_length = 128
+
+    texts = load_abstracts(args.sample, args.limit)
+    logger.info(f"Benchmarking on {len(texts)} abstracts")
+
+    fixed = lambda t: model.encode(t, batch_size=args.batch_size, show_progress_bar=False, convert_to_numpy=True)
+    bucketed = LengthBucketedEncoder(model, max_tokens_per_batch=args.max_tokens).encode
+
+    fixed_time, fixed_out = timed(fixed, texts, args.repeats)
+    bucketed_time, bucketed_out = timed(bucketed, texts, args.repeats)
+
+    cosine = np.sum(fixed_out * bucketed_out, axis=1) / (
+        np.linalg.norm(fixed_out, axis=1) * np.linalg.norm(bucketed_out, axis=1))
+    report = {
+        "docs": len(texts),
+        "fixed_batch_size": args.batch_size,
+        "max_tokens_per_batch": args.max_tokens,
+        "fixed_docs_per_sec": len(texts) / fixed_time,
+        "bucketed_docs_per_sec": len(texts) / bucketed_time,
+        "speedup": fixed_time / bucketed_time,
+        "min_cosine_vs_fixed": float(cosine.min()),
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
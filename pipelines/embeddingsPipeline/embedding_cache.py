@@ -0,0 +1,120 @@
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on host parameters per statement
+_MAX_PARAMS = 900
+
+# WAL mode keeps its index in shared memory next to the database, which only works when
+# every connection is on the same host, and these do not give SQLite reliable locking either
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph", "glusterfs", "lustre",
+                       "afs", "davfs", "sshfs"}
+
+
+def _filesystem_type(path: str) -> str:
+    """Type of the filesystem holding path, from the longest matching mount in /proc/mounts."""
+    path = os.path.realpath(path)
+    best, fs_type = "", ""
+    try:
+        with open("/proc/mounts") as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return ""
+    for mount_point, kind in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > len(best):
+            best, fs_type = mount_point, kind
+    return fs_type
+
+
+def check_local_disk(path: str):
+    """Raise ValueError unless path is on a local filesystem SQLite can run WAL on."""
+    fs_type = _filesystem_type(path)
+    if fs_type in NETWORK_FILESYSTEMS or fs_type.startswith("fuse."):
+        raise ValueError(f"Embedding cache at {path} is on a {fs_type} filesystem, "
+                         f"SQLite needs local disk; use a persistent disk mounted on the worker")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Persistent abstract -> embedding cache, keyed by a hash of (model, max_seq_length,
+    normalized text) so an unchanged abstract is never encoded twice.
+
+    Entries are spread over `shards` SQLite files by the first byte of the key, which
+    keeps each file small and lets concurrent threads write to different shards. The
+    files must be on local disk of the one machine using them: a network filesystem or
+    a bucket mount (gcsfuse) is rejected, see check_local_disk.
+    """
+
+    def __init__(self, path: str, model_id: str, max_seq_length: int, dim: int, shards: int = 16):
+        os.makedirs(path, exist_ok=True)
+        check_local_disk(path)
+        self.path = path
+        self.prefix = f"{model_id}\0{max_seq_length}\0".encode("utf-8")
+        self.dim = dim
+        self.shards = shards
+        self._local = threading.local()
+
+    def _connection(self, shard: int) -> sqlite3.Connection:
+        # sqlite connections cannot be shared across the processor's worker threads
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if shard not in connections:
+            conn = sqlite3.connect(os.path.join(self.path, f"embeddings-{shard:02d}.sqlite"), timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+            connections[shard] = conn
+        return connections[shard]
+
+    def keys(self, texts: List[str]) -> List[bytes]:
+        return [hashlib.blake2b(self.prefix + normalize_text(t).encode("utf-8"), digest_size=16).digest()
+                for t in texts]
+
+    def _by_shard(self, keys: List[bytes]):
+        shards = {}
+        for i, key in enumerate(keys):
+            shards.setdefault(key[0] % self.shards, []).append(i)
+        return shards
+
+    def lookup(self, keys: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+        """(embeddings, found mask); rows that were not found are left as zeros."""
+        embeddings = np.zeros((len(keys), self.dim), dtype=np.float32)
+        found = np.zeros(len(keys), dtype=bool)
+        for shard, positions in self._by_shard(keys).items():
+            conn = self._connection(shard)
+            # duplicate abstracts within a file share a key
+            positions_of = {}
+            for i in positions:
+                positions_of.setdefault(keys[i], []).append(i)
+            shard_keys = list(positions_of)
+            for start in range(0, len(shard_keys), _MAX_PARAMS):
+                batch = shard_keys[start:start + _MAX_PARAMS]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, vector in rows:
+                    hit = positions_of[key]
+                    embeddings[hit] = np.frombuffer(vector, dtype=np.float32)
+                    found[hit] = True
+        return embeddings, found
+
+    def store(self, keys: List[bytes], embeddings: np.ndarray):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        for shard, positions in self._by_shard(keys).items():
+            conn = self._connection(shard)
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                 [(keys[i], embeddings[i].tobytes()) for i in positions])
@@ -1,25 +1,41 @@
 import os
+import sys
 import json
 import logging
 import gzip
+import io
 import time
+import queue
 import tempfile
+import threading
 from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Dict, Iterator, List, Tuple
 
 import torch
+import numpy as np
 import pyarrow as pa
 import pyarrow.parquet as pq
 from sentence_transformers import SentenceTransformer
 from google.cloud import storage, bigquery
 
+from encoding_scheduler import LengthBucketedEncoder
+from embedding_cache import EmbeddingCache
+from onnx_backend import BACKENDS, OnnxEncoder, export_onnx, validate
+from process_pool import autotune, available_cores, run_pool
+from work_queue import GCSObjectStore, WorkQueue
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 class EmbeddingProcessor:
-    def __init__(self):
+    def __init__(self, backend: str = "torch", num_threads: int = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend!r}, expected one of {sorted(BACKENDS)}")
+        self.backend = backend
+        # intra-op threads for the model, all cores unless a process pool splits them up
+        self.num_threads = num_threads or os.cpu_count() or 4
+        self.onnx_dir = os.environ.get("ONNX_MODEL_DIR", "/tmp/onnx-model")
         self.input_bucket = "paperrank"
         self.input_prefix = "bq-export/"
         self.output_bucket = os.environ.get("OUTPUT_BUCKET", "your-output-bucket")
@@ -28,17 +44,57 @@ class EmbeddingProcessor:
         self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
         self.batch_size = 512
         self.max_text_length = 2048
+
+        # length-bucketed batching: batches are sized by a padded token budget instead of
+        # a fixed count, see benchmark_encoding.py for the fixed vs bucketed comparison
+        self.bucketed_batching = os.environ.get("BUCKETED_BATCHING", "0") == "1"
+        self.max_tokens_per_batch = int(os.environ.get("MAX_TOKENS_PER_BATCH", "32768"))
+
+        # persistent content-hash cache, so a snapshot refresh only encodes changed abstracts;
+        # point it at a local persistent disk that outlives the job, network filesystems and
+        # bucket mounts are rejected since SQLite cannot lock or run WAL on them
+        self.cache_dir = os.environ.get("EMBEDDING_CACHE_DIR")
+
+        # streaming mode: encode in bounded chunks while the next chunk is parsed and
+        # finished row groups upload, so memory stays flat regardless of file size
+        self.streaming = os.environ.get("STREAMING", "0") == "1"
+        self.chunk_size = int(os.environ.get("ENCODE_CHUNK_SIZE", "4096"))
+        self.prefetch_chunks = int(os.environ.get("PREFETCH_CHUNKS", "2"))
+
+        # float16 halves the shards but BigQuery cannot load it, keep float32 for the EMBED tables
+        self.embedding_dtype = np.dtype(os.environ.get("EMBEDDING_DTYPE", "float32"))
+        self.compression = os.environ.get("PARQUET_COMPRESSION", "snappy")
+        self.row_group_size = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", "8192"))
         
         self.storage_client = storage.Client()
         self._setup_model()
         
     def _setup_model(self):
-        cpu_count = os.cpu_count() or 4
-        torch.set_num_threads(cpu_count)
+        torch.set_num_threads(self.num_threads)
         
-        logger.info(f"Loading model {self.model_name} with {cpu_count} CPU threads")
+        logger.info(f"Loading model {self.model_name} with {self.num_threads} CPU threads")
         self.model = SentenceTransformer(self.model_name, device='cpu')
         self.model.max_seq_length = 128 
+
+        # the PyTorch model stays loaded: it provides the tokenizer and is the validation reference
+        self.encoder = self.model
+        if self.backend != "torch":
+            onnx_path = export_onnx(self.model, self.onnx_dir, quantize=self.backend == "onnx-int8")
+            logger.info(f"Using {self.backend} backend from {onnx_path}")
+            self.encoder = OnnxEncoder(onnx_path, self.model, num_threads=self.num_threads)
+        self.bucketed_encoder = LengthBucketedEncoder(self.encoder, max_tokens_per_batch=self.max_tokens_per_batch)
+
+        self.embedding_cache = None
+        if self.cache_dir:
+            self.embedding_cache = EmbeddingCache(self.cache_dir, f"{self.model_name}:{self.backend}",
+                                                  self.model.max_seq_length,
+                                                  self.model.get_sentence_embedding_dimension())
+
+    def validate_backend(self, file_path: str, sample_size: int, max_drift: float) -> dict:
+        texts = [paper['text'] for paper in self._extract_papers(file_path)[:sample_size]]
+        if not texts:
+            raise ValueError(f"No abstracts in {file_path} to validate the {self.backend} backend on")
+        return validate(self.model, self.encoder, texts, max_drift)
         
     def get_files_to_process(self) -> List[str]:
         all_files = self._list_input_files()
@@ -50,9 +106,20 @@ class EmbeddingProcessor:
         return remaining
     
     def _list_input_files(self) -> List[str]:
+        return list(self._list_input_sizes())
+
+    def _list_input_sizes(self) -> Dict[str, int]:
         bucket = self.storage_client.bucket(self.input_bucket)
         blobs = bucket.list_blobs(prefix=self.input_prefix)
-        return [f"gs://{self.input_bucket}/{blob.name}" for blob in blobs if blob.name.endswith('.json.gz')]
+        return {f"gs://{self.input_bucket}/{blob.name}": blob.size or 0
+                for blob in blobs if blob.name.endswith('.json.gz')}
+
+    def work_queue(self, **kwargs) -> WorkQueue:
+        """Queue over every input file, leased through objects next to the done markers."""
+        inputs: Dict[str, Tuple[str, int]] = {
+            self._extract_file_id(path): (path, size) for path, size in self._list_input_sizes().items()}
+        store = GCSObjectStore(self.storage_client, self.output_bucket)
+        return WorkQueue(store, inputs, self.output_prefix, **kwargs)
     
     def _get_processed_file_ids(self) -> set:
         bucket = self.storage_client.bucket(self.output_bucket)
@@ -68,6 +135,9 @@ class EmbeddingProcessor:
         blob.upload_from_string("")
     
     def process_file(self, file_path: str):
+        if self.streaming:
+            return self.process_file_streaming(file_path)
+
         file_id = self._extract_file_id(file_path)
         logger.info(f"Processing {file_id}")
         
@@ -78,7 +148,8 @@ class EmbeddingProcessor:
                 self._mark_file_processed(file_id)
                 return
             
-            embeddings = self._generate_embeddings([paper['text'] for paper in papers])
+            embeddings, hits = self._embed([paper['text'] for paper in papers])
+            self._log_cache_hits(file_id, hits, len(papers))
             
             self._save_to_parquet(file_id, papers, embeddings)
             self._mark_file_processed(file_id)
@@ -89,6 +160,111 @@ class EmbeddingProcessor:
             logger.error(f"Failed to process {file_id}: {e}")
             raise
     
+    def process_file_streaming(self, file_path: str):
+        file_id = self._extract_file_id(file_path)
+        logger.info(f"Streaming {file_id}")
+        start_time = time.time()
+
+        chunks = queue.Queue(maxsize=self.prefetch_chunks)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_chunks, args=(file_path, chunks, stop), daemon=True)
+        reader.start()
+
+        writer = None
+        sink = None
+        total = 0
+        hits = 0
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                embeddings, chunk_hits = self._embed([paper['text'] for paper in chunk])
+                hits += chunk_hits
+                table = self._embeddings_table(chunk, embeddings)
+                if writer is None:
+                    sink = self._open_output(file_id)
+                    writer = pq.ParquetWriter(sink, table.schema, compression=self.compression)
+                writer.write_table(table, row_group_size=self.row_group_size)
+                total += len(chunk)
+
+            if writer is not None:
+                writer.close()
+                sink.close()
+            else:
+                logger.warning(f"No valid papers found in {file_id}")
+            self._mark_file_processed(file_id)
+            self._log_cache_hits(file_id, hits, total)
+
+            elapsed = time.time() - start_time
+            logger.info(f"Completed {file_id}: {total} papers in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} docs/sec)")
+
+        except Exception as e:
+            logger.error(f"Failed to process {file_id}: {e}")
+            if writer is not None:
+                # closing commits the upload, so remove the partial shard again
+                try:
+                    writer.close()
+                    sink.close()
+                    self._discard_output(file_id)
+                except Exception as cleanup_error:
+                    logger.error(f"Failed to discard partial output for {file_id}: {cleanup_error}")
+            raise
+        finally:
+            # unblock the reader if we stopped consuming early
+            stop.set()
+            while reader.is_alive():
+                try:
+                    chunks.get_nowait()
+                except queue.Empty:
+                    reader.join(timeout=0.1)
+
+    def _read_chunks(self, file_path: str, chunks: queue.Queue, stop: threading.Event):
+        try:
+            chunk = []
+            for paper in self._iter_papers(file_path):
+                chunk.append(paper)
+                if len(chunk) >= self.chunk_size:
+                    if stop.is_set():
+                        return
+                    chunks.put(chunk)
+                    chunk = []
+            if chunk:
+                chunks.put(chunk)
+            chunks.put(None)
+        except Exception as e:
+            chunks.put(e)
+
+    def _iter_papers(self, file_path: str) -> Iterator[dict]:
+        bucket_name, blob_name = file_path.replace('gs://', '').split('/', 1)
+        blob = self.storage_client.bucket(bucket_name).blob(blob_name)
+
+        with blob.open('rb') as raw, gzip.GzipFile(fileobj=raw) as gz, \
+                io.TextIOWrapper(gz, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    paper = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                doi = paper.get('doi')
+                abstract = paper.get('abstract', '')
+                if doi and abstract:
+                    yield {'doi': doi, 'text': abstract}
+
+    def _open_output(self, file_id: str):
+        output_path = f"{self.output_prefix}data/{file_id}.parquet"
+        blob = self.storage_client.bucket(self.output_bucket).blob(output_path)
+        # resumable upload, each written chunk is sent while encoding continues
+        return blob.open('wb', content_type='application/octet-stream')
+
+    def _discard_output(self, file_id: str):
+        blob = self.storage_client.bucket(self.output_bucket).blob(f"{self.output_prefix}data/{file_id}.parquet")
+        if blob.exists():
+            blob.delete()
+
     def _extract_papers(self, file_path: str) -> List[dict]:
         papers = []
         
@@ -117,63 +293,125 @@ class EmbeddingProcessor:
         logger.info(f"Extracted {len(papers)} valid papers")
         return papers
     
-    def _generate_embeddings(self, texts: List[str]):
+    def _embed(self, texts: List[str]):
+        """Embeddings for texts, encoding only the cache misses. Returns (embeddings, cache hits)."""
+        if self.embedding_cache is None:
+            return self._generate_embeddings(texts), 0
+
+        keys = self.embedding_cache.keys(texts)
+        embeddings, found = self.embedding_cache.lookup(keys)
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            fresh = self._generate_embeddings([texts[i] for i in missing])
+            embeddings[missing] = fresh
+            self.embedding_cache.store([keys[i] for i in missing], fresh)
+        return embeddings, len(texts) - len(missing)
+
+    def _log_cache_hits(self, file_id: str, hits: int, total: int):
+        if self.embedding_cache is not None:
+            logger.info(f"Embedding cache for {file_id}: {hits}/{total} hits ({hits / max(total, 1):.1%})")
+
+    def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
         logger.info("Generating embeddings...")
         start_time = time.time()
         
-        embeddings = self.model.encode(
-            texts,
-            batch_size=self.batch_size,
-            show_progress_bar=False,
-            convert_to_numpy=True
-        )
+        if self.bucketed_batching:
+            embeddings = self.bucketed_encoder.encode(texts)
+        else:
+            embeddings = self.encoder.encode(
+                texts,
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
         
         elapsed = time.time() - start_time
         rate = len(texts) / elapsed
         logger.info(f"Generated {len(texts)} embeddings in {elapsed:.1f}s ({rate:.0f} docs/sec)")
         
-        return embeddings.tolist()
+        return embeddings
     
-    def _save_to_parquet(self, file_id: str, papers: List[dict], embeddings: List[List[float]]):
+    def _embeddings_table(self, papers: List[dict], embeddings: np.ndarray) -> pa.Table:
+        # FixedSizeList over the encoder's own buffer, no per-value Python floats
+        values = np.ascontiguousarray(embeddings, dtype=self.embedding_dtype).reshape(-1)
+        return pa.table({
+            'doi': pa.array([paper['doi'] for paper in papers], type=pa.string()),
+            'embedding': pa.FixedSizeListArray.from_arrays(pa.array(values), embeddings.shape[1])
+        })
+
+    def _save_to_parquet(self, file_id: str, papers: List[dict], embeddings: np.ndarray):
         logger.info("Saving to Parquet...")
         
-        table = pa.table({
-            'doi': [paper['doi'] for paper in papers],
-            'embedding': embeddings
-        })
+        table = self._embeddings_table(papers, embeddings)
         
         output_path = f"{self.output_prefix}data/{file_id}.parquet"
         bucket = self.storage_client.bucket(self.output_bucket)
         blob = bucket.blob(output_path)
         
         with BytesIO() as buffer:
-            pq.write_table(table, buffer, compression='snappy')
+            pq.write_table(table, buffer, compression=self.compression, row_group_size=self.row_group_size)
             buffer.seek(0)
             blob.upload_from_file(buffer)
 
 
 def main():
-    file_index = int(os.environ.get("FILE_INDEX", "0"))
-    files_per_job = int(os.environ.get("FILES_PER_JOB", "10"))
-    
-    processor = EmbeddingProcessor()
+    backend = os.environ.get("INFERENCE_BACKEND", "torch")
+    processor = EmbeddingProcessor(backend=backend)
     all_files = sorted(processor.get_files_to_process())
+
+    if os.environ.get("VALIDATE_BACKEND", "0") == "1" and all_files:
+        # fail the job before writing anything if the backend drifts from PyTorch
+        processor.validate_backend(all_files[0],
+                                   sample_size=int(os.environ.get("VALIDATION_SAMPLE_SIZE", "1000")),
+                                   max_drift=float(os.environ.get("MAX_COSINE_DRIFT", "0.02")))
     
-    start_idx = file_index * files_per_job
-    end_idx = min(start_idx + files_per_job, len(all_files))
-    
-    if start_idx >= len(all_files):
-        logger.info(f"No files to process for job {file_index}")
+    if not all_files:
+        logger.info("No files to process")
         return
-    
-    job_files = all_files[start_idx:end_idx]
-    logger.info(f"Job {file_index} processing {len(job_files)} files")
-    
-    num_threads = 4
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        executor.map(processor.process_file, job_files)
-    
-    logger.info(f"Job {file_index} completed")
+
+    # every task pulls leased files from the shared queue until it is empty, instead of
+    # taking a fixed slice of a list that shrinks as other tasks finish
+    task = os.environ.get("CLOUD_RUN_TASK_INDEX")
+    queue_kwargs = dict(
+        lease_seconds=float(os.environ.get("LEASE_SECONDS", "600")),
+        claim_bytes=int(os.environ.get("CLAIM_BYTES", str(256 * 1024 * 1024))),
+        poll_seconds=float(os.environ.get("QUEUE_POLL_SECONDS", "15")))
+    work_queue = processor.work_queue(
+        worker_id=f"{os.environ.get('CLOUD_RUN_EXECUTION', 'local')}-{task}" if task is not None else None,
+        **queue_kwargs)
+    logger.info(f"Worker {work_queue.worker_id} pulling from {len(all_files)} remaining files")
+
+    num_processes = os.environ.get("NUM_PROCESSES", "1")
+    if num_processes == "1":
+        num_threads = 4
+        work_queue.run(processor.process_file, num_threads=num_threads)
+        failed = work_queue.failed()
+        if failed:
+            # a non-zero exit marks the task failed, so Cloud Run retries it and the files get another go
+            logger.error(f"Worker {work_queue.worker_id} could not process {len(failed)} files: {failed}")
+            sys.exit(1)
+    else:
+        # one model per process with its own pinned cores, so concurrent encodes do not
+        # fight over the same threads and parsing is not serialized on one GIL
+        if num_processes == "auto":
+            sample = [paper['text'] for paper in processor._extract_papers(all_files[0])
+                      [:int(os.environ.get("AUTOTUNE_SAMPLE_SIZE", "2000"))]]
+            processes, threads = autotune(processor.backend, sample, cache_path=os.environ.get("AUTOTUNE_CACHE"))
+        else:
+            processes = int(num_processes)
+            threads = int(os.environ.get("THREADS_PER_PROCESS", str(max(1, len(available_cores()) // processes))))
+        # the workers load their own models
+        del processor
+        try:
+            run_pool(backend, processes, threads,
+                     queue_kwargs=dict(queue_kwargs, worker_id=work_queue.worker_id),
+                     files_in_flight=int(os.environ.get("FILES_PER_PROCESS", "1")))
+        except RuntimeError as e:
+            # a worker process exits non-zero when files failed on it
+            logger.error(f"Worker {work_queue.worker_id} failed: {e}")
+            sys.exit(1)
+
+    logger.info(f"Worker {work_queue.worker_id} completed")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
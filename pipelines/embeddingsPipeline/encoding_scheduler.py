@@ -0,0 +1,71 @@
+import logging
+from typing import List
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class LengthBucketedEncoder:
+    """Encodes texts in batches of similar token length.
+
+    Texts are tokenized once, sorted by length and cut into batches whose padded
+    size (batch size x longest sequence) stays under a token budget, so short
+    abstracts are no longer padded to the longest one in a fixed-size batch.
+    Embeddings come back in the original order.
+    """
+
+    def __init__(self, model, max_tokens_per_batch: int = 32768, max_batch_size: int = 1024):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+
+    def tokenize(self, texts: List[str]) -> List[List[int]]:
+        encoded = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+            padding=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return encoded["input_ids"]
+
+    def plan_batches(self, lengths: np.ndarray) -> List[np.ndarray]:
+        """Indices of each batch, longest sequences first."""
+        order = np.argsort(-lengths, kind="stable")
+        batches, start = [], 0
+        while start < len(order):
+            # the first text of a batch is its longest, so it fixes the padded width
+            width = max(int(lengths[order[start]]), 1)
+            size = max(1, min(self.max_batch_size, self.max_tokens_per_batch // width))
+            batches.append(order[start:start + size])
+            start += size
+        return batches
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        input_ids = self.tokenize(texts)
+        lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(input_ids))
+        batches = self.plan_batches(lengths)
+
+        padded = sum(len(b) * int(lengths[b[0]]) for b in batches)
+        logger.info(f"Encoding {len(texts)} texts in {len(batches)} length-bucketed batches "
+                    f"({lengths.sum() / max(padded, 1):.0%} of padded tokens are real)")
+
+        output = None
+        device = self.model.device
+        with torch.inference_mode():
+            for batch in batches:
+                features = self.tokenizer.pad({"input_ids": [input_ids[i] for i in batch]},
+                                              padding=True, return_tensors="pt")
+                features = {name: tensor.to(device) for name, tensor in features.items()}
+                embeddings = self.model(features)["sentence_embedding"].cpu().numpy()
+                if output is None:
+                    output = np.empty((len(texts), embeddings.shape[1]), dtype=embeddings.dtype)
+                output[batch] = embeddings
+        return output
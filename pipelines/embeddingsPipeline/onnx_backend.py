@@ -0,0 +1,150 @@
+import os
+import uuid
+import logging
+from typing import List
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = {"torch", "onnx", "onnx-int8"}
+
+
+class _TransformerOutput(torch.nn.Module):
+    """The HF transformer with a plain tensor output, which is what torch.onnx.export wants."""
+
+    def __init__(self, auto_model):
+        super().__init__()
+        self.auto_model = auto_model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.auto_model(input_ids=input_ids, attention_mask=attention_mask,
+                               token_type_ids=token_type_ids)[0]
+
+
+def _valid_graph(path: str) -> bool:
+    """Whether ONNX Runtime can load the graph at path, e.g. not a partial write."""
+    import onnxruntime as ort
+
+    if not os.path.exists(path):
+        return False
+    try:
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    except Exception as e:
+        logger.warning(f"Not reusing {path}, ONNX Runtime cannot load it: {e}")
+        return False
+    return {"input_ids", "attention_mask"} <= {i.name for i in session.get_inputs()}
+
+
+def _write_graph(path: str, write):
+    # written next to the target and moved into place once it loads, so an interrupted
+    # export never leaves a truncated graph where the next run would pick it up
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp)
+        if not _valid_graph(tmp):
+            raise RuntimeError(f"Exported ONNX graph {tmp} does not load")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def export_onnx(model, out_dir: str, quantize: bool = False) -> str:
+    """Export the SentenceTransformer's transformer to out_dir/model.onnx and, with
+    quantize, a dynamically int8-quantized out_dir/model-int8.onnx. Returns the path
+    of the graph to run; existing files are reused if ONNX Runtime loads them."""
+    os.makedirs(out_dir, exist_ok=True)
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    if not _valid_graph(fp32_path):
+        logger.info(f"Exporting ONNX graph to {fp32_path}")
+        features = model.tokenizer(["an example abstract"], return_tensors="pt")
+        dummy = (features["input_ids"], features["attention_mask"],
+                 features.get("token_type_ids", torch.zeros_like(features["input_ids"])))
+        axes = {0: "batch", 1: "sequence"}
+        _write_graph(fp32_path, lambda tmp: torch.onnx.export(
+            _TransformerOutput(model[0].auto_model).eval(), dummy, tmp,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes,
+                          "last_hidden_state": axes},
+            opset_version=14,
+        ))
+    if not quantize:
+        return fp32_path
+
+    int8_path = os.path.join(out_dir, "model-int8.onnx")
+    if not _valid_graph(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logger.info(f"Quantizing {fp32_path} to int8")
+        _write_graph(int8_path, lambda tmp: quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8))
+    return int8_path
+
+
+class OnnxEncoder:
+    """Runs an exported graph with ONNX Runtime and applies the SentenceTransformer's
+    mean pooling and normalization, so it can stand in for the model both in
+    EmbeddingProcessor and in LengthBucketedEncoder."""
+
+    device = "cpu"
+
+    def __init__(self, onnx_path: str, model, num_threads: int = None):
+        import onnxruntime as ort
+
+        pooling = model[1]
+        if pooling.get_pooling_mode_str() != "mean":
+            raise ValueError(f"ONNX backend only implements mean pooling, model uses {pooling.get_pooling_mode_str()}")
+        self.normalize = any(type(module).__name__ == "Normalize" for module in model)
+        self.tokenizer = model.tokenizer
+        self.max_seq_length = model.max_seq_length
+        self._dimension = model.get_sentence_embedding_dimension()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 4
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+    def _run(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids)}
+        hidden = self.session.run(None, {name: feed[name] for name in self._inputs})[0]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32, copy=False)
+
+    def __call__(self, features: dict) -> dict:
+        # same contract as SentenceTransformer.forward on pre-tokenized features
+        embeddings = self._run(features["input_ids"].numpy().astype(np.int64),
+                               features["attention_mask"].numpy().astype(np.int64))
+        return {"sentence_embedding": torch.from_numpy(embeddings)}
+
+    def encode(self, texts: List[str], batch_size: int = 512, **kwargs) -> np.ndarray:
+        output = np.empty((len(texts), self._dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            features = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                      max_length=self.max_seq_length, return_tensors="np")
+            output[start:start + batch_size] = self._run(features["input_ids"].astype(np.int64),
+                                                         features["attention_mask"].astype(np.int64))
+        return output
+
+
+def validate(reference, candidate, texts: List[str], max_drift: float, batch_size: int = 128) -> dict:
+    """Compare candidate embeddings against the PyTorch reference; raises if the worst
+    cosine distance exceeds max_drift."""
+    expected = reference.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    actual = candidate.encode(texts, batch_size=batch_size)
+    cosine = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    report = {"texts": len(texts), "min_cosine": float(cosine.min()), "mean_cosine": float(cosine.mean()),
+              "max_drift": float(1 - cosine.min()), "threshold": max_drift}
+    logger.info(f"Backend validation: {report}")
+    if report["max_drift"] > max_drift:
+        raise RuntimeError(f"Embedding drift {report['max_drift']:.4f} exceeds threshold {max_drift}")
+    return report
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import platform
+import multiprocessing as mp
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# spawn, not fork: every worker builds its own model and thread pools from scratch
+_ctx = mp.get_context("spawn")
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 4))
+
+
+def core_groups(processes: int, threads: int, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """Disjoint sets of `threads` cores, one per process."""
+    cores = cores if cores is not None else available_cores()
+    if processes * threads > len(cores):
+        raise ValueError(f"{processes} processes x {threads} threads needs more than {len(cores)} cores")
+    return [cores[i * threads:(i + 1) * threads] for i in range(processes)]
+
+
+def candidate_layouts(num_cores: int) -> List[Tuple[int, int]]:
+    """(processes, threads) layouts that use every core: 1 x N, 2 x N/2, ... N x 1."""
+    layouts, processes = [], 1
+    while processes <= num_cores:
+        layouts.append((processes, num_cores // processes))
+        processes *= 2
+    if layouts[-1][0] != num_cores:
+        layouts.append((num_cores, 1))
+    return layouts
+
+
+def machine_type() -> str:
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next(line.split(":", 1)[1].strip() for line in f if line.startswith("model name"))
+    except (OSError, StopIteration):
+        pass
+    return f"{cpu} x{len(available_cores())}"
+
+
+def _pin(cores: List[int], threads: int):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # already set once parallel work has started
+        pass
+
+
+def _build_processor(backend: str, threads: int):
+    from embedding_processor import EmbeddingProcessor
+    return EmbeddingProcessor(backend=backend, num_threads=threads)
+
+
+def _benchmark_worker(cores, threads, backend, texts, barrier, results):
+    _pin(cores, threads)
+    processor = _build_processor(backend, threads)
+    processor._generate_embeddings(texts[:64])  # warm up
+    barrier.wait()
+    start = time.perf_counter()
+    processor._generate_embeddings(texts)
+    results.put(time.perf_counter() - start)
+
+
+def measure_layout(backend: str, texts: List[str], processes: int, threads: int) -> float:
+    """docs/sec of `processes` pinned workers encoding `texts` each, all at once."""
+    barrier = _ctx.Barrier(processes)
+    results = _ctx.Queue()
+    workers = [_ctx.Process(target=_benchmark_worker, args=(cores, threads, backend, texts, barrier, results))
+               for cores in core_groups(processes, threads)]
+    for worker in workers:
+        worker.start()
+    elapsed = []
+    while len(elapsed) < len(workers):
+        try:
+            elapsed.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError(f"A benchmark worker for {processes} x {threads} failed")
+    for worker in workers:
+        worker.join()
+    return processes * len(texts) / max(elapsed)
+
+
+def autotune(backend: str, texts: List[str], cache_path: Optional[str] = None) -> Tuple[int, int]:
+    """Fastest (processes, threads) layout for this machine on a sample of abstracts.
+    With cache_path the result is stored per machine type and reused."""
+    key = f"{machine_type()} {backend}"
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if key in cache:
+            logger.info(f"Using cached layout for {key}: {cache[key]['layout']}")
+            return tuple(cache[key]["layout"])
+
+    rates = {}
+    for processes, threads in candidate_layouts(len(available_cores())):
+        rates[(processes, threads)] = measure_layout(backend, texts, processes, threads)
+        logger.info(f"Layout {processes} processes x {threads} threads: {rates[(processes, threads)]:.0f} docs/sec")
+    best = max(rates, key=rates.get)
+    logger.info(f"Autotuned layout for {key}: {best[0]} processes x {best[1]} threads")
+
+    if cache_path:
+        cache[key] = {"layout": list(best),
+                      "docs_per_sec": {f"{p}x{t}": rate for (p, t), rate in rates.items()}}
+        with open(cache_path, "w") as f:
+            json.dump(cache, f, indent=2)
+    return best
+
+
+def _queue_worker(cores, threads, backend, queue_kwargs, files_in_flight):
+    _pin(cores, threads)
+    processor = _build_processor(backend, threads)
+    work_queue = processor.work_queue(**queue_kwargs)
+    logger.info(f"Worker {work_queue.worker_id} on cores {cores} with {threads} threads")
+    work_queue.run(processor.process_file, num_threads=files_in_flight)
+    failed = work_queue.failed()
+    if failed:
+        logger.error(f"Worker {work_queue.worker_id} could not process {len(failed)} files: {failed}")
+        # run_pool raises on the non-zero exit code
+        sys.exit(1)
+
+
+def run_pool(backend: str, processes: int, threads: int, queue_kwargs: dict, files_in_flight: int = 1):
+    """Drain the work queue with `processes` pinned workers, each with its own model
+    and `threads` intra-op threads. Every process leases files on its own, so they
+    share the queue with each other and with other tasks."""
+    base_id = queue_kwargs.get("worker_id")
+    workers = []
+    for index, cores in enumerate(core_groups(processes, threads)):
+        kwargs = dict(queue_kwargs, worker_id=f"{base_id}-p{index}" if base_id else None)
+        worker = _ctx.Process(target=_queue_worker, args=(cores, threads, backend, kwargs, files_in_flight))
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    failed = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Worker processes {failed} exited with an error")
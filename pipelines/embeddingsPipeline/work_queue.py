@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PreconditionFailed(Exception):
+    """Another worker wrote the object between our read and our write."""
+
+
+class GCSObjectStore:
+    """Object primitives the work queue needs, on top of a GCS bucket.
+
+    Leases rely on generation preconditions: creating with if_generation_match=0 only
+    succeeds if the object does not exist, and overwriting with the generation we read
+    only succeeds if nobody took the lease over in between.
+    """
+
+    def __init__(self, client, bucket: str):
+        from google.api_core.exceptions import NotFound, PreconditionFailed as GCSPreconditionFailed
+        self._not_found = NotFound
+        self._precondition_failed = GCSPreconditionFailed
+        self.bucket = client.bucket(bucket)
+
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        return [(blob.name, blob.size or 0) for blob in self.bucket.list_blobs(prefix=prefix)]
+
+    def read(self, name: str) -> Optional[Tuple[bytes, object]]:
+        """(data, generation), or None if the object does not exist."""
+        blob = self.bucket.blob(name)
+        try:
+            data = blob.download_as_bytes()
+        except self._not_found:
+            return None
+        return data, blob.generation
+
+    def write(self, name: str, data: bytes, generation=None):
+        """Create (generation=None) or replace the object at exactly `generation`.
+        Returns the new generation."""
+        blob = self.bucket.blob(name)
+        try:
+            blob.upload_from_string(data, if_generation_match=0 if generation is None else generation)
+        except self._precondition_failed as e:
+            raise PreconditionFailed(name) from e
+        return blob.generation
+
+    def delete(self, name: str, generation=None):
+        try:
+            self.bucket.blob(name).delete(if_generation_match=generation)
+        except (self._not_found, self._precondition_failed):
+            pass
+
+
+class LocalObjectStore:
+    """Directory-backed stand-in for GCSObjectStore, for tests and local runs.
+
+    Conditional writes are serialized with an flock on a lock file under the root, so
+    it is safe across threads and processes on one machine. The object's content is
+    its generation.
+    """
+
+    def __init__(self, root: str):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._lock_path = os.path.join(root, ".lock")
+        self._thread_lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _locked(self):
+        store = self
+
+        class _Lock:
+            def __enter__(self):
+                store._thread_lock.acquire()
+                self.f = open(store._lock_path, "a")
+                fcntl.flock(self.f, fcntl.LOCK_EX)
+
+            def __exit__(self, *exc):
+                fcntl.flock(self.f, fcntl.LOCK_UN)
+                self.f.close()
+                store._thread_lock.release()
+
+        return _Lock()
+
+    def list(self, prefix: str) -> List[Tuple[str, int]]:
+        objects = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if name.startswith(prefix) and name != ".lock":
+                    try:
+                        size = os.path.getsize(path)
+                    except FileNotFoundError:
+                        # released or replaced by another worker since the walk listed it
+                        continue
+                    objects.append((name, size))
+        return sorted(objects)
+
+    def read(self, name: str) -> Optional[Tuple[bytes, object]]:
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return data, data
+
+    def write(self, name: str, data: bytes, generation=None):
+        path = self._path(name)
+        with self._locked():
+            current = self.read(name)
+            if (current is not None) if generation is None else (current is None or current[1] != generation):
+                raise PreconditionFailed(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return data
+
+    def delete(self, name: str, generation=None):
+        with self._locked():
+            current = self.read(name)
+            if current is not None and (generation is None or current[1] == generation):
+                os.unlink(self._path(name))
+
+
+@dataclass
+class WorkItem:
+    file_id: str
+    path: str
+    size: int
+    generation: object = None
+
+
+class WorkQueue:
+    """Dynamic work queue over the input files, shared by any number of workers.
+
+    A worker claims files by writing an expiring lease object next to the `.done`
+    markers; a background heartbeat keeps its leases alive while it works. If a worker
+    dies its leases run out and the files go back to the queue. Claims take the largest
+    unclaimed files first, up to `claim_bytes` at a time, so every worker gets a similar
+    number of bytes and the big files do not all land at the end. Workers keep pulling
+    until every file has a done marker.
+    """
+
+    def __init__(self, store, inputs: Dict[str, Tuple[str, int]], state_prefix: str,
+                 worker_id: Optional[str] = None, lease_seconds: float = 600.0,
+                 claim_bytes: int = 256 * 1024 * 1024, poll_seconds: float = 15.0):
+        # inputs: {file_id: (path, size in bytes)}
+        self.store = store
+        self.inputs = inputs
+        self.lease_prefix = f"{state_prefix}leases/"
+        self.marker_prefix = f"{state_prefix}markers/"
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.claim_bytes = claim_bytes
+        self.poll_seconds = poll_seconds
+
+        self._held: Dict[str, WorkItem] = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _ids(self, prefix: str, suffix: str) -> set:
+        return {name[len(prefix):-len(suffix)] for name, _ in self.store.list(prefix) if name.endswith(suffix)}
+
+    def _lease_name(self, file_id: str) -> str:
+        return f"{self.lease_prefix}{file_id}.lease"
+
+    def _lease_body(self) -> bytes:
+        return json.dumps({"worker": self.worker_id, "expires_at": time.time() + self.lease_seconds,
+                           "nonce": uuid.uuid4().hex}).encode("utf-8")
+
+    def pending(self) -> List[str]:
+        """File ids without a done marker, largest first."""
+        done = self._ids(self.marker_prefix, ".done")
+        return sorted((f for f in self.inputs if f not in done), key=lambda f: (-self.inputs[f][1], f))
+
+    def _try_lease(self, file_id: str) -> Optional[WorkItem]:
+        name = self._lease_name(file_id)
+        current = self.store.read(name)
+        generation = None
+        if current is not None:
+            data, generation = current
+            try:
+                lease = json.loads(data)
+            except ValueError:
+                lease = {}
+            if lease.get("expires_at", 0) > time.time():
+                return None
+            logger.warning(f"Lease on {file_id} held by {lease.get('worker')} expired, re-queuing it")
+        try:
+            generation = self.store.write(name, self._lease_body(), generation=generation)
+        except PreconditionFailed:
+            return None
+        if self.store.read(f"{self.marker_prefix}{file_id}.done") is not None:
+            # finished and released since we listed the markers
+            self.store.delete(name, generation=generation)
+            return None
+        path, size = self.inputs[file_id]
+        return WorkItem(file_id, path, size, generation)
+
+    def claim(self, skip: frozenset = frozenset()) -> List[WorkItem]:
+        """Lease the largest unclaimed files up to claim_bytes (always at least one).
+        An empty list means nothing is claimable right now."""
+        claimed, total = [], 0
+        leased = self._ids(self.lease_prefix, ".lease")
+        pending = [f for f in self.pending() if f not in skip]
+        # unleased files first, then ones whose lease might have expired
+        for file_id in sorted(pending, key=lambda f: f in leased):
+            size = self.inputs[file_id][1]
+            if claimed and total + size > self.claim_bytes:
+                continue
+            item = self._try_lease(file_id)
+            if item is None:
+                continue
+            claimed.append(item)
+            total += size
+            if total >= self.claim_bytes:
+                break
+        with self._lock:
+            self._held.update({item.file_id: item for item in claimed})
+        return claimed
+
+    def renew(self):
+        with self._lock:
+            items = list(self._held.values())
+        for item in items:
+            try:
+                generation = self.store.write(self._lease_name(item.file_id), self._lease_body(),
+                                              generation=item.generation)
+            except PreconditionFailed:
+                generation = None
+            with self._lock:
+                if item.file_id not in self._held:
+                    continue
+                if generation is None:
+                    # another worker took it over, our output will simply be overwritten
+                    logger.warning(f"Lost lease on {item.file_id}")
+                    del self._held[item.file_id]
+                else:
+                    item.generation = generation
+
+    def release(self, item: WorkItem):
+        with self._lock:
+            held = self._held.pop(item.file_id, None)
+        if held is not None:
+            self.store.delete(self._lease_name(item.file_id), generation=held.generation)
+
+    def complete(self, item: WorkItem):
+        """Drop the lease once the file's done marker is written."""
+        self.release(item)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"Lease renewal failed: {e}")
+
+    def _worker_loop(self, process: Callable[[str], None]):
+        while True:
+            with self._lock:
+                failed = frozenset(self._failed)
+            items = self.claim(skip=failed)
+            if not items:
+                if not set(self.pending()) - failed:
+                    return
+                # the rest is leased by other workers, wait in case one of them dies
+                time.sleep(self.poll_seconds)
+                continue
+            for item in items:
+                try:
+                    process(item.path)
+                except Exception as e:
+                    # hand it back so another worker retries it, and do not pick it up again here
+                    logger.error(f"Failed to process {item.file_id} on {self.worker_id}: {e}")
+                    with self._lock:
+                        self._failed.add(item.file_id)
+                    self.release(item)
+                    continue
+                self.complete(item)
+
+    def failed(self) -> List[str]:
+        """Files that failed on this worker and still have no done marker. The queue
+        stops handing them to this worker, so once run() returns only a new attempt
+        (another task, or this one retried) can finish them."""
+        with self._lock:
+            failed = set(self._failed)
+        return [f for f in self.pending() if f in failed]
+
+    def run(self, process: Callable[[str], None], num_threads: int = 4):
+        """Run `process(path)` over the queue on num_threads threads until every file
+        is done or has failed here, see failed(). `process` is expected to write the
+        file's done marker."""
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                for future in [executor.submit(self._worker_loop, process) for _ in range(num_threads)]:
+                    future.result()
+        finally:
+            self._stop.set()
+            heartbeat.join()
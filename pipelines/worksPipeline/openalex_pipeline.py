@@ -1,8 +1,11 @@
 import apache_beam as beam
+from apache_beam.io.filesystems import FileSystems
 from apache_beam.options.pipeline_options import PipelineOptions
 import json
+import re
 import argparse
 import logging
+from collections import defaultdict
 
 class ProcessOpenAlexRecord(beam.DoFn):
     def process(self, in_json_string):
@@ -33,6 +36,8 @@ class ProcessOpenAlexRecord(beam.DoFn):
                 'doi': data.get('doi'),
                 'title': data.get('title'),
                 'created_date': data.get('created_date'),
+                'publication_year': data.get('publication_year'),
+                'updated_date': data.get('updated_date'),
                 'cited_by_count': data.get('cited_by_count'),
                 'abstract': self.reconstructAbstract(data.get('abstract_inverted_index')),
                 'related_works': data.get('related_works',[]),
@@ -78,6 +83,8 @@ BIGQUERY_SCHEMA = {
         {'name': 'cited_by_count', 'type': 'INTEGER', 'mode': 'NULLABLE'},
         {'name': 'cited_by_api_url', 'type': 'STRING', 'mode': 'NULLABLE'},
         {'name': 'created_date', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'publication_year', 'type': 'INTEGER', 'mode': 'NULLABLE'},
+        {'name': 'updated_date', 'type': 'STRING', 'mode': 'NULLABLE'},
         {'name': 'doi', 'type': 'STRING', 'mode': 'NULLABLE'},
         {'name': 'related_works', 'type': 'STRING', 'mode': 'REPEATED'},
         {'name': 'title', 'type': 'STRING', 'mode': 'NULLABLE'},
@@ -97,6 +104,114 @@ BIGQUERY_SCHEMA = {
     ]
 }
 
+PARTITION_RE = re.compile(r'updated_date=([^/]+)/')
+
+
+def list_partitions(snapshot_root):
+    """{updated_date partition: [file paths]} for every .gz file under the snapshot root."""
+    pattern = f"{snapshot_root.rstrip('/')}/updated_date=*/*.gz"
+    partitions = defaultdict(list)
+    for metadata in FileSystems.match([pattern])[0].metadata_list:
+        match = PARTITION_RE.search(metadata.path)
+        if match:
+            partitions[match.group(1)].append(metadata.path)
+    return {partition: sorted(files) for partition, files in partitions.items()}
+
+
+def load_watermark(path):
+    if not FileSystems.exists(path):
+        return {'partitions': {}}
+    with FileSystems.open(path) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def save_watermark(path, watermark):
+    with FileSystems.create(path, mime_type='application/json') as f:
+        f.write(json.dumps(watermark, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def pending_files(partitions, watermark):
+    """Files not yet ingested. The newest partition can still grow between
+    refreshes, so the watermark records files per partition, not just dates."""
+    ingested = watermark.get('partitions', {})
+    pending = {}
+    for partition, files in partitions.items():
+        done = set(ingested.get(partition, []))
+        new = [f for f in files if f not in done]
+        if new:
+            pending[partition] = new
+    return pending
+
+
+def _sql_table(table):
+    # Beam takes project:dataset.table, SQL wants project.dataset.table
+    return table.replace(':', '.')
+
+
+def _latest_rows(table):
+    # rows appended before updated_date was recorded all have NULL there (sorted last);
+    # citation counts only grow, so among those the most cited copy is the newest, and
+    # the row's own content breaks the remaining ties so reruns keep the same one
+    return f"""SELECT * EXCEPT(_rank) FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY paper_id
+                ORDER BY updated_date DESC, cited_by_count DESC, FARM_FINGERPRINT(TO_JSON_STRING(w))
+            ) AS _rank
+            FROM `{table}` AS w)
+        WHERE _rank = 1"""
+
+
+def add_columns(client, table):
+    """Add the columns later versions of the schema introduced to a table written by an
+    older one; a no-op on tables that have them."""
+    table = _sql_table(table)
+    client.query(f"ALTER TABLE `{table}` ADD COLUMN IF NOT EXISTS updated_date STRING").result()
+    client.query(f"ALTER TABLE `{table}` ADD COLUMN IF NOT EXISTS publication_year INT64").result()
+
+
+def dedupe_table(client, table):
+    """Rewrite a table keeping only the latest row per paper_id."""
+    table = _sql_table(table)
+    client.query(f"CREATE OR REPLACE TABLE `{table}` AS {_latest_rows(table)}").result()
+
+
+def merge_staging(client, staging_table, target_table, changed_table, changed_dois_uri=None):
+    """Upsert the staged records into the target by paper_id, latest updated_date wins,
+    and record the papers whose DOI or abstract is new or changed in changed_table."""
+    staging, target, changed = _sql_table(staging_table), _sql_table(target_table), _sql_table(changed_table)
+    columns = [field['name'] for field in BIGQUERY_SCHEMA['fields']]
+    latest = _latest_rows(staging)
+
+    add_columns(client, target)
+
+    # a staged record older than the stored one is not merged, so it must not count as changed either
+    newer = "(t.updated_date IS NULL OR s.updated_date >= t.updated_date)"
+    client.query(f"""CREATE OR REPLACE TABLE `{changed}` AS
+        SELECT DISTINCT s.paper_id, s.doi
+        FROM ({latest}) AS s
+        LEFT JOIN `{target}` AS t ON t.paper_id = s.paper_id
+        WHERE t.paper_id IS NULL
+            OR ({newer} AND (t.abstract IS DISTINCT FROM s.abstract OR t.doi IS DISTINCT FROM s.doi))""").result()
+
+    updates = ',\n                '.join(f"{c} = s.{c}" for c in columns)
+    client.query(f"""MERGE `{target}` AS t
+        USING ({latest}) AS s
+        ON t.paper_id = s.paper_id
+        WHEN MATCHED AND {newer} THEN
+            UPDATE SET
+                {updates}
+        WHEN NOT MATCHED THEN
+            INSERT ({', '.join(columns)})
+            VALUES ({', '.join(f's.{c}' for c in columns)})""").result()
+
+    if changed_dois_uri:
+        client.query(f"""EXPORT DATA OPTIONS (uri = '{changed_dois_uri}', format = 'CSV', overwrite = true) AS
+            SELECT doi FROM `{changed}` WHERE doi IS NOT NULL""").result()
+
+    rows = list(client.query(f"SELECT COUNT(*) AS n FROM `{changed}`").result())
+    return rows[0]['n'] if rows else 0
+
+
 def run():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -128,6 +243,33 @@ def run():
     parser.add_argument(
         '--runner',
         default='DataflowRunner')
+    parser.add_argument(
+        '--disk_size_gb',
+        default=50)
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='only ingest updated_date partitions/files not yet in the watermark, then upsert by paper_id')
+    parser.add_argument(
+        '--snapshot_root',
+        default='gs://paperrank/data/works')
+    parser.add_argument(
+        '--watermark_path',
+        default='gs://paperrank/state/works_watermark.json')
+    parser.add_argument(
+        '--staging_table',
+        help='table the delta is loaded into before the merge, defaults to <output table>_staging')
+    parser.add_argument(
+        '--changed_table',
+        help='table of paper_id/doi that are new or changed, defaults to <output table>_changed')
+    parser.add_argument(
+        '--changed_dois_uri',
+        default=None,
+        help='optional gs://.../changed-*.csv export of the changed DOIs for re-embedding')
+    parser.add_argument(
+        '--dedupe_target',
+        action='store_true',
+        help='first rewrite the output table keeping one row per paper_id')
 
     known_args, beam_args = parser.parse_known_args()
 
@@ -144,6 +286,10 @@ def run():
 
     pipeline_options = PipelineOptions(beam_pipeline_args)
 
+    if known_args.incremental:
+        run_incremental(known_args, pipeline_options)
+        return
+
     with beam.Pipeline(options=pipeline_options) as p:
         lines = p | 'ReadFromGCS' >> beam.io.ReadFromText(known_args.input_gcs_path)
 
@@ -154,9 +300,54 @@ def run():
             table=known_args.output_bigquery_table,
             schema=BIGQUERY_SCHEMA,
             create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
-            write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND
+            write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
+            additional_bq_parameters={'schemaUpdateOptions': ['ALLOW_FIELD_ADDITION']}
         )
 
+
+def run_incremental(known_args, pipeline_options):
+    from google.cloud import bigquery
+
+    target = known_args.output_bigquery_table
+    staging = known_args.staging_table or f"{target}_staging"
+    changed = known_args.changed_table or f"{target}_changed"
+    client = bigquery.Client(project=known_args.project)
+
+    if known_args.dedupe_target:
+        # the legacy appended table has no updated_date for the dedupe to order by yet
+        add_columns(client, target)
+        logging.info(f"Deduplicating {target} by paper_id")
+        dedupe_table(client, target)
+
+    watermark = load_watermark(known_args.watermark_path)
+    pending = pending_files(list_partitions(known_args.snapshot_root), watermark)
+    files = [f for partition in sorted(pending) for f in pending[partition]]
+    if not files:
+        logging.info("No new partitions to ingest")
+        return
+    logging.info(f"Ingesting {len(files)} files from {len(pending)} partitions: {sorted(pending)}")
+
+    with beam.Pipeline(options=pipeline_options) as p:
+        (p
+         | 'PendingFiles' >> beam.Create(files)
+         | 'ReadPendingFiles' >> beam.io.ReadAllFromText()
+         | 'ProcessRecords' >> beam.ParDo(ProcessOpenAlexRecord())
+         | 'WriteToStaging' >> beam.io.WriteToBigQuery(
+             table=staging,
+             schema=BIGQUERY_SCHEMA,
+             create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+             write_disposition=beam.io.BigQueryDisposition.WRITE_TRUNCATE))
+
+    n_changed = merge_staging(client, staging, target, changed, known_args.changed_dois_uri)
+    logging.info(f"Merged delta into {target}, {n_changed} papers new or changed (listed in {changed})")
+
+    # only advance the watermark once the merge has landed
+    for partition, new_files in pending.items():
+        done = watermark['partitions'].setdefault(partition, [])
+        done.extend(new_files)
+        done.sort()
+    save_watermark(known_args.watermark_path, watermark)
+
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.INFO)
     run()
\ No newline at end of file
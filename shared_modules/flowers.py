@@ -1,35 +1,51 @@
 
 
+import streamlit as st
+import plotly.graph_objects as go
 import networkx as nx
 import matplotlib.pyplot as plt
 import numpy as np
 # import model.py
 # from model.py import toVector, compute_similarity_score
 
-def display_influence_flower(paper_details):
+
+GROUP_STYLES = {
+    'core': ('Current Paper', 'rgba(175, 55, 202, 0.8)', 25),
+    'citing': ('Citing Paper', 'rgba(55, 175, 202, 0.8)', 15),
+    'cited': ('Cited Paper', 'rgba(255, 140, 0, 0.8)', 15),
+}
+
+
+def _petal_positions(count, start_angle, end_angle, radius=1.0):
+    if count == 0:
+        return []
+    angles = np.linspace(start_angle, end_angle, count + 2)[1:-1]
+    return [(radius * np.cos(a), radius * np.sin(a)) for a in angles]
+
+
+def display_influence_flower(paper_details, graph, max_petals=12):
+    """Draw the paper with the works citing it above and the works it cites below.
+
+    graph is the /citation_graph response for the paper.
+    """
     st.subheader(f"Influence Network for: {paper_details['Title']}")
 
-    # Create mock data for the graph
     nodes_data = [
-        {'id': 0, 'name': paper_details['Title'], 'label': 'Current Paper', 'group': 'core'},
+        {'id': 0, 'name': paper_details['Title'], 'group': 'core'},
     ]
-    edges_data = []
-
-    # Add mock papers
-    mock_papers = [
-        {'id': 1, 'name': 'Energy-Efficient Inference for CNNs', 'label': 'Citing Paper', 'group': 'citing'},
-        {'id': 2, 'name': 'Hardware Accelerators for Deep Learning', 'label': 'Citing Paper', 'group': 'citing'},
-        {'id': 3, 'name': 'Efficient Neural Network Architectures', 'label': 'Cited Paper', 'group': 'cited'},
-        {'id': 4, 'name': 'Survey of IoT and Machine Learning', 'label': 'Cited Paper', 'group': 'cited'},
-    ]
-    nodes_data.extend(mock_papers)
+    positions = [(0.0, 0.0)]
+
+    for group, works, (start, end) in [('citing', graph.get('cited_by', []), (0, np.pi)),
+                                       ('cited', graph.get('references', []), (np.pi, 2 * np.pi))]:
+        works = works[:max_petals]
+        for work, position in zip(works, _petal_positions(len(works), start, end)):
+            nodes_data.append({'id': len(nodes_data), 'name': work.get('title') or work['id'], 'group': group})
+            positions.append(position)
 
-    for mock_paper in mock_papers:
-        edges_data.append({'source': 0, 'target': mock_paper['id']})
+    edges_data = [{'source': 0, 'target': node['id']} for node in nodes_data[1:]]
 
-    # Prepare data for Plotly
-    node_x = [0, 1, -1, 0.5, -0.5]
-    node_y = [0, 1, 1, -1, -1]
+    node_x = [x for x, _ in positions]
+    node_y = [y for _, y in positions]
     
     edge_x = []
     edge_y = []
@@ -57,14 +73,14 @@ def display_influence_flower(paper_details):
         name='Papers',
         marker=dict(
             symbol='circle',
-            size=[25, 15, 15, 15, 15],
-            color=['rgba(175, 55, 202, 0.8)', 'rgba(55, 175, 202, 0.8)', 'rgba(55, 175, 202, 0.8)', 'rgba(255, 140, 0, 0.8)', 'rgba(255, 140, 0, 0.8)']
+            size=[GROUP_STYLES[node['group']][2] for node in nodes_data],
+            color=[GROUP_STYLES[node['group']][1] for node in nodes_data]
         ),
         text=[node['name'] for node in nodes_data],
         textposition='top center',
         textfont=dict(size=10),
         hovertemplate='<b>%{text}</b><br><i>%{customdata}</i><extra></extra>',
-        customdata=[node['label'] for node in nodes_data]
+        customdata=[GROUP_STYLES[node['group']][0] for node in nodes_data]
     ))
     
     # Configure the plot layout
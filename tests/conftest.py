@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the pipelines and the backend are flat script directories that import their modules by bare name
+for path in (ROOT, os.path.join(ROOT, "pipelines", "embeddingsPipeline"),
+             os.path.join(ROOT, "pipelines", "worksPipeline"), os.path.join(ROOT, "backend")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,27 @@
+import numpy as np
+
+from benchmarks.bench_filters import ArrayStore
+from db.ann import IVFIndex
+
+
+def test_build_writes_list_ordered_vectors_to_disk(tmp_path):
+    rng = np.random.default_rng(0)
+    store = ArrayStore(rng.standard_normal((3000, 16)).astype(np.float32))
+    out = str(tmp_path / "ivf")
+
+    in_memory = IVFIndex.build(store, n_iter=5)
+    on_disk = IVFIndex.build(store, n_iter=5, out=out)
+    assert isinstance(on_disk.vectors, np.memmap)
+    np.testing.assert_array_equal(on_disk.rows, in_memory.rows)
+    np.testing.assert_allclose(on_disk.vectors, in_memory.vectors)
+
+    on_disk.save(out)
+    loaded = IVFIndex.load(out, store)
+    np.testing.assert_allclose(loaded.vectors, in_memory.vectors)
+    expected = store.vectors[loaded.rows]
+    np.testing.assert_allclose(loaded.vectors, expected / np.linalg.norm(expected, axis=1, keepdims=True),
+                               atol=1e-6)
+
+    query = store.vectors[3]
+    for a, b in zip(loaded.search(query, top_k=10, exclude=3), in_memory.search(query, top_k=10, exclude=3)):
+        np.testing.assert_allclose(a, b)
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+
+from benchmarks.fixtures import Corpus, FakeBigQueryClient
+from db import async_query, query
+
+
+class RecordingClient(FakeBigQueryClient):
+    """Notes the thread every query runs on."""
+
+    def __init__(self, corpus):
+        super().__init__(corpus)
+        self.threads = []
+
+    def query(self, sql, job_config=None):
+        self.threads.append(threading.current_thread().name)
+        return super().query(sql, job_config)
+
+
+class FakeIndex:
+    def __init__(self, dois):
+        self.dois = dois
+        self.threads = []
+
+    def search_doi(self, doi, top_k=10, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        return [(n, 0.1 * i) for i, n in enumerate(d for d in self.dois if d != doi)][:top_k]
+
+
+@pytest.fixture
+def corpus():
+    return Corpus(size=50, seed=1)
+
+
+@pytest.fixture
+def client(corpus, monkeypatch):
+    client = RecordingClient(corpus)
+    monkeypatch.setattr(query, "_client", None)
+    query.set_client(client)
+    return client
+
+
+def test_async_entry_points_run_on_the_bigquery_pool(corpus, client):
+    work = corpus.works[3]
+    bare_doi = work["doi"].replace("https://doi.org/", "")
+
+    async def run():
+        return await asyncio.gather(
+            async_query.doiEnteredAsync(bare_doi, fields=["title"]),
+            async_query.vectorSearchAsync(work["doi"], top_k=5, backend="bigquery"),
+            async_query.vectorSearchBatchAsync([work["doi"], corpus.works[4]["doi"]], top_k=5, backend="bigquery"),
+            async_query.abstractsByDoiAsync([work["doi"]]),
+            async_query.worksByOpenAlexIdAsync([work["id"].rsplit("/", 1)[-1]]),
+        )
+
+    details, papers, batch, abstracts, works = asyncio.run(run())
+    assert details == {"title": work["title"]}
+    assert 0 < len(papers) <= 5 and all(p["doi"] != work["doi"] for p in papers)
+    assert set(batch) == {work["doi"], corpus.works[4]["doi"]}
+    assert abstracts == {work["doi"]: work["abstract"]}
+    assert works[work["id"].rsplit("/", 1)[-1]]["publication_year"] == work["publication_year"]
+    assert client.threads and all(name.startswith("bigquery") for name in client.threads)
+
+
+def test_local_index_search_runs_on_the_cpu_pool(corpus, client, monkeypatch):
+    index = FakeIndex([w["doi"] for w in corpus.works])
+    monkeypatch.setattr(query, "_get_local_index", lambda: index)
+    doi = corpus.works[0]["doi"]
+
+    papers = asyncio.run(async_query.vectorSearchAsync(doi, top_k=3, backend="local"))
+    assert [p["doi"] for p in papers] == [w["doi"] for w in corpus.works[1:4]]
+    assert index.threads[0].startswith("local-search")
+    # the works are still read on the BigQuery pool
+    assert client.threads and all(name.startswith("bigquery") for name in client.threads)
+    assert query.get_cpu_executor()._max_workers == query.LOCAL_SEARCH_THREADS
+
+
+def test_new_client_uses_a_pooled_session(monkeypatch):
+    import google.auth
+    from google.auth.credentials import AnonymousCredentials
+
+    monkeypatch.setattr(google.auth, "default", lambda scopes=None: (AnonymousCredentials(), "test-project"))
+    client = query._new_client()
+    adapter = client._http.get_adapter("https://bigquery.googleapis.com")
+    assert adapter._pool_maxsize == query.BIGQUERY_MAX_CONCURRENCY
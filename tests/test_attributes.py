@@ -0,0 +1,33 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db.attributes import AttributeIndex, SearchFilter, build
+from db.embedding_store import EmbeddingStore, compact
+
+
+def test_build_takes_years_from_publication_year(tmp_path):
+    dois = [f"https://doi.org/10.1/{i}" for i in range(4)]
+    embeddings = pa.array(np.eye(4, dtype=np.float32).tolist(), type=pa.list_(pa.float32(), 4))
+    (tmp_path / "shards").mkdir()
+    pq.write_table(pa.table({"doi": dois, "embedding": embeddings}), str(tmp_path / "shards" / "0.parquet"))
+    compact(str(tmp_path / "shards"), str(tmp_path / "store"))
+
+    (tmp_path / "works").mkdir()
+    pq.write_table(pa.table({
+        "doi": dois,
+        # created_date is when OpenAlex made the record, not when the work came out
+        "created_date": ["2023-05-01", "2023-05-01", "2016-01-01", None],
+        # rows merged before the column existed have no publication_year yet
+        "publication_year": pa.array([1998, 2005, None, None], type=pa.int64()),
+        "cited_by_count": [1, 2, 3, 4],
+        "oa_status": ["gold", "green", "gold", None],
+    }), str(tmp_path / "works" / "0.parquet"))
+    build(str(tmp_path / "works"), str(tmp_path / "store"), str(tmp_path / "attributes"))
+
+    store = EmbeddingStore(str(tmp_path / "store"))
+    index = AttributeIndex(str(tmp_path / "attributes"), store)
+    rows = lambda filters: sorted(store.doi_at(int(r)) for r in index.select(filters).to_rows())
+    assert rows(SearchFilter(year_to=2000)) == [dois[0]]
+    assert rows(SearchFilter(year_from=2005, year_to=2016)) == [dois[1], dois[2]]
+    assert rows(SearchFilter(year_from=2023)) == []
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from db.cache import AsyncCache, TTLCache
+
+
+def _cache():
+    return AsyncCache(TTLCache(maxsize=16, ttl=60))
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def run():
+        cache, release, calls = _cache(), asyncio.Event(), []
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return "value"
+
+        leader = asyncio.create_task(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await waiter == "value"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return cache, calls
+
+    cache, calls = asyncio.run(run())
+    assert calls == [1]
+    assert cache.cache.get("k") == "value"
+    assert cache.stats()["in_flight"] == 0 and cache.coalesced == 1
+
+
+def test_load_finishes_and_is_cached_after_every_caller_left():
+    async def run():
+        cache, release = _cache(), asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return "value"
+
+        caller = asyncio.create_task(cache.get_or_load("k", loader))
+        await asyncio.sleep(0)
+        caller.cancel()
+        release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return cache
+
+    cache = asyncio.run(run())
+    assert cache.cache.get("k") == "value"
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    async def run():
+        cache, release = _cache(), asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            raise RuntimeError("backend down")
+
+        callers = [asyncio.create_task(cache.get_or_load("k", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert await cache.get_or_load("k", _value) == "fresh"
+
+    async def _value():
+        return "fresh"
+
+    asyncio.run(run())
+
+
+def test_get_many_loads_misses_in_one_batch_and_coalesces_with_get_or_load():
+    async def run():
+        cache, release, batches = _cache(), asyncio.Event(), []
+        cache.cache.set("a", "cached")
+
+        async def load_many(keys):
+            batches.append(sorted(keys))
+            await release.wait()
+            return {key: key.upper() for key in keys if key != "missing"}
+
+        async def single():
+            raise AssertionError("should join the batch")
+
+        many = asyncio.create_task(cache.get_many(["a", "b", "c", "b", "missing"], load_many))
+        await asyncio.sleep(0)
+        joined = asyncio.create_task(cache.get_or_load("b", single))
+        again = asyncio.create_task(cache.get_many(["c", "d"], load_many))
+        await asyncio.sleep(0)
+        assert cache.stats()["in_flight"] == 4
+        release.set()
+
+        assert await many == {"a": "cached", "b": "B", "c": "C", "missing": None}
+        assert await joined == "B"
+        assert await again == {"c": "C", "d": "D"}
+        return cache, batches
+
+    cache, batches = asyncio.run(run())
+    assert batches == [["b", "c", "missing"], ["d"]]
+    assert cache.coalesced == 2
+    assert cache.stats()["in_flight"] == 0
+    assert cache.cache.get("c") == "C" and cache.cache.get("missing") is None
+
+
+def test_get_many_failure_is_not_cached():
+    async def run():
+        cache = _cache()
+
+        async def failing(keys):
+            raise RuntimeError("backend down")
+
+        async def working(keys):
+            return {key: "fresh" for key in keys}
+
+        with pytest.raises(RuntimeError):
+            await cache.get_many(["a", "b"], failing)
+        assert cache.stats()["in_flight"] == 0
+        assert await cache.get_many(["a", "b"], working) == {"a": "fresh", "b": "fresh"}
+
+    asyncio.run(run())
@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.mark.parametrize("query", ["hops=0", "hops=3", "limit=0", "limit=100000", "limit=ten"])
+def test_citation_graph_rejects_out_of_range_parameters(query):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+    import main
+
+    response = TestClient(main.app).get(f"/citation_graph/W1?{query}")
+    assert response.status_code == 422
+
+
+def test_citation_graph_runs_on_the_cpu_pool(monkeypatch):
+    pytest.importorskip("fastapi")
+    import threading
+    from fastapi.testclient import TestClient
+    import main
+
+    threads = []
+
+    class FakeGraph:
+        def neighbourhood(self, work_id, hops=1, limit=25):
+            threads.append(threading.current_thread().name)
+            return {"work_id": work_id, "cites": [], "cited_by": []}
+
+        def co_cited(self, work_id, limit=25):
+            return []
+
+        def bibliographically_coupled(self, work_id, limit=25):
+            return []
+
+    monkeypatch.setattr(main, "get_citation_graph", FakeGraph)
+    response = TestClient(main.app).get("/citation_graph/W1")
+    assert response.status_code == 200, response.text
+    assert threads and threads[0].startswith("local-search")
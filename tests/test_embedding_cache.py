@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+
+def test_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", 128, dim=4, shards=2)
+    keys = cache.keys(["an abstract", "another  abstract", "an  abstract"])
+    assert keys[0] == keys[2]
+
+    cache.store(keys[:2], np.arange(8, dtype=np.float32).reshape(2, 4))
+    embeddings, found = cache.lookup(keys + cache.keys(["unseen"]))
+    assert found.tolist() == [True, True, True, False]
+    np.testing.assert_array_equal(embeddings[2], [0, 1, 2, 3])
+
+
+@pytest.mark.parametrize("fs_type", ["nfs4", "fuse.gcsfuse", "cifs"])
+def test_rejects_network_filesystems(tmp_path, monkeypatch, fs_type):
+    monkeypatch.setattr(embedding_cache, "_filesystem_type", lambda path: fs_type)
+    with pytest.raises(ValueError, match=fs_type):
+        EmbeddingCache(str(tmp_path), "model", 128, dim=4)
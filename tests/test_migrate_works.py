@@ -0,0 +1,33 @@
+from db import migrate_works
+
+
+class RecordingClient:
+    def __init__(self):
+        self.statements = []
+
+    def query(self, sql):
+        self.statements.append(sql)
+        return self
+
+    def result(self):
+        return []
+
+
+def test_adds_the_read_columns_to_every_works_table():
+    client = RecordingClient()
+    migrate_works.migrate(client)
+    for table in ("EWORKS", "EWORKS_TEST"):
+        for column in ("updated_date STRING", "publication_year INT64"):
+            assert f"ALTER TABLE `hazel-quanta-470113-h4.openAlexDataset.{table}` ADD COLUMN IF NOT EXISTS {column}" \
+                in client.statements
+    assert len(client.statements) == 4
+
+
+def test_covers_every_works_table_the_backend_reads():
+    import re
+    from db import query
+
+    with open(query.__file__) as f:
+        read = set(re.findall(r"`(hazel-quanta-470113-h4\.openAlexDataset\.EWORKS\w*)`", f.read()))
+    # worksByOpenAlexId reads EWORKS, the searches EWORKS_TEST
+    assert read == set(migrate_works.WORKS_TABLES)
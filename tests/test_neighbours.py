@@ -0,0 +1,60 @@
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from db import neighbours
+from db.ann import IVFIndex, SearchAfter
+from db.embedding_store import EmbeddingStore, compact
+
+
+def _store(path, n=300, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    shards = os.path.join(path, "shards")
+    os.makedirs(shards)
+    pq.write_table(pa.table({"doi": [f"https://doi.org/10.1/{i:04d}" for i in range(n)],
+                             "embedding": pa.array(vectors.tolist(), type=pa.list_(pa.float32(), dim))}),
+                   os.path.join(shards, "0.parquet"))
+    compact(shards, os.path.join(path, "store"))
+    return os.path.join(path, "store")
+
+
+@pytest.fixture(scope="module")
+def table_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("neighbours"))
+    store_path = _store(path)
+    neighbours.build(store_path, os.path.join(path, "table"), k=20, workers=1)
+    return path
+
+
+def test_pages_continue_into_the_live_search(table_dir):
+    store = EmbeddingStore(os.path.join(table_dir, "store"))
+    table = neighbours.NeighbourTable(os.path.join(table_dir, "table"), store)
+    # a single list is an exhaustive search, which the table's rows are exact for
+    live = IVFIndex.build(store, n_lists=1)
+    doi = store.doi_at(5)
+
+    first = table.lookup(doi, top_k=10)
+    assert first == live.search_doi(doi, top_k=10)
+
+    last_doi, last_distance = first[-1]
+    after = SearchAfter(last_distance, store.row_of(last_doi), 10)
+    # the table covers the second page, and the live search it would fall back to agrees
+    assert table.lookup(doi, top_k=10, after=after) == live.search_doi(doi, top_k=10, after=after)
+    # past the precomputed neighbours the table hands over to the live search
+    assert table.lookup(doi, top_k=15, after=after) is None
+
+
+def test_rejects_a_different_store_with_the_same_size(table_dir, tmp_path):
+    other = EmbeddingStore(_store(str(tmp_path), seed=1))
+    with pytest.raises(ValueError, match="different embedding store"):
+        neighbours.NeighbourTable(os.path.join(table_dir, "table"), other)
+
+    meta_path = os.path.join(table_dir, "table", "meta.json")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    assert meta["store_fingerprint"] == EmbeddingStore(os.path.join(table_dir, "store")).fingerprint
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("onnxruntime")
+
+import onnx_backend
+
+
+def test_truncated_graph_is_not_reused_or_left_behind(tmp_path):
+    path = str(tmp_path / "model.onnx")
+    with open(path, "wb") as f:
+        f.write(b"truncated")
+    assert not onnx_backend._valid_graph(path)
+
+    def write_garbage(tmp):
+        with open(tmp, "wb") as f:
+            f.write(b"not a graph")
+
+    with pytest.raises(RuntimeError):
+        onnx_backend._write_graph(path, write_garbage)
+    # the old file is untouched and no temporary file is left
+    assert os.listdir(tmp_path) == ["model.onnx"]
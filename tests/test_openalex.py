@@ -0,0 +1,129 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from db.cache import TTLCache
+from db.openalex import RelatedWorksHydrator
+
+
+class StubOpenAlex:
+    """Local HTTP server answering GET /works?filter=openalex_id:a|b like the API.
+    Ids in `statuses` make the batch holding them fail with that status."""
+
+    def __init__(self, works, delay: float = 0.0):
+        self.works = works
+        self.delay = delay
+        self.statuses = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                ids = parse_qs(urlparse(self.path).query)["filter"][0].split(":", 1)[1].split("|")
+                with stub._lock:
+                    stub.requests.append(ids)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.delay)
+                    status = next((stub.statuses[i] for i in ids if i in stub.statuses), 200)
+                    body = {"results": [stub.works[i] for i in ids if i in stub.works]} if status == 200 else {}
+                    payload = json.dumps(body).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _works(n):
+    return {f"W{i}": {"id": f"https://openalex.org/W{i}", "doi": f"https://doi.org/10.1/{i}",
+                      "title": f"Work {i}", "publication_year": 2000 + i % 20} for i in range(n)}
+
+
+def _hydrate(hydrator, ids):
+    async def run():
+        try:
+            return await hydrator.hydrate(ids)
+        finally:
+            await hydrator.close()
+    return asyncio.run(run())
+
+
+def test_requests_are_batched():
+    works = _works(120)
+    with StubOpenAlex(works) as stub:
+        hydrator = RelatedWorksHydrator(base_url=stub.url, batch_size=50)
+        details = _hydrate(hydrator, [f"https://openalex.org/W{i}" for i in range(120)])
+
+    assert sorted(len(ids) for ids in stub.requests) == [20, 50, 50]
+    assert sorted(i for ids in stub.requests for i in ids) == sorted(works)
+    # results come back in input order with the selected fields
+    assert [d["title"] for d in details] == [f"Work {i}" for i in range(120)]
+    assert details[3] == {"title": "Work 3", "doi": "https://doi.org/10.1/3", "publication_year": 2003}
+
+
+def test_concurrency_is_bounded_by_the_semaphore():
+    with StubOpenAlex(_works(12), delay=0.05) as stub:
+        hydrator = RelatedWorksHydrator(base_url=stub.url, batch_size=1, max_concurrency=3)
+        details = _hydrate(hydrator, [f"W{i}" for i in range(12)])
+
+    assert len(details) == 12
+    assert len(stub.requests) == 12
+    assert stub.max_in_flight == 3
+
+
+def test_works_are_cached_per_id():
+    with StubOpenAlex(_works(10)) as stub:
+        hydrator = RelatedWorksHydrator(base_url=stub.url, batch_size=50, cache=TTLCache(maxsize=100, ttl=60))
+        _hydrate(hydrator, ["W1", "W2", "W404"])
+        details = _hydrate(hydrator, ["W2", "W3", "W404", "W1"])
+
+    # only W3 is new: W1 and W2 are cached, and W404, which OpenAlex did not return, is cached as empty
+    assert stub.requests == [["W1", "W2", "W404"], ["W3"]]
+    assert [d["title"] for d in details] == ["Work 2", "Work 3", "Work 1"]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_failed_batches_are_skipped_and_not_cached(status):
+    with StubOpenAlex(_works(6)) as stub:
+        stub.statuses = {"W0": status}
+        hydrator = RelatedWorksHydrator(base_url=stub.url, batch_size=3)
+        details = _hydrate(hydrator, [f"W{i}" for i in range(6)])
+
+        # the failed batch is left out instead of failing the whole hydration
+        assert [d["title"] for d in details] == ["Work 3", "Work 4", "Work 5"]
+
+        stub.statuses = {}
+        details = _hydrate(hydrator, [f"W{i}" for i in range(6)])
+
+    assert stub.requests[-1] == ["W0", "W1", "W2"]
+    assert [d["title"] for d in details] == [f"Work {i}" for i in range(6)]
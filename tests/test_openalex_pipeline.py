@@ -0,0 +1,100 @@
+import argparse
+
+import pytest
+
+pytest.importorskip("apache_beam")
+
+import openalex_pipeline
+
+
+class _Job:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return self.rows
+
+
+class RecordingClient:
+    """Stands in for bigquery.Client, keeping every statement it is sent."""
+
+    def __init__(self, *args, **kwargs):
+        self.statements = []
+
+    def query(self, sql, *args, **kwargs):
+        self.statements.append(" ".join(sql.split()))
+        return _Job([{"n": 3}] if sql.startswith("SELECT COUNT") else [])
+
+
+def test_dedupe_adds_the_missing_columns_first(tmp_path, monkeypatch):
+    from google.cloud import bigquery
+
+    client = RecordingClient()
+    monkeypatch.setattr(bigquery, "Client", lambda *args, **kwargs: client)
+    args = argparse.Namespace(output_bigquery_table="proj:works.EWORKS", staging_table=None, changed_table=None,
+                              project="proj", dedupe_target=True, snapshot_root=str(tmp_path),
+                              watermark_path=str(tmp_path / "watermark.json"), changed_dois_uri=None)
+    openalex_pipeline.run_incremental(args, None)
+
+    assert [s.split(" ADD COLUMN")[0] for s in client.statements[:2]] == ["ALTER TABLE `proj.works.EWORKS`"] * 2
+    assert "updated_date STRING" in client.statements[0] and "publication_year INT64" in client.statements[1]
+    dedupe = client.statements[2]
+    assert dedupe.startswith("CREATE OR REPLACE TABLE `proj.works.EWORKS`")
+    assert "ORDER BY updated_date DESC, cited_by_count DESC, FARM_FINGERPRINT(TO_JSON_STRING(w))" in dedupe
+
+
+def test_pending_files_picks_up_a_partition_that_grew():
+    watermark = {"partitions": {"2024-06-01": ["a/part_000.gz"], "2024-06-02": ["b/part_000.gz"]}}
+    partitions = {
+        "2024-06-01": ["a/part_000.gz"],
+        # the newest partition gained a file since the last run
+        "2024-06-02": ["b/part_000.gz", "b/part_001.gz"],
+        "2024-06-03": ["c/part_000.gz"],
+    }
+    assert openalex_pipeline.pending_files(partitions, watermark) == {
+        "2024-06-02": ["b/part_001.gz"],
+        "2024-06-03": ["c/part_000.gz"],
+    }
+
+
+def test_pending_files_skips_ingested_files():
+    partitions = {"2024-06-01": ["a/part_000.gz", "a/part_001.gz"]}
+    assert openalex_pipeline.pending_files(partitions, {"partitions": dict(partitions)}) == {}
+    assert openalex_pipeline.pending_files(partitions, {"partitions": {}}) == partitions
+    assert openalex_pipeline.pending_files({}, {"partitions": {}}) == {}
+
+
+def test_watermark_round_trip(tmp_path):
+    path = str(tmp_path / "watermark.json")
+    assert openalex_pipeline.load_watermark(path) == {"partitions": {}}
+    watermark = {"partitions": {"2024-06-01": ["a/part_000.gz"]}}
+    openalex_pipeline.save_watermark(path, watermark)
+    assert openalex_pipeline.load_watermark(path) == watermark
+
+
+def test_merge_staging_statements():
+    client = RecordingClient()
+    n = openalex_pipeline.merge_staging(client, "proj:works.staging", "proj:works.EWORKS", "proj:works.changed",
+                                        changed_dois_uri="gs://bucket/changed-*.csv")
+    assert n == 3
+
+    kinds = [s.split(" `")[0] for s in client.statements]
+    assert kinds == ["ALTER TABLE", "ALTER TABLE", "CREATE OR REPLACE TABLE", "MERGE",
+                     "EXPORT DATA OPTIONS (uri = 'gs://bucket/changed-*.csv', format = 'CSV', overwrite = true) AS "
+                     "SELECT doi FROM", "SELECT COUNT(*) AS n FROM"]
+    _, _, changed, merge, export, count = client.statements
+
+    newer = "(t.updated_date IS NULL OR s.updated_date >= t.updated_date)"
+    # the changed set only counts rows the MERGE applies: new ones, or newer ones that differ
+    assert changed.startswith("CREATE OR REPLACE TABLE `proj.works.changed`")
+    assert f"WHERE t.paper_id IS NULL OR ({newer} AND (t.abstract IS DISTINCT FROM s.abstract" in changed
+    assert f"WHEN MATCHED AND {newer} THEN UPDATE SET" in merge
+    assert "FROM `proj.works.staging`" in changed and "FROM `proj.works.staging`" in merge
+    assert "WHEN NOT MATCHED THEN INSERT (" in merge and "publication_year" in merge
+    assert "`proj.works.changed`" in export and "`proj.works.changed`" in count
+
+
+def test_merge_staging_without_export():
+    client = RecordingClient()
+    openalex_pipeline.merge_staging(client, "p:d.s", "p:d.t", "p:d.c")
+    assert not any(s.startswith("EXPORT DATA") for s in client.statements)
@@ -0,0 +1,23 @@
+import pytest
+
+
+def test_doi_spellings_share_one_cache_entry(monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+    import main
+
+    calls = []
+
+    async def lookup(doi, fields=None):
+        calls.append(doi)
+        return {"title": "Attention", "paper_id": "W1"}
+
+    monkeypatch.setattr(main, "doiEnteredAsync", lookup)
+    monkeypatch.setattr(main, "paper_cache", main._new_cache())
+    client = TestClient(main.app)
+    for doi in ("10.1/abc", "doi.org/10.1/abc", "https://doi.org/10.1/abc"):
+        response = client.get(f"/paper_details/{doi}", params={"fields": "title"})
+        assert response.status_code == 200
+        assert response.json()["paper"] == {"title": "Attention"}
+
+    assert calls == ["10.1/abc"]
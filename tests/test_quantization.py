@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_filters import ArrayStore
+from db.ann import IVFIndex
+from db.bitmap import Bitmap
+from db.quantization import CompressedIndex, ProductQuantizer
+
+
+def _vectors(n=2000, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_product_quantizer_trains_on_fewer_rows_than_centroids():
+    sample = _vectors(n=100)
+    quantizer = ProductQuantizer.train(sample, m=4, n_iter=2)
+    assert quantizer.codebooks.shape == (4, 100, 8)
+    assert quantizer.encode(sample).max() < 100
+
+    with pytest.raises(ValueError):
+        ProductQuantizer.train(sample[:0], m=4)
+
+
+def test_compressed_index_needs_no_ivf_vectors(tmp_path):
+    store = ArrayStore(_vectors())
+    ivf = IVFIndex.build(store, n_iter=5)
+    ivf.save(str(tmp_path / "ivf"))
+    CompressedIndex.build(ivf, kind="pq", m=8, n_iter=5).save(str(tmp_path / "pq"))
+
+    coarse = IVFIndex.load(str(tmp_path / "ivf"), store, vectors=False)
+    assert coarse.vectors is None
+    index = CompressedIndex.load(str(tmp_path / "pq"), coarse)
+    query = store.vectors[7]
+
+    rows, distances = index.search(query, top_k=10, nprobe=4, exclude=7)
+    assert len(rows) == 10 and 7 not in rows
+    exact = 1.0 - store.vectors[rows] @ query
+    np.testing.assert_allclose(distances, exact, atol=1e-5)
+
+    # small enough for the exact filtered scan, which reads the store
+    allowed = Bitmap.from_rows(np.arange(0, 2000, 50))
+    rows, distances = index.search(query, top_k=5, nprobe=4, allowed=allowed)
+    truth = np.argsort(1.0 - store.vectors[allowed.to_rows()] @ query)[:5]
+    assert rows.tolist() == allowed.to_rows()[truth].tolist()
+
+    assert index.nbytes == (index.codes.nbytes + index.quantizer.codebooks.nbytes + coarse.centroids.nbytes
+                            + coarse.offsets.nbytes + coarse.rows.nbytes)
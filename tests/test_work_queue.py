@@ -0,0 +1,99 @@
+import threading
+import time
+
+from work_queue import LocalObjectStore, WorkQueue
+
+STATE = "state/"
+
+
+def _inputs(n=20):
+    return {f"file{i:02d}": (f"input/file{i:02d}.jsonl.gz", 1000 + i) for i in range(n)}
+
+
+def _processor(store, processed, lock):
+    """process(path) that writes a create-only output and the done marker, like the pipeline."""
+    def process(path):
+        file_id = path.rsplit("/", 1)[-1].split(".")[0]
+        with lock:
+            processed.append(file_id)
+        store.write(f"output/{file_id}.parquet", file_id.encode("utf-8"))
+        store.write(f"{STATE}markers/{file_id}.done", b"")
+    return process
+
+
+def test_each_file_claimed_once(tmp_path):
+    store = LocalObjectStore(str(tmp_path))
+    inputs = _inputs()
+    processed, lock = [], threading.Lock()
+    queue = WorkQueue(store, inputs, STATE, claim_bytes=1, poll_seconds=0.01)
+
+    queue.run(_processor(store, processed, lock), num_threads=3)
+
+    assert sorted(processed) == sorted(inputs)
+    assert queue.pending() == []
+    assert store.list(f"{STATE}leases/") == []
+
+
+def test_expired_lease_is_requeued_after_worker_dies(tmp_path):
+    store = LocalObjectStore(str(tmp_path))
+    inputs = _inputs(4)
+    dead = WorkQueue(store, inputs, STATE, worker_id="dead", lease_seconds=0.3, claim_bytes=1 << 30)
+    claimed = dead.claim()
+    assert sorted(item.file_id for item in claimed) == sorted(inputs)
+
+    # the dead worker never renews or releases, its leases keep others out until they expire
+    survivor = WorkQueue(store, inputs, STATE, worker_id="survivor", claim_bytes=1 << 30, poll_seconds=0.05)
+    assert survivor.claim() == []
+
+    processed, lock = [], threading.Lock()
+    time.sleep(0.35)
+    survivor.run(_processor(store, processed, lock), num_threads=2)
+
+    assert sorted(processed) == sorted(inputs)
+    assert survivor.pending() == []
+
+
+def test_concurrent_workers_write_no_duplicate_outputs(tmp_path):
+    store = LocalObjectStore(str(tmp_path))
+    inputs = _inputs(30)
+    processed, lock = [], threading.Lock()
+    # a second write of the same output fails its create-only precondition, so a file
+    # processed twice would show up twice in `processed`
+    process = _processor(store, processed, lock)
+
+    def worker(name):
+        WorkQueue(store, inputs, STATE, worker_id=name, claim_bytes=2000, poll_seconds=0.01).run(process, num_threads=3)
+
+    workers = [threading.Thread(target=worker, args=(f"worker{i}",)) for i in range(3)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert sorted(processed) == sorted(inputs)
+    assert [name for name, _ in store.list("output/")] == [f"output/{f}.parquet" for f in sorted(inputs)]
+
+
+def test_file_failing_on_every_thread_is_reported(tmp_path):
+    store = LocalObjectStore(str(tmp_path))
+    inputs = _inputs(5)
+    processed, lock = [], threading.Lock()
+    process = _processor(store, processed, lock)
+
+    def flaky(path):
+        if "file02" in path:
+            raise ValueError("corrupt input")
+        process(path)
+
+    queue = WorkQueue(store, inputs, STATE, claim_bytes=1, poll_seconds=0.01)
+    queue.run(flaky, num_threads=3)
+
+    assert queue.failed() == ["file02"]
+    assert queue.pending() == ["file02"]
+    assert store.list(f"{STATE}leases/") == []
+
+    # a retried task starts with a clean slate and finishes it
+    retry = WorkQueue(store, inputs, STATE, claim_bytes=1, poll_seconds=0.01)
+    retry.run(process, num_threads=3)
+    assert retry.failed() == []
+    assert retry.pending() == []